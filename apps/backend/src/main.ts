@@ -65,6 +65,9 @@ app.use(
     credentials: true,
   }),
 );
+// Hubs upload sensor reading chunks gzip-compressed (Content-Encoding: gzip), which express.json() inflates.
+// Registered before the global parser so these uploads get a larger limit (applied to the inflated body).
+app.use('/api/hubs/pushSensorReadings', express.json({ inflate: true, limit: '2mb' }));
 app.use(express.json());
 app.use(cookieParser());
 
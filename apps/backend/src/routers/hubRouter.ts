@@ -79,6 +79,19 @@ router.get('/getHubDataTransmissionRate/:identifierNumber', async (req, res) =>
   }
 });
 
+router.get('/getHubPollingConfig/:identifierNumber', async (req, res) => {
+  try {
+    const pollingConfig = await HubService.getHubPollingConfig(req.params.identifierNumber);
+    res.status(200).json(pollingConfig);
+  } catch (error) {
+    if (error instanceof HubNotFoundError) {
+      res.status(404).json({ error: error.message });
+    } else {
+      res.status(400).json({ error: error.message });
+    }
+  }
+});
+
 router.get('/getAllSensorsByHubId/:hubId', async (req, res) => {
   try {
     const sensors = await HubService.getAllSensorsByHubId(req.params.hubId);
@@ -1,5 +1,12 @@
 import { z } from 'zod';
-import { HubStatusEnum } from '@prisma/client';
+import { HubStatusEnum, SensorTypeEnum } from '@prisma/client';
+
+// Polling interval bounds used by the raspberry pi for one sensor type
+export const HubPollingIntervalSchema = z.object({
+  minIntervalSeconds: z.number().min(1).optional(),
+  maxIntervalSeconds: z.number().min(1).optional(),
+  changeThreshold: z.number().min(0).optional(),
+});
 
 export const HubSchema = z.object({
   id: z.string().uuid().optional(),
@@ -12,6 +19,7 @@ export const HubSchema = z.object({
   nextMaintenanceDate: z.date().optional(),
   nextMaintenanceDates: z.array(z.date()).optional(),
   dataTransmissionInterval: z.number().min(0).optional(),
+  pollingConfig: z.record(z.nativeEnum(SensorTypeEnum), HubPollingIntervalSchema).optional(),
   supplier: z.string().min(1, { message: 'Supplier is required' }),
   supplierContactNumber: z.string().min(1, { message: 'Supplier contact number is required' }),
   ipAddress: z.string().optional(),
@@ -28,3 +36,4 @@ export const HubSchema = z.object({
 });
 
 export type HubSchemaType = z.infer<typeof HubSchema>;
+export type HubPollingIntervalSchemaType = z.infer<typeof HubPollingIntervalSchema>;
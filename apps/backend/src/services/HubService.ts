@@ -1,7 +1,7 @@
 import aws from 'aws-sdk';
-import { HubSchemaType, HubSchema } from '../schemas/hubSchema';
+import { HubSchemaType, HubSchema, HubPollingIntervalSchemaType } from '../schemas/hubSchema';
 import HubDao from '../dao/HubDao';
-import { Prisma, Hub, Facility, Sensor, HubStatusEnum } from '@prisma/client';
+import { Prisma, Hub, Facility, Sensor, HubStatusEnum, SensorTypeEnum } from '@prisma/client';
 import { z } from 'zod';
 import FacilityDao from '../dao/FacilityDao';
 import ParkDao from '../dao/ParkDao';
@@ -33,6 +33,16 @@ const dateFormatter = (data: any) => {
   return formattedData;
 };
 
+// Default polling interval bounds per sensor type, used by the raspberry pi unless the hub's pollingConfig overrides them.
+// changeThreshold is the reading spread below which a sensor is considered stable and polled less often.
+const DEFAULT_POLLING_INTERVALS: Record<SensorTypeEnum, Required<HubPollingIntervalSchemaType>> = {
+  TEMPERATURE: { minIntervalSeconds: 5, maxIntervalSeconds: 60, changeThreshold: 0.3 },
+  HUMIDITY: { minIntervalSeconds: 5, maxIntervalSeconds: 60, changeThreshold: 1 },
+  SOIL_MOISTURE: { minIntervalSeconds: 10, maxIntervalSeconds: 300, changeThreshold: 5 },
+  LIGHT: { minIntervalSeconds: 5, maxIntervalSeconds: 30, changeThreshold: 5 },
+  CAMERA: { minIntervalSeconds: 5, maxIntervalSeconds: 5, changeThreshold: 0 },
+};
+
 export class HubNotFoundError extends Error {
   constructor(message: string) {
     super(message);
@@ -147,6 +157,31 @@ class HubService {
     return hub?.dataTransmissionInterval || null;
   }
 
+  // used by raspberry pi to get the polling interval bounds of each of its sensors
+  public async getHubPollingConfig(identifierNumber: string): Promise<{
+    sensorTypes: Record<string, SensorTypeEnum>;
+    pollingIntervals: Record<SensorTypeEnum, Required<HubPollingIntervalSchemaType>>;
+  }> {
+    const hub = await HubDao.getHubByIdentifierNumber(identifierNumber);
+    if (!hub) {
+      throw new HubNotFoundError('Hub not found');
+    }
+
+    const overrides = (hub.pollingConfig ?? {}) as Partial<Record<SensorTypeEnum, HubPollingIntervalSchemaType>>;
+    const pollingIntervals = {} as Record<SensorTypeEnum, Required<HubPollingIntervalSchemaType>>;
+    for (const sensorType of Object.values(SensorTypeEnum)) {
+      pollingIntervals[sensorType] = { ...DEFAULT_POLLING_INTERVALS[sensorType], ...overrides[sensorType] };
+    }
+
+    const sensors = await HubDao.getAllActiveSensorsByHubId(hub.id);
+    const sensorTypes: Record<string, SensorTypeEnum> = {};
+    for (const sensor of sensors) {
+      sensorTypes[sensor.identifierNumber] = sensor.sensorType;
+    }
+
+    return { sensorTypes, pollingIntervals };
+  }
+
   public async updateHubDetails(id: string, data: Partial<HubSchemaType>): Promise<Hub> {
     try {
       const formattedData = dateFormatter(data);
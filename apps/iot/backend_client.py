@@ -0,0 +1,130 @@
+import random
+import statistics
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+# Default connect and read timeouts of backend requests, in seconds
+CONNECT_TIMEOUT_SECONDS = 3.05
+READ_TIMEOUT_SECONDS = 10
+# Number of times a request is retried after a connection error, a timeout or one of RETRY_STATUS_CODES
+RETRIES = 3
+# Retries wait a random time between 0 and BACKOFF_SECONDS * 2^attempt (at most MAX_BACKOFF_SECONDS), so hubs that lost
+# the backend at the same time do not all retry at once
+BACKOFF_SECONDS = 0.5
+MAX_BACKOFF_SECONDS = 8
+RETRY_STATUS_CODES = {502, 503, 504}
+# Number of recent response times kept for the stats
+RESPONSE_TIME_SAMPLES = 200
+
+# HTTP client for every hub <-> backend call. One requests.Session keeps the TCP connections to the backend alive
+# between calls, so a push over a slow Wi-Fi link does not pay for a new connection every time.
+class BackendClient:
+    def __init__(self, base_url, connect_timeout=CONNECT_TIMEOUT_SECONDS, read_timeout=READ_TIMEOUT_SECONDS,
+                 retries=RETRIES, backoff_seconds=BACKOFF_SECONDS, max_backoff_seconds=MAX_BACKOFF_SECONDS, pool_size=4):
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.session = requests.Session()
+        # Retries are done here (with jitter) rather than by urllib3
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.request_count = 0
+        self.retry_count = 0
+        self.failure_count = 0
+        self.response_times = deque(maxlen=RESPONSE_TIME_SAMPLES)
+        self.last_response_time = None
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.backoff_seconds * 2 ** attempt, self.max_backoff_seconds))
+
+    # Send a request to base_url + path. Returns the last response, or raises the last error if no response came back.
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            response, error = None, None
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.base_url + path, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            elapsed = time.perf_counter() - started
+            self.request_count += 1
+            if response is not None:
+                self.last_response_time = elapsed
+                self.response_times.append(elapsed)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    return response
+            if attempt < self.retries:
+                delay = self.backoff(attempt)
+                print(f"Backend {method} {path} failed ({error or response.status_code}), retrying in {delay:.1f}s")
+                self.retry_count += 1
+                time.sleep(delay)
+        self.failure_count += 1
+        if response is not None:
+            return response
+        raise error
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    # Request counts and response time percentiles (in milliseconds) of the recent requests
+    def stats(self):
+        times = sorted(self.response_times)
+        return {
+            "requests": self.request_count,
+            "retries": self.retry_count,
+            "failures": self.failure_count,
+            "response_p50_ms": round(statistics.median(times) * 1000, 1) if times else None,
+            "response_p95_ms": round(times[min(int(0.95 * len(times)), len(times) - 1)] * 1000, 1) if times else None,
+        }
+
+    def close(self):
+        self.session.close()
+
+# After this many consecutive failed uploads the circuit opens: the backend is treated as offline and only probed
+# once per cooldown, which doubles (with jitter) every time a probe fails, up to BREAKER_MAX_COOLDOWN_SECONDS
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_BASE_COOLDOWN_SECONDS = 5
+BREAKER_MAX_COOLDOWN_SECONDS = 300
+
+# Exponential backoff with a circuit breaker for work that depends on the backend being reachable
+class CircuitBreaker:
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, base_cooldown_seconds=BREAKER_BASE_COOLDOWN_SECONDS,
+                 max_cooldown_seconds=BREAKER_MAX_COOLDOWN_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown_seconds = base_cooldown_seconds
+        self.max_cooldown_seconds = max_cooldown_seconds
+        self.clock = clock
+        self.failures = 0  # consecutive failures
+        self.retry_at = 0
+
+    # "closed" (working), "open" (backend offline, waiting for the cooldown) or "half-open" (next attempt is a probe)
+    @property
+    def state(self):
+        if self.failures < self.failure_threshold:
+            return "closed"
+        return "open" if self.clock() < self.retry_at else "half-open"
+
+    # Seconds to wait before the next attempt
+    def retry_delay(self):
+        return max(self.retry_at - self.clock(), 0)
+
+    def record_success(self):
+        self.failures = 0
+        self.retry_at = 0
+
+    def record_failure(self):
+        self.failures += 1
+        cooldown = min(self.base_cooldown_seconds * 2 ** (self.failures - 1), self.max_cooldown_seconds)
+        self.retry_at = self.clock() + random.uniform(cooldown / 2, cooldown)
@@ -0,0 +1,310 @@
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Stands in for the Node backend (apps/backend) on the routes a hub calls, with the same request and response shapes:
+#   PUT  /api/hubs/verifyHubInitialization                      {"identifierNumber"} -> {"token"}
+#   POST /api/hubs/pushSensorReadings/<hubIdentifierNumber>     {"jsonPayloadString", "sha256"} (optionally gzip) -> {"sensors", "radioGroup"}
+#   GET  /api/hubs/getHubDataTransmissionRate/<hubIdentifierNumber> -> number of polls between pushes, or null
+#   GET  /api/hubs/getHubPollingConfig/<hubIdentifierNumber>    -> {"sensorTypes", "pollingIntervals"}
+# pushSensorReadings checks sha256(jsonPayloadString + hub secret) like HubService.validatePayload. Errors are answered
+# like the backend's routers, with {"error": message} and status 400 (404 for an unknown hub on verifyHubInitialization
+# and getHubPollingConfig).
+# Latency, errors and timeouts can be injected to test the hub's retries and backoff.
+
+# Readings whose end-to-end latency is kept for the stats
+LATENCY_SAMPLES = 100000
+# Status code of injected errors, one that BackendClient retries
+INJECTED_ERROR_STATUS = 503
+ROUTES = [
+    ("PUT", re.compile(r"^/api/hubs/verifyHubInitialization/?$"), "verify_hub_initialization"),
+    ("POST", re.compile(r"^/api/hubs/pushSensorReadings/([^/]+)/?$"), "push_sensor_readings"),
+    ("GET", re.compile(r"^/api/hubs/getHubDataTransmissionRate/([^/]+)/?$"), "get_hub_data_transmission_rate"),
+    ("GET", re.compile(r"^/api/hubs/getHubPollingConfig/([^/]+)/?$"), "get_hub_polling_config"),
+]
+# Same as HubService's DEFAULT_POLLING_INTERVALS; a hub's polling config overrides them per sensor type
+DEFAULT_POLLING_INTERVALS = {
+    "TEMPERATURE": {"minIntervalSeconds": 5, "maxIntervalSeconds": 60, "changeThreshold": 0.3},
+    "HUMIDITY": {"minIntervalSeconds": 5, "maxIntervalSeconds": 60, "changeThreshold": 1},
+    "SOIL_MOISTURE": {"minIntervalSeconds": 10, "maxIntervalSeconds": 300, "changeThreshold": 5},
+    "LIGHT": {"minIntervalSeconds": 5, "maxIntervalSeconds": 30, "changeThreshold": 5},
+    "CAMERA": {"minIntervalSeconds": 5, "maxIntervalSeconds": 5, "changeThreshold": 0},
+}
+# Sensor types given to a hub's sensors in turn, in the order microbit_simulator.py gives them to its simulated sensors
+SENSOR_TYPE_CYCLE = ("TEMPERATURE", "LIGHT", "SOIL_MOISTURE", "HUMIDITY")
+
+class BackendError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class SimulatedHub:
+    def __init__(self, identifier, sensors, radio_group, transmission_rate, sensor_types=None, polling_config=None):
+        self.identifier = identifier
+        self.sensors = list(sensors)
+        self.radio_group = radio_group
+        self.transmission_rate = transmission_rate
+        self.sensor_types = sensor_types or {sensor: SENSOR_TYPE_CYCLE[i % len(SENSOR_TYPE_CYCLE)] for i, sensor in enumerate(self.sensors)}
+        self.polling_config = polling_config or dict()  # sensor type -> interval overrides, like the hub's pollingConfig
+        self.secret = None
+        self.last_reading_dates = dict()  # sensorIdentifier -> newest readingDate received, to spot re-sent readings
+
+class BackendSimulator:
+    # hubs maps hub identifiers to their sensor identifiers. With auto_register, unknown hubs are created on
+    # verifyHubInitialization with default_sensors. latency (+ a random jitter) is added to every request; error_rate of
+    # the requests get INJECTED_ERROR_STATUS instead of an answer, and timeout_rate of them are answered only after
+    # timeout_seconds (the request is still processed, like a backend whose response is lost). polling_config overrides
+    # the polling intervals of every hub per sensor type, e.g. {"LIGHT": {"minIntervalSeconds": 10}}.
+    def __init__(self, hubs=None, default_sensors=(), auto_register=True, radio_group=None, transmission_rate=5,
+                 latency=0.0, jitter=0.0, error_rate=0.0, timeout_rate=0.0, timeout_seconds=15.0, seed=None,
+                 clock=time.time, quiet=True, polling_config=None):
+        self.rng = random.Random(seed)
+        self.default_sensors = list(default_sensors)
+        self.auto_register = auto_register
+        self.radio_group = radio_group
+        self.transmission_rate = transmission_rate
+        self.polling_config = polling_config
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.clock = clock
+        self.quiet = quiet
+        self.lock = threading.Lock()
+        self.hubs = dict()
+        for identifier, sensors in (hubs or dict()).items():
+            self.add_hub(identifier, sensors)
+        self.server = None
+        self.thread = None
+        self.request_count = 0
+        self.injected_errors = 0
+        self.injected_timeouts = 0
+        self.digest_failures = 0
+        self.rejected_pushes = 0
+        self.readings_received = 0
+        self.duplicate_readings = 0
+        self.bytes_received = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)  # milliseconds from readingDate to the push being accepted
+
+    # sensor_types maps the sensors to their types (cycled through SENSOR_TYPE_CYCLE if None)
+    def add_hub(self, identifier, sensors, radio_group=None, transmission_rate=None, sensor_types=None):
+        if radio_group is None:
+            radio_group = self.radio_group if self.radio_group is not None else self.rng.randrange(255)
+        hub = SimulatedHub(identifier, sensors, radio_group, transmission_rate if transmission_rate is not None else self.transmission_rate,
+                           sensor_types, self.polling_config)
+        with self.lock:
+            self.hubs[identifier] = hub
+        return hub
+
+    # Serve on host:port (port 0 picks a free port) from a background thread. Returns the base URL of the API.
+    def start(self, host="127.0.0.1", port=0):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like express
+            disable_nagle_algorithm = True  # like node; otherwise every response waits for a delayed ACK
+
+            def do_GET(self):
+                simulator.handle(self, "GET")
+
+            def do_PUT(self):
+                simulator.handle(self, "PUT")
+
+            def do_POST(self):
+                simulator.handle(self, "POST")
+
+            def log_message(self, format, *args):
+                if not simulator.quiet:
+                    super().log_message(format, *args)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return f"http://{host}:{self.server.server_address[1]}/api"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def handle(self, request, method):
+        with self.lock:
+            self.request_count += 1
+        body = request.rfile.read(int(request.headers.get("content-length") or 0))
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            with self.lock:
+                self.injected_errors += 1
+            return self.respond(request, INJECTED_ERROR_STATUS, {"error": "Injected error"})
+        timed_out = self.timeout_rate and self.rng.random() < self.timeout_rate
+
+        path = request.path.split("?")[0]
+        for route_method, pattern, handler_name in ROUTES:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            return self.respond(request, 404, {"error": f"Cannot {method} {path}"})
+        try:
+            body_bytes = len(body)  # as sent over the network
+            if request.headers.get("content-encoding", "").lower() == "gzip":
+                body = gzip.decompress(body)
+            data = json.loads(body) if body else dict()
+            status, response = 200, getattr(self, handler_name)(data, *match.groups(), body_bytes)
+        except BackendError as e:
+            status, response = e.status, {"error": str(e)}
+        except (ValueError, OSError) as e:
+            status, response = 400, {"error": str(e)}
+
+        if timed_out:
+            with self.lock:
+                self.injected_timeouts += 1
+            time.sleep(self.timeout_seconds)
+        self.respond(request, status, response)
+
+    def respond(self, request, status, response):
+        data = json.dumps(response).encode()
+        try:
+            request.send_response(status)
+            request.send_header("content-type", "application/json; charset=utf-8")
+            request.send_header("content-length", str(len(data)))
+            request.end_headers()
+            request.wfile.write(data)
+        except OSError:
+            pass  # the hub gave up on the request
+
+    def get_hub(self, identifier, message, status=400):
+        with self.lock:
+            hub = self.hubs.get(identifier)
+        if hub is None:
+            raise BackendError(message, status)
+        return hub
+
+    def verify_hub_initialization(self, data, body_bytes):
+        identifier = data.get("identifierNumber")
+        with self.lock:
+            hub = self.hubs.get(identifier)
+        if hub is None:
+            if not self.auto_register or not identifier:
+                raise BackendError("Hub not found", 404)
+            hub = self.add_hub(identifier, self.default_sensors)
+        # Same format as HubService.generateHubSecret
+        hub.secret = "".join(self.rng.choice("0123456789abcdefghijklmnopqrstuvwxyz") for _ in range(16))
+        return {"token": hub.secret}
+
+    def push_sensor_readings(self, data, hub_identifier, body_bytes):
+        hub = self.get_hub(hub_identifier, f"Hub with identifier number {hub_identifier} not found")
+        if not hub.secret:
+            raise BackendError(f"Hub secret not set for hub with identifier number {hub_identifier}")
+        payload_string = data.get("jsonPayloadString")
+        if not isinstance(payload_string, str):
+            raise BackendError("jsonPayloadString is required")
+        if hashlib.sha256((payload_string + hub.secret).encode()).hexdigest() != data.get("sha256"):
+            with self.lock:
+                self.digest_failures += 1
+            raise BackendError("JSON validation failed. Digest does not match!")
+        payload = json.loads(payload_string)
+        if any(sensor not in hub.sensors for sensor in payload):
+            with self.lock:
+                self.rejected_pushes += 1
+            raise BackendError("Sensor not found")
+
+        now = self.clock() * 1000
+        with self.lock:
+            self.bytes_received += body_bytes
+            for sensor, readings in payload.items():
+                last_reading_date = hub.last_reading_dates.get(sensor)
+                for reading in readings:
+                    reading_date = reading["readingDate"]
+                    self.readings_received += 1
+                    if last_reading_date is not None and reading_date <= last_reading_date:
+                        self.duplicate_readings += 1
+                        continue
+                    last_reading_date = reading_date
+                    self.latencies.append(now - reading_date)
+                hub.last_reading_dates[sensor] = last_reading_date
+        return {"sensors": hub.sensors, "radioGroup": hub.radio_group}
+
+    def get_hub_data_transmission_rate(self, data, hub_identifier, body_bytes):
+        with self.lock:
+            hub = self.hubs.get(hub_identifier)
+        return hub.transmission_rate if hub is not None else None
+
+    def get_hub_polling_config(self, data, hub_identifier, body_bytes):
+        hub = self.get_hub(hub_identifier, "Hub not found", 404)
+        polling_intervals = {sensor_type: {**intervals, **hub.polling_config.get(sensor_type, dict())}
+                             for sensor_type, intervals in DEFAULT_POLLING_INTERVALS.items()}
+        return {"sensorTypes": {sensor: hub.sensor_types[sensor] for sensor in hub.sensors if sensor in hub.sensor_types},
+                "pollingIntervals": polling_intervals}
+
+    # Request counts, injected faults, readings received and end-to-end latency percentiles in milliseconds
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                "requests": self.request_count,
+                "injected_errors": self.injected_errors,
+                "injected_timeouts": self.injected_timeouts,
+                "digest_failures": self.digest_failures,
+                "rejected_pushes": self.rejected_pushes,
+                "readings_received": self.readings_received,
+                "duplicate_readings": self.duplicate_readings,
+                "bytes_received": self.bytes_received,
+            }
+        for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+            stats[f"latency_{name}_ms"] = round(latencies[min(int(fraction * len(latencies)), len(latencies) - 1)], 1) if latencies else None
+        stats["latency_max_ms"] = round(latencies[-1], 1) if latencies else None
+        return stats
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the backend routes a hub calls, to run hub.py without the Node backend.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--host', default="0.0.0.0", help='Address to listen on.')
+    parser.add_argument('--port', type=int, default=3333, help='Port to listen on (BACKEND_PORT of the hub).')
+    parser.add_argument('--sensors', type=int, default=10, help='Number of sensors of every hub (SE-10000, SE-10001, ...), like microbit_simulator.py.')
+    parser.add_argument('--sensorIdentifiers', default=None, help='Comma separated sensor identifiers (overrides --sensors).')
+    parser.add_argument('--radioGroup', type=int, default=None, help='Radio group of every hub (random by default).')
+    parser.add_argument('--transmissionRate', type=int, default=5, help='Polls between pushes returned by getHubDataTransmissionRate.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every request.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Maximum random seconds added on top of --latency.')
+    parser.add_argument('--errorRate', type=float, default=0.0, help=f'Probability that a request gets a {INJECTED_ERROR_STATUS} error.')
+    parser.add_argument('--timeoutRate', type=float, default=0.0, help='Probability that a response is held back for --timeoutSeconds.')
+    parser.add_argument('--timeoutSeconds', type=float, default=15.0, help='How long a timed out response is held back.')
+    parser.add_argument('--pollingConfig', type=json.loads, default=None,
+                        help='Polling interval overrides per sensor type returned by getHubPollingConfig, as JSON, e.g. \'{"LIGHT": {"minIntervalSeconds": 10}}\'.')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed.')
+    parser.add_argument('--verbose', action='store_true', help='Log every request.')
+    args = parser.parse_args()
+
+    sensors = args.sensorIdentifiers.split(",") if args.sensorIdentifiers else [f"SE-{10000 + i}" for i in range(args.sensors)]
+    simulator = BackendSimulator(default_sensors=sensors, radio_group=args.radioGroup, transmission_rate=args.transmissionRate,
+                                 latency=args.latency, jitter=args.jitter, error_rate=args.errorRate, timeout_rate=args.timeoutRate,
+                                 timeout_seconds=args.timeoutSeconds, seed=args.seed, quiet=not args.verbose,
+                                 polling_config=args.pollingConfig)
+    base_url = simulator.start(args.host, args.port)
+    print(f"Simulated backend listening on {base_url} (set BACKEND_IP and BACKEND_PORT={args.port} on the hub)")
+    print("Sensors: " + ",".join(sensors))
+    try:
+        while True:
+            time.sleep(60)
+            print(simulator.stats())
+    except KeyboardInterrupt:
+        print(simulator.stats())
+    finally:
+        simulator.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+
+from backend_simulator import BackendSimulator
+
+# Runs the hub pipeline (sqlite writer, backend uploader and database maintenance of hub.HubRuntime) against
+# backend_simulator.py for hours of simulated time. A virtual gateway hands the runtime one poll result per poll interval
+# in place of the serial poll cycles. Reports end-to-end reading latency (readingDate to the backend accepting the push),
+# rows/sec, database size growth and memory, to catch regressions in the upload path.
+# Simulated time runs --speedup times faster than real time. Latencies are in simulated time, so time spent in the hub
+# and the backend is magnified by --speedup as well; chunk_upload_*_ms are real times.
+# Usage: python3 benchmark_hub_pipeline.py [--hours 6] [--sensors 20] [--speedup 300] [--errorRate 0.05]
+
+HUB_IDENTIFIER = "HB-BENCH"
+# Database size and memory are sampled this often, in simulated seconds
+SAMPLE_INTERVAL_SECONDS = 15 * 60
+
+class SimulatedClock:
+    def __init__(self, speedup):
+        self.speedup = speedup
+        self.started = time.time()
+
+    def now(self):
+        return self.started + (time.time() - self.started) * self.speedup
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds / self.speedup)
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def database_bytes(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else None
+
+def create_runtime_class(hub, storage):
+    # The hub runtime with the serial gateways replaced by a virtual one and database maintenance on simulated time
+    class BenchmarkRuntime(hub.HubRuntime):
+        def __init__(self, clock, retention_hours, *args):
+            super().__init__(*args)
+            self.clock = clock
+            self.retention_hours = retention_hours
+            self.chunk_upload_times = []
+            self.readings_inserted = 0
+
+        async def virtual_gateway(self, hours, poll_seconds, seed):
+            rng = random.Random(seed)
+            values = dict()
+            for _ in range(int(hours * 3600 / poll_seconds)):
+                await self.clock.sleep(poll_seconds)
+                reading_time = int(self.clock.now() * 1000)
+                sensor_values = dict()
+                for sensor in self.valid_sensors:
+                    values[sensor] = values.get(sensor, rng.uniform(0, 1000)) + rng.uniform(-2, 2)
+                    sensor_values[sensor] = {"time": reading_time, "reading": round(values[sensor], 2)}
+                self.readings_inserted += len(sensor_values)
+                await self.poll_results.put(sensor_values)
+
+        async def upload_chunk(self):
+            started = time.perf_counter()
+            drained = await super().upload_chunk()
+            self.chunk_upload_times.append(time.perf_counter() - started)
+            return drained
+
+        async def database_maintainer(self):
+            while True:
+                cutoff = int((self.clock.now() - self.retention_hours * 60 * 60) * 1000)
+                await self.run_db(storage.maintain_database, self.mydb, cutoff)
+                await self.clock.sleep(hub.DATABASE_MAINTENANCE_INTERVAL_SECONDS)
+
+        async def outbox_backlog(self):
+            return await self.run_db(lambda conn: conn.execute(
+                "SELECT COUNT(*) FROM readings WHERE readingId > ?", (storage.get_acked_rowid(conn),)).fetchone()[0], self.mydb)
+
+    return BenchmarkRuntime
+
+async def run_pipeline(runtime, database_path, hours, poll_seconds, seed, drain_timeout):
+    samples = []
+    tasks = [
+        asyncio.create_task(runtime.sqlite_writer()),
+        asyncio.create_task(runtime.backend_uploader()),
+        asyncio.create_task(runtime.database_maintainer()),
+    ]
+
+    async def sampler():
+        while True:
+            samples.append({
+                "simulated_hours": round((runtime.clock.now() - runtime.clock.started) / 3600, 2),
+                "database_bytes": await runtime.run_db(database_bytes, database_path),
+                "rss_bytes": rss_bytes(),
+            })
+            await runtime.clock.sleep(SAMPLE_INTERVAL_SECONDS)
+
+    tasks.append(asyncio.create_task(sampler()))
+    started = time.perf_counter()
+    try:
+        await runtime.virtual_gateway(hours, poll_seconds, seed)
+        # Push whatever is left and wait for the outbox to drain
+        drain_started = time.perf_counter()
+        while time.perf_counter() - drain_started < drain_timeout:
+            if not runtime.poll_results.qsize() and await runtime.outbox_backlog() == 0:
+                break
+            try:
+                runtime.upload_requests.put_nowait(None)
+            except asyncio.QueueFull:
+                pass
+            await asyncio.sleep(0.1)
+        return samples, time.perf_counter() - started
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+def benchmark(hours, sensors, speedup, poll_seconds, transmission_rate, latency, error_rate, timeout_rate, retention_hours,
+              json_backend, seed, quiet, drain_timeout=60):
+    import contextlib
+    import io
+
+    clock = SimulatedClock(speedup)
+    sensor_identifiers = [f"SE-{10000 + i}" for i in range(sensors)]
+    backend = BackendSimulator({HUB_IDENTIFIER: sensor_identifiers}, auto_register=False, transmission_rate=transmission_rate,
+                               latency=latency, error_rate=error_rate, timeout_rate=timeout_rate, timeout_seconds=2, seed=seed, clock=clock.now)
+    base_url = backend.start()
+    directory = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # hub.py reads its settings from the environment when it is imported
+    os.environ.update({
+        "HUB_IDENTIFIER_NO": HUB_IDENTIFIER,
+        "BACKEND_IP": "127.0.0.1",
+        "BACKEND_PORT": base_url.split(":")[-1].split("/")[0],
+        "COM_PORT": "",
+        "BACKEND_READ_TIMEOUT_SECONDS": "1",
+        "UPLOAD_JSON_BACKEND": json_backend,
+    })
+    os.chdir(directory)  # hub_state.json and processor.db go to the temporary directory
+    output = io.StringIO() if quiet else None
+    try:
+        import hub
+        import storage
+        database_path = os.path.join(directory, storage.DATABASE_PATH)
+        rss_started = rss_bytes()
+        cpu_started = time.process_time()
+        with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+            token = hub.initialize_connection_to_backend()
+            if token is None:
+                raise RuntimeError("The simulated backend did not return a token")
+            mydb = storage.open_database(database_path)
+            valid_sensors, radioGroup, polling_config = hub.get_initial_hub_state(token, mydb)
+            hub.get_data_transmission_rate()
+            runtime = create_runtime_class(hub, storage)(clock, retention_hours, token, mydb, valid_sensors, radioGroup, polling_config)
+            try:
+                samples, wall_time = asyncio.run(run_pipeline(runtime, database_path, hours, poll_seconds, seed, drain_timeout))
+                backlog = asyncio.run(runtime.outbox_backlog())
+            finally:
+                runtime.db_executor.shutdown(wait=True)
+                runtime.upload_executor.shutdown(wait=True)
+                mydb.close()
+        cpu_time = time.process_time() - cpu_started
+    finally:
+        os.chdir(cwd)
+        backend.stop()
+        shutil.rmtree(directory)
+
+    backend_stats = backend.stats()
+    uploads = runtime.chunk_upload_times
+    readings_acked = backend_stats["readings_received"] - backend_stats["duplicate_readings"]
+    growth = samples[-1]["database_bytes"] - samples[0]["database_bytes"] if len(samples) > 1 else 0
+    return {
+        "simulated_hours": hours,
+        "sensors": sensors,
+        "speedup": speedup,
+        "json_backend": json_backend,
+        "readings_inserted": runtime.readings_inserted,
+        "readings_acked": readings_acked,
+        "readings_not_uploaded": backlog,
+        "duplicate_readings": backend_stats["duplicate_readings"],
+        "rows_per_sec": round(readings_acked / wall_time, 1),
+        "latency_p50_s": round(backend_stats["latency_p50_ms"] / 1000, 1) if backend_stats["latency_p50_ms"] is not None else None,
+        "latency_p95_s": round(backend_stats["latency_p95_ms"] / 1000, 1) if backend_stats["latency_p95_ms"] is not None else None,
+        "latency_max_s": round(backend_stats["latency_max_ms"] / 1000, 1) if backend_stats["latency_max_ms"] is not None else None,
+        "chunk_uploads": len(uploads),
+        "chunk_upload_p50_ms": round(statistics.median(uploads) * 1000, 1) if uploads else None,
+        "chunk_upload_p95_ms": round(percentile(uploads, 0.95) * 1000, 1) if uploads else None,
+        "upload_bytes": backend_stats["bytes_received"],
+        "injected_errors": backend_stats["injected_errors"],
+        "injected_timeouts": backend_stats["injected_timeouts"],
+        "database_bytes": samples[-1]["database_bytes"] if samples else None,
+        "database_growth_bytes_per_hour": round(growth / max(samples[-1]["simulated_hours"] - samples[0]["simulated_hours"], 1e-9)) if len(samples) > 1 else None,
+        "rss_growth_mb": round((max(sample["rss_bytes"] for sample in samples) - rss_started) / 2 ** 20, 1) if samples else None,
+        "rss_peak_mb": round(max(sample["rss_bytes"] for sample in samples) / 2 ** 20, 1) if samples else None,
+        "hub_cpu_seconds": round(cpu_time, 2),
+        "wall_seconds": round(wall_time, 1),
+        "samples": samples,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--hours', type=float, default=6, help='Simulated hours to run the pipeline for.')
+    parser.add_argument('--sensors', type=int, default=20, help='Number of sensors on the hub.')
+    parser.add_argument('--speedup', type=float, default=300, help='How much faster than real time the simulation runs.')
+    parser.add_argument('--pollSeconds', type=float, default=5, help='Simulated seconds between poll cycles.')
+    parser.add_argument('--transmissionRate', type=int, default=5, help='Poll cycles between pushes to the backend.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the simulated backend adds to every request.')
+    parser.add_argument('--errorRate', type=float, default=0.0, help='Probability that a backend request fails.')
+    parser.add_argument('--timeoutRate', type=float, default=0.0, help='Probability that a backend response times out.')
+    parser.add_argument('--retentionHours', type=float, default=24, help='Hours uploaded raw readings are kept (RAW_RETENTION_HOURS).')
+    parser.add_argument('--jsonBackend', default="json", choices=["json", "orjson"], help='JSON backend of the upload encoder (UPLOAD_JSON_BACKEND).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the readings and the injected faults.')
+    parser.add_argument('--verbose', action='store_true', help='Show the hub output while benchmarking.')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON, including the size and memory samples.')
+    args = parser.parse_args()
+
+    result = benchmark(args.hours, args.sensors, args.speedup, args.pollSeconds, args.transmissionRate, args.latency, args.errorRate,
+                       args.timeoutRate, args.retentionHours, args.jsonBackend, args.seed, not args.verbose)
+    if args.json:
+        print(json.dumps(result))
+    else:
+        result.pop("samples")
+        print(", ".join(f"{key}={value}" for key, value in result.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import statistics
+import time
+
+# Runs hub poll cycles against a simulated gateway micro:bit (microbit_simulator.py) and reports
+# cycle latency percentiles, readings/sec, dropped readings and hub CPU time for different sensor counts.
+# Usage: python3 benchmark_poll_cycle.py [--sensorCounts 1,10,50,200] [--cycles 20]
+
+DEFAULT_SENSOR_COUNTS = [1, 10, 50, 200]
+
+# The simulator runs in its own process so its CPU time is not counted against the hub
+def run_simulator(connection, sensor_count, jitter, loss, malformed, seed):
+    from microbit_simulator import MicrobitSimulator
+    simulator = MicrobitSimulator(sensor_count, jitter=jitter, loss=loss, malformed=malformed, seed=seed)
+    port_path = simulator.start()
+    connection.send((port_path, [sensor.identifier for sensor in simulator.sensors]))
+    connection.recv()  # wait for the benchmark to finish
+    stats = simulator.stats()
+    simulator.stop()
+    connection.send(stats)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+async def run_poll_cycles(hub, gateway, sensors, cycles, framing):
+    gateway.start()
+    gateway.configure(sensors, 1, None, asyncio.get_running_loop().time())
+    if framing == "binary" and not await gateway.negotiate_binary():
+        raise RuntimeError("The simulated gateway did not accept binary framing")
+    latencies = []
+    readings_per_cycle = []
+    for _ in range(cycles):
+        started = time.perf_counter()
+        poll_result = await gateway.poll(sensors)
+        latencies.append(time.perf_counter() - started)
+        readings_per_cycle.append(len(poll_result))
+    return latencies, readings_per_cycle
+
+def benchmark(sensor_count, cycles, jitter, loss, malformed, seed, quiet, framing="text"):
+    import contextlib
+    import io
+    import serial
+    import hub
+
+    parent_connection, child_connection = multiprocessing.Pipe()
+    simulator = multiprocessing.Process(target=run_simulator, args=(child_connection, sensor_count, jitter, loss, malformed, seed), daemon=True)
+    simulator.start()
+    port_path, sensors = parent_connection.recv()
+
+    hub.ser = serial.Serial(port=port_path, baudrate=115200, timeout=1)
+    gateway = hub.GatewayWorker(0, hub.ser)
+    ingest = gateway.ingest
+
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    output = io.StringIO() if quiet else None
+    with contextlib.redirect_stdout(output) if quiet else contextlib.nullcontext():
+        latencies, readings_per_cycle = asyncio.run(run_poll_cycles(hub, gateway, sensors, cycles, framing))
+    wall_time = time.perf_counter() - wall_started
+    cpu_time = time.process_time() - cpu_started
+
+    # Let in-flight replies arrive before comparing what was sent with what was buffered
+    time.sleep(0.2)
+    ingest.stop()
+    parent_connection.send("stop")
+    simulator_stats = parent_connection.recv()
+    simulator.join(timeout=5)
+    hub.ser.close()
+
+    readings_buffered = ingest.buffered_count()
+    return {
+        "sensors": sensor_count,
+        "framing": framing,
+        "cycles": cycles,
+        "cycle_p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "cycle_p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "cycle_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "cycle_mean_ms": round(statistics.mean(latencies) * 1000, 1),
+        "readings_per_sec": round(readings_buffered / wall_time, 1),
+        "sensors_reported_per_cycle": round(statistics.mean(readings_per_cycle), 1),
+        "readings_sent": simulator_stats["readings_sent"],
+        "readings_lost_on_radio": simulator_stats["readings_lost"],
+        "dropped_readings": simulator_stats["readings_sent"] - readings_buffered + ingest.overwritten_count(),
+        "malformed_lines": ingest.malformed_lines + ingest.decoder.checksum_errors,
+        "serial_bytes_per_reading": round(simulator_stats["bytes_sent"] / max(simulator_stats["readings_sent"], 1), 1),
+        "hub_cpu_seconds": round(cpu_time, 3),
+        "hub_cpu_percent": round(100 * cpu_time / wall_time, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sensorCounts', default=",".join(map(str, DEFAULT_SENSOR_COUNTS)), help='Comma separated sensor counts to benchmark.')
+    parser.add_argument('--cycles', type=int, default=20, help='Poll cycles per sensor count.')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Maximum extra reply delay of the simulated sensors in seconds.')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability that a simulated reading is lost over radio.')
+    parser.add_argument('--malformed', type=float, default=0.0, help='Probability that a simulated reading line is malformed.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the simulator.')
+    parser.add_argument('--framing', default="text", choices=["text", "binary"], help='Serial framing between the hub and the gateway micro:bit.')
+    parser.add_argument('--verbose', action='store_true', help='Show the hub output while benchmarking.')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON lines.')
+    args = parser.parse_args()
+
+    for sensor_count in map(int, args.sensorCounts.split(",")):
+        result = benchmark(sensor_count, args.cycles, args.jitter, args.loss, args.malformed, args.seed, not args.verbose, args.framing)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(", ".join(f"{key}={value}" for key, value in result.items()))
+
+if __name__ == "__main__":
+    main()
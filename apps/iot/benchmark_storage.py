@@ -0,0 +1,141 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import storage
+
+# Compares the old sensordb format ("%Y-%m-%d %H:%M:%S" text dates, full sensor identifiers) with the normalized
+# readings schema in storage.py: bytes per row on disk, upload/rollup/per-sensor query times and the migration time.
+# Usage: python3 benchmark_storage.py [--rows 200000] [--sensors 20]
+
+SINGAPORE_TZ = timezone(timedelta(hours=8))
+LEGACY_SCHEMA = [
+    "CREATE TABLE sensordb(readingDate TIMESTAMP, sensorIdentifier CHAR, reading NUMERIC, sent INTEGER)",
+    "CREATE INDEX sensordb_sent ON sensordb(sent)",
+    "CREATE INDEX sensordb_sensor_date ON sensordb(sensorIdentifier, readingDate)",
+]
+LEGACY_QUERIES = {
+    "upload_chunk": ("SELECT rowid, readingDate, sensorIdentifier, reading FROM sensordb WHERE rowid > ? ORDER BY rowid LIMIT ?", "upload"),
+    "rollup_chunk": ("SELECT sensorIdentifier, substr(readingDate, 1, 16), MIN(reading), MAX(reading), AVG(reading), COUNT(*) "
+                     "FROM sensordb WHERE rowid > ? AND rowid <= ? GROUP BY 1, 2", "rollup"),
+    "sensor_hour": ("SELECT readingDate, reading FROM sensordb WHERE sensorIdentifier = ? AND readingDate >= ? AND readingDate < ?", "sensor"),
+}
+NORMALIZED_QUERIES = {
+    "upload_chunk": ("SELECT readingId, readingTime, sensorIdentifier, reading FROM readings JOIN sensors USING (sensorId) "
+                     "WHERE readingId > ? ORDER BY readingId LIMIT ?", "upload"),
+    "rollup_chunk": ("SELECT sensorId, readingTime - readingTime % 60000, MIN(reading), MAX(reading), AVG(reading), COUNT(*) "
+                     "FROM readings WHERE readingId > ? AND readingId <= ? GROUP BY 1, 2", "rollup"),
+    "sensor_hour": ("SELECT readingTime, reading FROM readings WHERE sensorId = (SELECT sensorId FROM sensors WHERE sensorIdentifier = ?) "
+                    "AND readingTime >= ? AND readingTime < ?", "sensor"),
+}
+
+def create_legacy_database(path, rows, sensors, seed):
+    random.seed(seed)
+    identifiers = [f"SE-{10000 + index}" for index in range(sensors - 1)] + ["CA-00001"]
+    start = datetime(2024, 1, 1, tzinfo=SINGAPORE_TZ)
+    conn = sqlite3.connect(path)
+    for query in LEGACY_SCHEMA:
+        conn.execute(query)
+    # One reading per sensor every 5 seconds, like the hub's default poll interval
+    conn.executemany("INSERT INTO sensordb VALUES (?, ?, ?, 1)", (
+        ((start + timedelta(seconds=5 * (index // sensors))).strftime("%Y-%m-%d %H:%M:%S"), identifiers[index % sensors], round(random.uniform(0, 1000), 2))
+        for index in range(rows)))
+    conn.commit()
+    conn.execute("VACUUM")
+    conn.close()
+    return identifiers, start
+
+# On-disk bytes of the given tables and their indexes, from the dbstat virtual table if SQLite was built with it
+def table_bytes(conn, tables):
+    names = [name for name, in conn.execute(
+        f"SELECT name FROM sqlite_master WHERE tbl_name IN ({', '.join('?' * len(tables))})", tables)]
+    try:
+        return conn.execute(f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ({', '.join('?' * len(names))})", names).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+def time_queries(conn, queries, rows, identifier, start, legacy, repeats):
+    hour_start, hour_end = start + timedelta(hours=1), start + timedelta(hours=2)
+    if legacy:
+        sensor_args = (identifier, hour_start.strftime("%Y-%m-%d %H:%M:%S"), hour_end.strftime("%Y-%m-%d %H:%M:%S"))
+    else:
+        sensor_args = (identifier, int(hour_start.timestamp() * 1000), int(hour_end.timestamp() * 1000))
+    arguments = {
+        "upload": (rows - 2000, 500),
+        "rollup": (rows - storage.MAINTENANCE_CHUNK_ROWS, rows),
+        "sensor": sensor_args,
+    }
+    results = dict()
+    for name, (query, kind) in queries.items():
+        started = time.perf_counter()
+        for _ in range(repeats):
+            conn.execute(query, arguments[kind]).fetchall()
+        results[f"{name}_ms"] = round((time.perf_counter() - started) / repeats * 1000, 3)
+    return results
+
+def upload_bytes_per_reading(conn, query):
+    results = conn.execute(query, (0, 500)).fetchall()
+    json_payload = dict()
+    for result in results:
+        json_payload.setdefault(result[2], []).append({"readingDate": result[1], "reading": result[3]})
+    return round(len(json.dumps(json_payload)) / len(results), 1)
+
+def benchmark(rows, sensors, seed, repeats):
+    directory = tempfile.mkdtemp()
+    try:
+        legacy_path = os.path.join(directory, "legacy.db")
+        identifiers, start = create_legacy_database(legacy_path, rows, sensors, seed)
+        legacy = sqlite3.connect(legacy_path)
+        legacy_bytes = table_bytes(legacy, ["sensordb"])
+        before = {
+            "file_bytes_per_row": round(os.path.getsize(legacy_path) / rows, 1),
+            "table_bytes_per_row": round(legacy_bytes / rows, 1) if legacy_bytes else None,
+            "upload_json_bytes_per_reading": upload_bytes_per_reading(legacy, LEGACY_QUERIES["upload_chunk"][0]),
+            **time_queries(legacy, LEGACY_QUERIES, rows, identifiers[0], start, True, repeats),
+        }
+        legacy.close()
+
+        normalized_path = os.path.join(directory, "normalized.db")
+        shutil.copy(legacy_path, normalized_path)
+        started = time.perf_counter()
+        conn = storage.open_database(normalized_path)
+        migration_seconds = time.perf_counter() - started
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        normalized_bytes = table_bytes(conn, ["readings", "sensors"])
+        after = {
+            "file_bytes_per_row": round(os.path.getsize(normalized_path) / rows, 1),
+            "table_bytes_per_row": round(normalized_bytes / rows, 1) if normalized_bytes else None,
+            "upload_json_bytes_per_reading": upload_bytes_per_reading(conn, NORMALIZED_QUERIES["upload_chunk"][0]),
+            **time_queries(conn, NORMALIZED_QUERIES, rows, identifiers[0], start, False, repeats),
+        }
+        conn.close()
+        return {"rows": rows, "sensors": sensors, "migration_seconds": round(migration_seconds, 2), "before": before, "after": after}
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000, help='Number of readings in the benchmark database.')
+    parser.add_argument('--sensors', type=int, default=20, help='Number of sensors (the last one is a camera).')
+    parser.add_argument('--repeats', type=int, default=20, help='Times each query is run.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed for the readings.')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON.')
+    args = parser.parse_args()
+
+    result = benchmark(args.rows, args.sensors, args.seed, args.repeats)
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"rows={result['rows']}, sensors={result['sensors']}, migration_seconds={result['migration_seconds']}")
+    for key in result["before"]:
+        print(f"{key}: before={result['before'][key]}, after={result['after'][key]}")
+
+if __name__ == "__main__":
+    main()
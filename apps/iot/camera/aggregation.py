@@ -0,0 +1,56 @@
+import statistics
+
+# Person counts aggregated over fixed windows (aligned to multiples of window_seconds since the epoch) instead of stored
+# per frame. A window is closed by the first count of the next window, or by flush() when the camera stops; its max,
+# mean, p95 and last count are stored in person_count_windows and the chosen statistic as the camera's reading.
+
+COUNT_STATISTICS = ("max", "mean", "p95", "last")
+
+class PersonCountWindows:
+    def __init__(self, window_seconds=10, statistic="max"):
+        if statistic not in COUNT_STATISTICS:
+            raise ValueError(f"Unknown count statistic {statistic}, expected one of {', '.join(COUNT_STATISTICS)}")
+        self.window_ms = int(window_seconds * 1000)
+        self.statistic = statistic
+        self.window_start = None
+        self.counts = []
+        self.windows_closed = 0
+        self.frames_closed = 0
+
+    # Add the person count of a frame captured at time_ms (epoch milliseconds) and return the window it closed, if any
+    def add(self, time_ms, person_count):
+        window_start = time_ms - time_ms % self.window_ms
+        closed = None
+        if self.window_start is not None and window_start != self.window_start:
+            closed = self.flush()
+        self.window_start = window_start
+        self.counts.append(person_count)
+        return closed
+
+    # Close the current window and return it as a dict (None if it has no counts)
+    def flush(self):
+        if not self.counts:
+            return None
+        counts = sorted(self.counts)
+        window = {
+            "start": self.window_start,
+            "seconds": self.window_ms / 1000,
+            "max": counts[-1],
+            "mean": statistics.mean(counts),
+            "p95": counts[min(int(0.95 * len(counts)), len(counts) - 1)],
+            "last": self.counts[-1],
+            "frames": len(counts),
+        }
+        window["reading"] = window[self.statistic]
+        self.counts = []
+        self.windows_closed += 1
+        self.frames_closed += window["frames"]
+        return window
+
+    def stats(self):
+        return {
+            "window_seconds": self.window_ms / 1000,
+            "statistic": self.statistic,
+            "windows": self.windows_closed,
+            "frames_per_window": round(self.frames_closed / self.windows_closed, 1) if self.windows_closed else None,
+        }
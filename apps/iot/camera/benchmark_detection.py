@@ -0,0 +1,111 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+# storage.py and deadband.py are shared with the hub: they sit next to this file on the Raspberry Pi and one directory up in the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import open_database
+from deadband import DEFAULT_DEADBANDS
+from detection import DetectionPipeline, RUNNING_MODES
+from snapshot import SnapshotWriter
+from motion import MotionGate
+from tracker import PersonTracker
+from aggregation import PersonCountWindows
+
+# Compares the MediaPipe running modes of the detection pipeline (detection.py) on frames delivered at a camera's frame
+# rate: detections/sec, capture-to-result latency, frames dropped before inference and the time of every stage.
+# Usage: python3 benchmark_detection.py [--video clip.mp4 | --image people.jpg] [--fps 30] [--seconds 30] [--motionThreshold 0.01] [--detectEvery 3]
+
+# Frames from a video file (looped), a still image or random noise, delivered no faster than fps
+class FrameSource:
+    def __init__(self, fps, video=None, image=None, size=(640, 480), seed=1):
+        self.interval = 1 / fps
+        self.next_frame_time = time.perf_counter()
+        self.video = cv2.VideoCapture(video) if video else None
+        self.image = cv2.resize(cv2.imread(image), size) if image else None
+        self.noise = None
+        if self.video is None and self.image is None:
+            self.noise = np.random.default_rng(seed).integers(0, 256, (8, size[1], size[0], 3), dtype=np.uint8)
+        self.size = size
+        self.frames = 0
+
+    def read(self):
+        delay = self.next_frame_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame_time = max(self.next_frame_time + self.interval, time.perf_counter())
+        self.frames += 1
+        if self.video is not None:
+            ret, frame = self.video.read()
+            if not ret:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                ret, frame = self.video.read()
+            return cv2.resize(frame, self.size)
+        if self.image is not None:
+            return self.image.copy()
+        return self.noise[self.frames % len(self.noise)].copy()
+
+def benchmark(running_mode, model, max_results, score_threshold, fps, seconds, video, image, motion_threshold=0, detect_every=0):
+    directory = tempfile.mkdtemp()
+    try:
+        source = FrameSource(fps, video, image)
+        mydb = open_database(os.path.join(directory, "processor.db"))
+        pipeline = DetectionPipeline(source.read, model, max_results, score_threshold, mydb, "CA-BENCH", DEFAULT_DEADBANDS,
+                                     SnapshotWriter(os.path.join(directory, "detection_results")), PersonCountWindows(),
+                                     running_mode=running_mode,
+                                     motion_gate=MotionGate(motion_threshold) if motion_threshold > 0 else None,
+                                     tracker=PersonTracker() if detect_every else None, detect_every=max(detect_every, 1))
+        pipeline.start()
+        time.sleep(seconds)
+        pipeline.stop()
+        mydb.close()
+        stats = pipeline.stats()
+        return {
+            "running_mode": running_mode,
+            "frames_captured": stats["capture"]["items"],
+            "detections": stats["detection"]["detections"],
+            "detections_per_sec": round(stats["detection"]["detections"] / seconds, 1),
+            "latency_mean_ms": stats["detection"]["latency_mean_ms"],
+            "latency_p95_ms": stats["detection"]["latency_p95_ms"],
+            "frames_dropped": stats["inference"]["dropped"] + stats["detection"]["stale_frames"],
+            "frames_reused": stats["detection"]["reused_frames"],
+            "frames_propagated": stats["detection"]["propagated_frames"],
+            "stages": {name: stage for name, stage in stats.items() if name != "detection"},
+        }
+    finally:
+        shutil.rmtree(directory)
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--model', default='efficientdet.tflite', help='Path of the object detection model.')
+    parser.add_argument('--maxResults', type=int, default=20, help='Max number of detection results.')
+    parser.add_argument('--scoreThreshold', type=float, default=0.35, help='The score threshold of detection results.')
+    parser.add_argument('--runningModes', default=",".join(RUNNING_MODES), help='Comma separated running modes to benchmark.')
+    parser.add_argument('--fps', type=float, default=30, help='Frame rate of the simulated camera.')
+    parser.add_argument('--seconds', type=float, default=30, help='Seconds to run each running mode for.')
+    parser.add_argument('--video', default=None, help='Video file to take the frames from (looped).')
+    parser.add_argument('--image', default=None, help='Image to use as every frame (random noise if neither is given).')
+    parser.add_argument('--motionThreshold', type=float, default=0, help='Motion gate threshold (0 runs the detector on every frame).')
+    parser.add_argument('--detectEvery', type=int, default=0, help='Track people and detect every n-th frame (0 counts detections without tracking).')
+    parser.add_argument('--json', action='store_true', help='Print results as JSON lines.')
+    args = parser.parse_args()
+
+    for running_mode in args.runningModes.split(","):
+        result = benchmark(running_mode, args.model, args.maxResults, args.scoreThreshold, args.fps, args.seconds, args.video, args.image,
+                           args.motionThreshold, args.detectEvery)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            stages = result.pop("stages")
+            print(", ".join(f"{key}={value}" for key, value in result.items()))
+            for name, stage in stages.items():
+                print(f"    {name}: " + ", ".join(f"{key}={value}" for key, value in stage.items()))
+
+if __name__ == "__main__":
+    main()
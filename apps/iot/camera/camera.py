@@ -17,30 +17,44 @@
 # https://github.com/raspberrypi/picamera2/blob/main/examples/mjpeg_server.py
 
 import io
+import json
 import logging
 import socketserver
 from http import server
-from threading import Condition, Thread
-import time
-import cv2
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-from utils import visualize
+from threading import Condition, Lock
+from collections import deque
 import os
 from dotenv import load_dotenv
-import sqlite3
 import argparse
-from datetime import datetime
-from picamera2 import Picamera2
+from picamera2 import Picamera2, MappedArray
 from picamera2.encoders import JpegEncoder
 from picamera2.outputs import FileOutput
-import matplotlib.pyplot as plt
-import pytz
+import sys
+import cv2
+import numpy as np
+
+# storage.py and deadband.py are shared with the hub: they sit next to this file on the Raspberry Pi and one directory up in the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import open_database
+from deadband import parse_deadband_config
+from detection import DetectionPipeline, RUNNING_MODES
+from snapshot import SnapshotWriter, SNAPSHOT_FORMATS
+from motion import MotionGate
+from tracker import PersonTracker
+from aggregation import PersonCountWindows, COUNT_STATISTICS
 
 # Load environment variables from .env file
 load_dotenv()
 CAMERA_IDENTIFIER_NO = os.getenv("CAMERA_IDENTIFIER_NO")
+# A person count is only stored when it changes or when the CAMERA heartbeat interval passed (DEADBAND_CONFIG, see deadband.py)
+DEADBANDS = parse_deadband_config(os.getenv("DEADBAND_CONFIG"))
+# The main stream is JPEG encoded by the hardware for the web stream; detection runs on the low resolution stream, close
+# to the model's 320x320 input. The lores width must be a multiple of 64 so its YUV420 rows are not padded.
+MAIN_SIZE = (640, 480)
+LORES_SIZE = (320, 240)
+# Preallocated RGB frames the lores stream is converted into. A frame is only reused once the detection pipeline released
+# it; when all of them are still in use the next camera frame is dropped.
+LORES_BUFFER_COUNT = 16
 
 #####
 # MJPEG Web Server
@@ -170,6 +184,14 @@ class StreamingHandler(server.BaseHTTPRequestHandler):
                 logging.warning(
                     'Removed streaming client %s: %s',
                     self.client_address, str(e))
+        elif self.path == '/stats.json':
+            # Items, dropped frames, rate and time per frame of every detection stage
+            content = json.dumps(pipeline.stats() if pipeline is not None else {}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', len(content))
+            self.end_headers()
+            self.wfile.write(content)
         else:
             self.send_error(404)
             self.end_headers()
@@ -182,140 +204,79 @@ class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
 # Person Detection with MediaPipe
 #####
 
-# Create the database if it doesn't exist
-def attempt_create_db():
-    try: 
-        mydb = sqlite3.connect("processor.db")
-        mycursor = mydb.cursor()
-        query = "CREATE TABLE IF NOT EXISTS sensordb(readingDate TIMESTAMP, sensorIdentifier CHAR, reading NUMERIC, sent INTEGER)"
-        mycursor.execute(query)
-        mydb.commit()
-        mydb.close()
-    except:
-        mydb.close()
-
 # Global variables
 picam2 = None
 output = StreamingOutput()
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
+pipeline = None
 
 # Initialize the camera
 def initialize_camera():
     global picam2
     picam2 = Picamera2()
-    picam2.configure(picam2.create_video_configuration(main={"size": (640, 480)}))
+    picam2.configure(picam2.create_video_configuration(main={"size": MAIN_SIZE},
+                                                      lores={"size": LORES_SIZE, "format": "YUV420"}))
     picam2.start_recording(JpegEncoder(), FileOutput(output))
 
-def run_detection(model: str, max_results: int, score_threshold: float) -> None:
-    """Continuously run inference on images acquired from the camera.
+# Lores frames for detection: each YUV420 frame is converted to RGB straight from the camera's buffer into a free
+# preallocated array, without an intermediate copy, a BGR frame or a resize. An array is free again once release() gave it
+# back; capture() returns None (the camera frame is dropped) when none is free.
+class LoresCapture:
+    def __init__(self, camera, size=LORES_SIZE, buffer_count=LORES_BUFFER_COUNT):
+        self.camera = camera
+        self.lock = Lock()
+        self.free_buffers = deque(np.empty((size[1], size[0], 3), dtype=np.uint8) for _ in range(buffer_count))
+
+    def capture(self):
+        # The request is taken (and released) even without a free buffer, so the capture stage keeps the camera's pace
+        request = self.camera.capture_request()
+        try:
+            with self.lock:
+                buffer = self.free_buffers.popleft() if self.free_buffers else None
+            if buffer is None:
+                return None
+            with MappedArray(request, "lores") as mapped:
+                cv2.cvtColor(mapped.array, cv2.COLOR_YUV420p2RGB, dst=buffer)
+        finally:
+            request.release()
+        return buffer
+
+    def release(self, buffer):
+        with self.lock:
+            self.free_buffers.append(buffer)
+
+def run_detection(model: str, max_results: int, score_threshold: float, running_mode: str = "image",
+                  snapshot_writer: SnapshotWriter = None, motion_gate: MotionGate = None, tracker: PersonTracker = None,
+                  detect_every: int = 1, count_windows: PersonCountWindows = None) -> DetectionPipeline:
+    """Start running inference on images acquired from the camera.
+
+    Capture, inference, persistence and overlay each run on their own thread (see detection.py); snapshots are saved
+    in the background by snapshot_writer.
 
     Args:
         model: Name of the TFLite object detection model.
         max_results: Max number of detection results.
         score_threshold: The score threshold of detection results.
+        running_mode: "image" (detect each frame synchronously) or "live_stream" (detect_async on the newest frame).
+        snapshot_writer: Saves the detection frames its policy keeps, or None to save none.
+        motion_gate: Skips the detector on frames of an unchanged scene, or None to detect every frame.
+        tracker: Tracks people between detections and counts them, or None to count the detections of each frame.
+        detect_every: Run the detector on every detect_every-th frame and move the tracked boxes forward in between.
+        count_windows: Aggregates the person counts into the windows stored in the database (10 second maxima if None).
     """
-    global FPS, COUNTER, START_TIME
-    
-    # Visualization parameters
-    row_size = 50  # pixels
-    left_margin = 24  # pixels
-    text_color = (0, 0, 0)  # black
-    font_size = 0.6
-    font_thickness = 1
-    fps_avg_frame_count = 10
-    
-    detection_frame = None
-    detection_result_list = []
-    
-    frame_count = 0
-    output_dir = 'detection_results'
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Initialize the object detection model
-    base_options = python.BaseOptions(model_asset_path=model)
-    options = vision.ObjectDetectorOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.IMAGE,
-        max_results=max_results,
-        score_threshold=score_threshold
-    )
-    detector = vision.ObjectDetector.create_from_options(options)
-
-    while True:
-        # Capture frame
-        frame = picam2.capture_array()
-        
-        # Convert the frame from BGR to RGB as required by the TFLite model
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-
-        # Run object detection using the model
-        detection_result = detector.detect(mp_image)
-
-        # Calculate FPS
-        COUNTER += 1
-        if COUNTER % 10 == 0:
-            FPS = 10 / (time.time() - START_TIME)
-            START_TIME = time.time()
-
-        # Count the number of people detected
-        person_count = sum(1 for detection in detection_result.detections if detection.categories[0].category_name == "person")
-
-        # Log the number of people detected
-        print(f"People detected: {person_count}")
-        
-        # Insert person count into the database
-        try:
-            with sqlite3.connect("processor.db") as mydb:
-                mycursor = mydb.cursor()
-                singapore_tz = pytz.timezone('Asia/Singapore')
-                current_time = datetime.now(singapore_tz).strftime("%Y-%m-%d %H:%M:%S")
-                query = "INSERT INTO sensordb(readingDate, sensorIdentifier, reading, sent) VALUES (?, ?, ?, ?)"
-                mycursor.execute(query, (current_time, CAMERA_IDENTIFIER_NO, person_count, 0))
-                mydb.commit()
-                print(f"Inserted person count {person_count} into database")
-        except sqlite3.Error as e:
-            print(f"Error inserting into database: {e}")
-            
-        image = cv2.resize(frame, (640, 480))
-
-        # Show the FPS and count
-        fps_text = f'FPS = {FPS:.1f}'
-        count_text = f'count = {person_count}'
-        text_location = (left_margin, row_size)
-        current_frame = image
-        cv2.putText(current_frame, fps_text, (left_margin, row_size), cv2.FONT_HERSHEY_SIMPLEX,
-                    font_size, text_color, font_thickness, cv2.LINE_AA)
-        cv2.putText(current_frame, count_text, (left_margin, row_size * 2), cv2.FONT_HERSHEY_SIMPLEX,
-                    font_size, text_color, font_thickness, cv2.LINE_AA)
-
-        # Visualize results if available
-        if detection_result:
-            current_frame = visualize(current_frame, detection_result)
-            detection_frame = current_frame
-
-         # Save every detection frame
-        if detection_frame is not None:
-            try:
-                singapore_tz = pytz.timezone('Asia/Singapore')
-                timestamp = datetime.now(singapore_tz).strftime("%Y%m%d_%H%M%S_%f")
-                filename = f'detection_{timestamp}.png'
-                filepath = os.path.join(output_dir, filename)
-                
-                plt.figure(figsize=(12, 9))
-                plt.imshow(cv2.cvtColor(detection_frame, cv2.COLOR_BGR2RGB))
-                plt.axis('off')
-                plt.tight_layout(pad=0)
-                plt.savefig(filepath, bbox_inches='tight', pad_inches=0)
-                plt.close()
-                
-                print(f"Frame saved to {filepath}")
-            except Exception as e:
-                print(f"Error saving detection frame: {e}")
+    # Capture RGB frames from the camera's lores stream
+    lores_capture = LoresCapture(picam2)
 
-        # Increase sleep time to make visualization stay longer
-        time.sleep(0.5) 
+    # The database is opened once; person counts are aggregated and each closed window is written in one transaction
+    mydb = open_database()
+    count_windows = count_windows or PersonCountWindows()
+    # The stream shows the camera's own JPEG frames, so the overlay stage only draws the frames for the snapshots
+    pipeline = DetectionPipeline(lores_capture.capture, model, max_results, score_threshold, mydb, CAMERA_IDENTIFIER_NO, DEADBANDS,
+                                 snapshot_writer, count_windows, stream_output=None,
+                                 running_mode=running_mode, motion_gate=motion_gate,
+                                 tracker=tracker, detect_every=detect_every, rgb_frames=True,
+                                 release_frame=lores_capture.release)
+    pipeline.start()
+    return pipeline
 
 #####
 # Main
@@ -340,15 +301,83 @@ def main():
         required=False,
         type=float,
         default=0.35)
+    parser.add_argument(
+        '--runningMode',
+        help='MediaPipe running mode: image runs detect() on every frame, live_stream runs detect_async() on the newest frame only.',
+        required=False,
+        choices=list(RUNNING_MODES),
+        default='image')
+    parser.add_argument(
+        '--snapshotFormat',
+        help='Image format of the detection snapshots.',
+        required=False,
+        choices=list(SNAPSHOT_FORMATS),
+        default='jpg')
+    parser.add_argument(
+        '--snapshotIntervalSeconds',
+        help='Save a snapshot at least this often (0 to only save on person count changes).',
+        required=False,
+        type=float,
+        default=60)
+    parser.add_argument(
+        '--snapshotThresholds',
+        help='Comma separated person counts; a snapshot is saved whenever the count crosses one of them, instead of on every count change.',
+        required=False,
+        default='')
+    parser.add_argument(
+        '--snapshotQuotaMb',
+        help='Disk space for snapshots; the oldest are deleted beyond it (0 for no limit).',
+        required=False,
+        type=float,
+        default=500)
+    parser.add_argument(
+        '--motionThreshold',
+        help='Fraction of pixels that must change for the detector to run on a frame (0 to detect every frame).',
+        required=False,
+        type=float,
+        default=0.01)
+    parser.add_argument(
+        '--maxStaleSeconds',
+        help='Run the detector at least this often, even on an unchanged scene.',
+        required=False,
+        type=float,
+        default=10)
+    parser.add_argument(
+        '--detectEvery',
+        help='Run the detector on every n-th frame and track people in between.',
+        required=False,
+        type=int,
+        default=3)
+    parser.add_argument(
+        '--noTracking',
+        help='Count the people detected in each frame instead of tracking them (the detector runs on every frame).',
+        action='store_true')
+    parser.add_argument(
+        '--countWindowSeconds',
+        help='Length of the windows the person counts are aggregated over before they are stored.',
+        required=False,
+        type=float,
+        default=10)
+    parser.add_argument(
+        '--countStatistic',
+        help='Statistic of each window that is stored as the camera reading and uploaded (all are kept in person_count_windows).',
+        required=False,
+        choices=list(COUNT_STATISTICS),
+        default='max')
     args = parser.parse_args()
 
-    attempt_create_db()
     initialize_camera()
 
-    # Start the detection thread
-    detection_thread = Thread(target=run_detection, args=(args.model, int(args.maxResults), args.scoreThreshold))
-    detection_thread.daemon = True
-    detection_thread.start()
+    # Start the detection stages
+    global pipeline
+    snapshot_writer = SnapshotWriter('detection_results', image_format=args.snapshotFormat,
+                                     interval_seconds=args.snapshotIntervalSeconds,
+                                     count_thresholds=[int(count) for count in args.snapshotThresholds.split(',') if count],
+                                     quota_bytes=int(args.snapshotQuotaMb * 1024 * 1024))
+    motion_gate = MotionGate(args.motionThreshold, max_stale_seconds=args.maxStaleSeconds) if args.motionThreshold > 0 else None
+    tracker = None if args.noTracking else PersonTracker()
+    pipeline = run_detection(args.model, int(args.maxResults), args.scoreThreshold, args.runningMode, snapshot_writer,
+                             motion_gate, tracker, args.detectEvery, PersonCountWindows(args.countWindowSeconds, args.countStatistic))
 
     # Start the streaming server
     try:
@@ -357,6 +386,7 @@ def main():
         print("Server started at http://localhost:8000")
         server.serve_forever()
     finally:
+        pipeline.stop()
         picam2.stop_recording()
 
 if __name__ == '__main__':
@@ -0,0 +1,346 @@
+import sqlite3
+import statistics
+import threading
+import time
+from collections import deque
+import cv2
+import mediapipe as mp
+from mediapipe.tasks import python
+from mediapipe.tasks.python import vision
+from utils import visualize, visualize_tracks
+from storage import insert_count_windows
+from deadband import DeadbandFilter
+from pipeline import LatestQueue, Pipeline
+
+# Person detection of camera.py and webcam.py, split into stages that each run on their own thread:
+#   capture -> inference -> persistence (person counts aggregated over windows, see aggregation.py, into processor.db)
+#                        -> overlay (boxes, FPS and count drawn on the frame, JPEG encoded for the stream, offered to the
+#                           snapshot writer, see snapshot.py)
+# Frames are handed on through one-slot queues in which a newer frame replaces one that was not picked up yet, so the
+# inference rate is only limited by the model and a slow disk or database never holds up detection.
+# In "image" running mode the inference stage calls detect() on each frame. In "live_stream" mode it hands the newest frame
+# to detect_async() once the detector is free and the result callback passes the result on, so the stage is never blocked
+# on the model and a frame that went stale while the model was busy is never submitted.
+# With a tracker (see tracker.py) the detector only runs every detect_every frames, the tracked boxes are moved forward
+# in between, and the person count is the number of people tracked rather than the detections of a single frame.
+# With a motion gate (see motion.py) the inference stage skips the detector on frames of an unchanged scene and passes them
+# on with the previous detections and person count. With both, the gate is asked on the frames due for a detection, and
+# the detector runs whenever it asks for one.
+# With release_frame, capture() hands out buffers from a pool (camera.py's lores stream): every frame is given back with
+# release_frame once the overlay stage is done with it, or once it is dropped on the way there, and never before, so a
+# buffer is not overwritten while a stage still reads it.
+
+RUNNING_MODES = {
+    "image": vision.RunningMode.IMAGE,
+    "live_stream": vision.RunningMode.LIVE_STREAM,
+}
+
+# Person counts waiting for the persistence stage; if the database falls this far behind the oldest counts are dropped
+PERSIST_QUEUE_SIZE = 256
+# How often the stage timings are printed
+STATS_LOG_INTERVAL_SECONDS = 60
+# Visualization parameters
+ROW_SIZE = 50  # pixels
+LEFT_MARGIN = 24  # pixels
+TEXT_COLOR = (0, 0, 0)  # black
+FONT_SIZE = 0.6
+FONT_THICKNESS = 1
+STREAM_JPEG_QUALITY = 70
+# Detections whose capture-to-result latency is kept for the stats
+DETECTION_TIMING_SAMPLES = 200
+# live_stream mode: a frame whose result has not come back after this long is given up on
+LIVE_STREAM_RESULT_TIMEOUT_SECONDS = 2
+
+class DetectedFrame:
+    __slots__ = ("index", "capture_time", "frame", "detection_result", "person_count", "tracks")
+
+    def __init__(self, index, capture_time, frame):
+        self.index = index
+        self.capture_time = capture_time
+        self.frame = frame
+        self.detection_result = None
+        self.person_count = None
+        self.tracks = None  # (track IDs, boxes) of the people tracked
+
+class DetectionPipeline:
+    # capture() returns the next BGR frame. If stream_output is given, the overlay frames are JPEG encoded into it
+    # (camera.py streams the camera's own hardware encoded JPEGs instead). snapshot_writer (a SnapshotWriter, or None to
+    # save no snapshots) decides which overlay frames are saved. motion_gate (a MotionGate, or None to detect every frame)
+    # decides which frames are worth running the detector on. tracker (a PersonTracker, or None to count the detections of
+    # each frame) follows the people between the detections made every detect_every frames. With rgb_frames, capture()
+    # returns RGB frames that go to the model without a colour conversion (camera.py's lores stream). count_windows (a
+    # PersonCountWindows) aggregates the person counts; each closed window is inserted in one transaction. capture() may
+    # return None when it has no frame (no free buffer); release_frame, if given, returns a frame's buffer to capture().
+    def __init__(self, capture, model, max_results, score_threshold, mydb, camera_identifier, deadbands, snapshot_writer,
+                 count_windows, stream_output=None, running_mode="image", motion_gate=None, tracker=None, detect_every=1,
+                 rgb_frames=False, release_frame=None):
+        self.capture = capture
+        self.release_frame = release_frame
+        self.frames_without_buffer = 0
+        self.rgb_frames = rgb_frames
+        self.running_mode = running_mode
+        self.mydb = mydb
+        self.camera_identifier = camera_identifier
+        self.snapshot_writer = snapshot_writer
+        self.motion_gate = motion_gate
+        self.tracker = tracker
+        self.detect_every = detect_every
+        self.frames_since_detection = 0
+        self.stream_output = stream_output
+        self.count_windows = count_windows
+        self.deadband = DeadbandFilter(deadbands)
+        self.deadband.configure({camera_identifier: "CAMERA"})
+        # Closed windows and the readings reported for them, kept until they are inserted
+        self.pending_windows = []
+        self.pending_counts = []
+        self.frame_index = 0
+        self.stats_thread = None
+        # Capture-to-result latencies and result times of the recent detections
+        self.detection_latencies = deque(maxlen=DETECTION_TIMING_SAMPLES)
+        self.detection_times = deque(maxlen=DETECTION_TIMING_SAMPLES)
+        self.detections = 0
+        # Last detected frame, whose detections are reused while the motion gate finds the scene unchanged
+        self.last_detected = None
+        self.reused_frames = 0
+        self.propagated_frames = 0
+        # live_stream mode: frames submitted to detect_async by timestamp, and whether the detector is free for the next one
+        self.in_flight = dict()
+        self.detector_idle = threading.Event()
+        self.detector_idle.set()
+        self.last_timestamp_ms = 0
+        self.stale_frames = 0
+
+        # Initialize the object detection model
+        base_options = python.BaseOptions(model_asset_path=model)
+        options = vision.ObjectDetectorOptions(
+            base_options=base_options,
+            running_mode=RUNNING_MODES[running_mode],
+            max_results=max_results,
+            score_threshold=score_threshold,
+            result_callback=self.on_detection_result if running_mode == "live_stream" else None
+        )
+        self.detector = vision.ObjectDetector.create_from_options(options)
+
+        self.pipeline = Pipeline()
+        # The persistence stage never reads the frame, so a frame is released by the overlay stage or when it is dropped
+        self.inference_queue = LatestQueue(on_drop=self.release)
+        self.persist_queue = LatestQueue(PERSIST_QUEUE_SIZE)
+        self.overlay_queue = LatestQueue(on_drop=self.release)
+        self.pipeline.add_stage("capture", self.capture_frame, None, [self.inference_queue])
+        if running_mode == "live_stream":
+            # Results are passed on by on_detection_result
+            self.pipeline.add_stage("inference", self.submit_frame, self.inference_queue)
+        else:
+            self.pipeline.add_stage("inference", self.detect_people, self.inference_queue, [self.persist_queue, self.overlay_queue])
+        self.pipeline.add_stage("persistence", self.persist_count, self.persist_queue)
+        self.pipeline.add_stage("overlay", self.draw_overlay, self.overlay_queue)
+
+    def start(self):
+        self.pipeline.start()
+        self.stats_thread = threading.Thread(target=self.log_stats, daemon=True)
+        self.stats_thread.start()
+
+    def stop(self):
+        self.pipeline.stop()
+        self.detector.close()
+        self.close_window(self.count_windows.flush())
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.close()
+
+    # Stage timings, plus the detections made, their rate and their capture-to-result latency in milliseconds, the frames
+    # the motion gate let through or skipped, the people tracked, the count windows stored, and the snapshots saved,
+    # skipped, dropped and evicted
+    def stats(self):
+        stats = self.pipeline.stats()
+        latencies = sorted(self.detection_latencies)
+        detection_times = list(self.detection_times)
+        stats["detection"] = {
+            "running_mode": self.running_mode,
+            "detections": self.detections,
+            "stale_frames": self.stale_frames,
+            "frames_without_buffer": self.frames_without_buffer,
+            "reused_frames": self.reused_frames,
+            "propagated_frames": self.propagated_frames,
+            "fps": round((len(detection_times) - 1) / (detection_times[-1] - detection_times[0]), 1) if len(detection_times) > 1 and detection_times[-1] > detection_times[0] else None,
+            "latency_mean_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+            "latency_p95_ms": round(latencies[min(int(0.95 * len(latencies)), len(latencies) - 1)] * 1000, 1) if latencies else None,
+        }
+        stats["counts"] = self.count_windows.stats()
+        if self.tracker is not None:
+            stats["tracking"] = self.tracker.stats()
+        if self.motion_gate is not None:
+            stats["motion"] = self.motion_gate.stats()
+        if self.snapshot_writer is not None:
+            stats["snapshots"] = self.snapshot_writer.stats()
+        return stats
+
+    def log_stats(self):
+        while True:
+            time.sleep(STATS_LOG_INTERVAL_SECONDS)
+            print("Camera pipeline: " + ", ".join(f"{name} {stats}" for name, stats in self.stats().items()))
+
+    def capture_frame(self):
+        frame = self.capture()
+        if frame is None:
+            self.frames_without_buffer += 1
+            return None
+        self.frame_index += 1
+        return DetectedFrame(self.frame_index, time.time(), frame)
+
+    # Give the frame's buffer back to capture(); a frame is released once, by whichever stage last had it
+    def release(self, detected):
+        frame, detected.frame = detected.frame, None
+        if self.release_frame is not None and frame is not None:
+            self.release_frame(frame)
+
+    def detect_people(self, detected):
+        try:
+            if self.propagate_tracks(detected) or self.reuse_detection(detected):
+                return detected
+            detected.detection_result = self.detector.detect(to_mp_image(detected.frame, self.rgb_frames))
+            return self.detection_done(detected)
+        except Exception:
+            self.release(detected)
+            raise
+
+    # Submit the newest frame to detect_async once the previous one has been detected
+    def submit_frame(self, detected):
+        if not self.detector_idle.wait(LIVE_STREAM_RESULT_TIMEOUT_SECONDS):
+            print("No detection result for the previous frame, submitting the next one")
+            # A result that still comes back finds its frame gone and is ignored
+            for timestamp_ms in list(self.in_flight):
+                lost = self.in_flight.pop(timestamp_ms, None)
+                if lost is not None:
+                    self.release(lost)
+        # A newer frame may have arrived while the detector was busy; the older one is stale
+        newer = self.inference_queue.get(timeout=0)
+        if newer is not None:
+            self.stale_frames += 1
+            self.release(detected)
+            detected = newer
+        try:
+            reused = self.propagate_tracks(detected) or self.reuse_detection(detected)
+        except Exception:
+            self.release(detected)
+            raise
+        if reused:
+            self.persist_queue.put(detected)
+            self.overlay_queue.put(detected)
+            return
+        # detect_async needs strictly increasing timestamps
+        timestamp_ms = max(int(time.monotonic() * 1000), self.last_timestamp_ms + 1)
+        self.last_timestamp_ms = timestamp_ms
+        self.in_flight[timestamp_ms] = detected
+        self.detector_idle.clear()
+        try:
+            self.detector.detect_async(to_mp_image(detected.frame, self.rgb_frames), timestamp_ms)
+        except Exception:
+            del self.in_flight[timestamp_ms]
+            self.detector_idle.set()
+            self.release(detected)
+            raise
+
+    # Result callback of the live_stream detector, called on MediaPipe's thread
+    def on_detection_result(self, result, output_image, timestamp_ms):
+        try:
+            detected = self.in_flight.pop(timestamp_ms, None)
+            if detected is None:
+                return
+            detected.detection_result = result
+            try:
+                detected = self.detection_done(detected)
+            except Exception:
+                self.release(detected)
+                raise
+            self.persist_queue.put(detected)
+            self.overlay_queue.put(detected)
+        finally:
+            # Only now may the inference stage go on, so it sees this frame as the last detected one
+            self.detector_idle.set()
+
+    # Give the frame the last detections instead of running the detector if the motion gate finds the scene unchanged.
+    # Only asked once propagate_tracks passed the frame on for detection, so the frames the gate lets through are detected.
+    def reuse_detection(self, detected):
+        last_detected = self.last_detected
+        if self.motion_gate is None or last_detected is None or self.motion_gate.should_detect(detected.frame, detected.capture_time):
+            return False
+        detected.detection_result = last_detected.detection_result
+        detected.person_count = last_detected.person_count
+        # The scene did not change, so the tracks stay where they are instead of being extrapolated over the skipped frames
+        detected.tracks = self.tracker.hold(detected.index) if self.tracker is not None else last_detected.tracks
+        self.reused_frames += 1
+        return True
+
+    # Between the detections made every detect_every frames, move the tracked people forward instead of running the detector
+    def propagate_tracks(self, detected):
+        if self.tracker is None or self.last_detected is None or self.frames_since_detection + 1 >= self.detect_every:
+            self.frames_since_detection = 0
+            return False
+        self.frames_since_detection += 1
+        detected.detection_result = self.last_detected.detection_result
+        detected.tracks = self.tracker.predict(detected.index)
+        detected.person_count = len(detected.tracks[0])
+        self.propagated_frames += 1
+        return True
+
+    def detection_done(self, detected):
+        # Count the number of people detected, or tracked if there is a tracker
+        people = [detection.bounding_box for detection in detected.detection_result.detections if detection.categories[0].category_name == "person"]
+        if self.tracker is not None:
+            boxes = [(box.origin_x, box.origin_y, box.origin_x + box.width, box.origin_y + box.height) for box in people]
+            detected.tracks = self.tracker.update(detected.index, boxes, detected.capture_time)
+            detected.person_count = len(detected.tracks[0])
+        else:
+            detected.person_count = len(people)
+        now = time.time()
+        self.detections += 1
+        self.detection_latencies.append(now - detected.capture_time)
+        self.detection_times.append(now)
+        self.last_detected = detected
+        return detected
+
+    def persist_count(self, detected):
+        self.close_window(self.count_windows.add(int(detected.capture_time * 1000), detected.person_count))
+
+    # Insert a closed count window, and its reading if it passes the deadband
+    def close_window(self, window):
+        if window is None:
+            return
+        self.pending_windows.append((window["start"], self.camera_identifier, window["seconds"], window["max"],
+                                     window["mean"], window["p95"], window["last"], window["frames"]))
+        if self.deadband.should_report(self.camera_identifier, window["start"], window["reading"]):
+            self.pending_counts.append((window["start"], self.camera_identifier, window["reading"]))
+        try:
+            insert_count_windows(self.mydb, self.pending_windows, self.pending_counts)
+            print(f"Inserted {len(self.pending_windows)} person count window(s) and {len(self.pending_counts)} reading(s) into database")
+            self.pending_windows = []
+            self.pending_counts = []
+        except sqlite3.Error as e:
+            # Keep the windows and retry with the next one
+            print(f"Error inserting into database: {e}")
+
+    # Draws on the frame in place: the inference stage is done with it, and it is only released afterwards
+    def draw_overlay(self, detected):
+        try:
+            frame = detected.frame
+            fps = self.stats()["detection"]["fps"] or 0
+            cv2.putText(frame, f'FPS = {fps:.1f}', (LEFT_MARGIN, ROW_SIZE), cv2.FONT_HERSHEY_SIMPLEX,
+                        FONT_SIZE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
+            cv2.putText(frame, f'count = {detected.person_count}', (LEFT_MARGIN, ROW_SIZE * 2), cv2.FONT_HERSHEY_SIMPLEX,
+                        FONT_SIZE, TEXT_COLOR, FONT_THICKNESS, cv2.LINE_AA)
+            if detected.tracks is not None:
+                frame = visualize_tracks(frame, *detected.tracks)
+            else:
+                frame = visualize(frame, detected.detection_result)
+            if self.stream_output is not None:
+                _, jpeg_frame = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), STREAM_JPEG_QUALITY])
+                self.stream_output.write(jpeg_frame.tobytes())
+            # The snapshot writer copies the frame, so the buffer can be released right after
+            if self.snapshot_writer is not None:
+                self.snapshot_writer.offer(frame, detected.capture_time, detected.person_count, self.rgb_frames)
+        finally:
+            self.release(detected)
+
+# Convert a frame to the RGB MediaPipe image the TFLite model needs (RGB frames are used as they are)
+def to_mp_image(frame, rgb=False):
+    return mp.Image(image_format=mp.ImageFormat.SRGB, data=frame if rgb else cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
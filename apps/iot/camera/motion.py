@@ -0,0 +1,62 @@
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+# Motion gate in front of the object detector: every frame is shrunk to a small grayscale image and compared with a
+# running-average background. The detector only runs when enough pixels changed or when the last detection is older than
+# max_stale_seconds; otherwise the previous detections and person count are reused. A person standing still fades into
+# the background, which is fine: the count does not change until they move, and the staleness interval re-checks it.
+
+# Size of the grayscale image the scene is compared at
+MOTION_FRAME_SIZE = (80, 60)
+# Change fractions kept for the stats
+MOTION_SAMPLES = 200
+
+class MotionGate:
+    # threshold: fraction of the small image's pixels that must differ from the background by more than pixel_threshold
+    # grey levels; background_alpha: how fast the background follows the scene (0-1 per frame)
+    def __init__(self, threshold=0.01, pixel_threshold=25, max_stale_seconds=10, background_alpha=0.05):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.max_stale_seconds = max_stale_seconds
+        self.background_alpha = background_alpha
+        self.background = None
+        self.last_detection_time = None
+        self.frames = 0
+        self.motion_frames = 0
+        self.stale_frames = 0
+        self.changes = deque(maxlen=MOTION_SAMPLES)
+
+    # Whether the detector should run on this frame
+    def should_detect(self, frame, now=None):
+        now = time.time() if now is None else now
+        self.frames += 1
+        small = cv2.resize(frame, MOTION_FRAME_SIZE, interpolation=cv2.INTER_AREA)
+        gray = small[..., :3].mean(axis=2, dtype=np.float32) if small.ndim == 3 else small.astype(np.float32)
+        if self.background is None:
+            self.background = gray
+            change = 1.0
+        else:
+            change = np.count_nonzero(np.abs(gray - self.background) > self.pixel_threshold) / gray.size
+            self.background += self.background_alpha * (gray - self.background)
+        self.changes.append(change)
+        if change >= self.threshold:
+            self.motion_frames += 1
+        elif self.last_detection_time is not None and now - self.last_detection_time < self.max_stale_seconds:
+            return False
+        else:
+            self.stale_frames += 1
+        self.last_detection_time = now
+        return True
+
+    def stats(self):
+        changes = list(self.changes)
+        detected = self.motion_frames + self.stale_frames
+        return {
+            "frames": self.frames,
+            "motion_frames": self.motion_frames,
+            "stale_frames": self.stale_frames,
+            "skipped_percent": round(100 * (self.frames - detected) / self.frames, 1) if self.frames else None,
+            "mean_change_percent": round(100 * sum(changes) / len(changes), 2) if changes else None,
+        }
@@ -0,0 +1,123 @@
+import statistics
+import threading
+import time
+from collections import deque
+
+# Threaded stages connected by bounded queues. A full queue drops its oldest item, so a slow stage always works on the
+# newest frame and never holds up the stages before it.
+
+# Durations kept per stage for the timing stats
+STAGE_TIMING_SAMPLES = 200
+# Pause after a stage function raised, so a failing camera or disk does not spin a core
+STAGE_ERROR_BACKOFF_SECONDS = 0.5
+
+# on_drop, if given, is called with every item dropped from a full queue
+class LatestQueue:
+    def __init__(self, maxsize=1, on_drop=None):
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    # Add an item, dropping the oldest one if the queue is full
+    def put(self, item):
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(dropped)
+            self.items.append(item)
+            self.condition.notify()
+
+    # Oldest item, or None if there was none within timeout seconds or the queue was closed
+    def get(self, timeout=None):
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+# Runs function on every item of input_queue (or, for a source stage without an input queue, over and over) on its own
+# thread and puts every result that is not None on each of output_queues
+class PipelineStage(threading.Thread):
+    def __init__(self, name, function, input_queue=None, output_queues=()):
+        super().__init__(name=name, daemon=True)
+        self.function = function
+        self.input_queue = input_queue
+        self.output_queues = list(output_queues)
+        self.stopped = threading.Event()
+        self.items = 0
+        self.errors = 0
+        self.busy_seconds = 0
+        self.durations = deque(maxlen=STAGE_TIMING_SAMPLES)
+        self.finished_times = deque(maxlen=STAGE_TIMING_SAMPLES)
+
+    def run(self):
+        while not self.stopped.is_set():
+            if self.input_queue is not None:
+                item = self.input_queue.get(timeout=0.5)
+                if item is None:
+                    continue
+            started = time.perf_counter()
+            try:
+                result = self.function(item) if self.input_queue is not None else self.function()
+            except Exception as e:
+                self.errors += 1
+                print(f"Error in the {self.name} stage: {e}")
+                time.sleep(STAGE_ERROR_BACKOFF_SECONDS)
+                continue
+            finished = time.perf_counter()
+            self.items += 1
+            self.busy_seconds += finished - started
+            self.durations.append(finished - started)
+            self.finished_times.append(finished)
+            if result is not None:
+                for output_queue in self.output_queues:
+                    output_queue.put(result)
+
+    def stop(self):
+        self.stopped.set()
+        if self.input_queue is not None:
+            self.input_queue.close()
+
+    # Items handled, items dropped from the input queue, recent rate and time per item in milliseconds
+    def stats(self):
+        durations = sorted(self.durations)
+        finished_times = list(self.finished_times)
+        return {
+            "items": self.items,
+            "dropped": self.input_queue.dropped if self.input_queue is not None else 0,
+            "errors": self.errors,
+            "fps": round((len(finished_times) - 1) / (finished_times[-1] - finished_times[0]), 1) if len(finished_times) > 1 and finished_times[-1] > finished_times[0] else None,
+            "mean_ms": round(statistics.mean(durations) * 1000, 1) if durations else None,
+            "p95_ms": round(durations[min(int(0.95 * len(durations)), len(durations) - 1)] * 1000, 1) if durations else None,
+        }
+
+class Pipeline:
+    def __init__(self):
+        self.stages = []
+
+    def add_stage(self, name, function, input_queue=None, output_queues=()):
+        stage = PipelineStage(name, function, input_queue, output_queues)
+        self.stages.append(stage)
+        return stage
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self, timeout=2):
+        for stage in self.stages:
+            stage.stop()
+        for stage in self.stages:
+            stage.join(timeout)
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -7,7 +7,7 @@ sudo apt-get install -y python3-pip libgl1-mesa-glx libglib2.0-0
 
 # Install Python dependencies
 python3 -m pip install --upgrade pip
-python3 -m pip install requests opencv-python mediapipe matplotlib picamera2
+python3 -m pip install requests opencv-python mediapipe picamera2
 
 # Install OpenCV and MediaPipe with extended timeout (if needed)
 if [ $? -ne 0 ]; then
@@ -0,0 +1,142 @@
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import cv2
+import pytz
+
+# Detection snapshots: the policy decides from every detected frame whether it is worth keeping, the chosen frames are
+# encoded by OpenCV straight from the BGR array on a small thread pool, and the oldest snapshots are deleted once the
+# folder grows past its disk quota. When all writers are busy and the backlog is full, new snapshots are dropped rather
+# than holding up detection.
+
+SNAPSHOT_FORMATS = {
+    "jpg": lambda quality: [int(cv2.IMWRITE_JPEG_QUALITY), quality],
+    "png": lambda quality: [int(cv2.IMWRITE_PNG_COMPRESSION), 1],
+}
+# Write times kept for the stats
+SNAPSHOT_TIMING_SAMPLES = 200
+
+class SnapshotWriter:
+    # interval_seconds: save a frame at least this often (0 disables it); on_count_change: save whenever the person count
+    # changes (None: only without count_thresholds, which then replace it); count_thresholds: save when the count crosses
+    # one of these counts, up or down; quota_bytes: delete the
+    # oldest snapshots beyond this total size (0 disables it); max_pending: snapshots waiting for a writer before new
+    # ones are dropped
+    def __init__(self, output_dir, image_format="jpg", jpeg_quality=85, interval_seconds=60, on_count_change=None,
+                 count_thresholds=(), quota_bytes=500 * 1024 * 1024, workers=1, max_pending=4):
+        if image_format not in SNAPSHOT_FORMATS:
+            raise ValueError(f"Unknown snapshot format {image_format}, expected one of {', '.join(SNAPSHOT_FORMATS)}")
+        self.output_dir = output_dir
+        self.image_format = image_format
+        self.encode_params = SNAPSHOT_FORMATS[image_format](jpeg_quality)
+        self.interval_seconds = interval_seconds
+        self.count_thresholds = sorted(count_thresholds)
+        # Every threshold crossing is also a count change, so thresholds only select frames without the count change trigger
+        self.on_count_change = not self.count_thresholds if on_count_change is None else on_count_change
+        self.quota_bytes = quota_bytes
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot")
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.lock = threading.Lock()
+        self.last_saved_time = None
+        self.last_count = None
+        self.saved = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.evicted = 0
+        self.errors = 0
+        self.durations = deque(maxlen=SNAPSHOT_TIMING_SAMPLES)
+        os.makedirs(output_dir, exist_ok=True)
+        # Snapshots already on disk, oldest first, so the quota also covers earlier runs
+        self.files = deque()
+        self.total_bytes = 0
+        for name in sorted(os.listdir(output_dir)):
+            path = os.path.join(output_dir, name)
+            if name.startswith("detection_") and os.path.isfile(path):
+                size = os.path.getsize(path)
+                self.files.append((path, size))
+                self.total_bytes += size
+        self.evict()
+
+    # Why the frame should be saved ("first", "count", "threshold" or "interval"), or None
+    def reason(self, capture_time, person_count):
+        last_count = self.last_count
+        self.last_count = person_count
+        if self.last_saved_time is None:
+            return "first"
+        if self.on_count_change and person_count != last_count:
+            return "count"
+        if any(min(last_count, person_count) < threshold <= max(last_count, person_count) for threshold in self.count_thresholds):
+            return "threshold"
+        if self.interval_seconds and capture_time - self.last_saved_time >= self.interval_seconds:
+            return "interval"
+        return None
+
+    # Offer a detected BGR (or, with rgb, RGB) frame; it is written in the background if the policy keeps it and a writer
+    # is free. The frame is copied, as the caller may reuse its buffer for a later frame.
+    def offer(self, frame, capture_time, person_count, rgb=False):
+        reason = self.reason(capture_time, person_count)
+        if reason is None:
+            self.skipped += 1
+            return False
+        if not self.pending.acquire(blocking=False):
+            self.dropped += 1
+            return False
+        self.last_saved_time = capture_time
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR) if rgb else frame.copy()
+        self.executor.submit(self.write, frame, capture_time, reason)
+        return True
+
+    def write(self, frame, capture_time, reason):
+        started = time.perf_counter()
+        try:
+            timestamp = datetime.fromtimestamp(capture_time, pytz.timezone('Asia/Singapore')).strftime("%Y%m%d_%H%M%S_%f")
+            filepath = os.path.join(self.output_dir, f'detection_{timestamp}.{self.image_format}')
+            ok, encoded = cv2.imencode(f'.{self.image_format}', frame, self.encode_params)
+            if not ok:
+                raise ValueError("could not encode the frame")
+            with open(filepath, "wb") as f:
+                f.write(encoded.tobytes())
+            with self.lock:
+                self.files.append((filepath, len(encoded)))
+                self.total_bytes += len(encoded)
+                self.saved += 1
+                self.durations.append(time.perf_counter() - started)
+                self.evict()
+            print(f"Frame saved to {filepath} ({reason})")
+        except Exception as e:
+            self.errors += 1
+            print(f"Error saving snapshot: {e}")
+        finally:
+            self.pending.release()
+
+    # Delete the oldest snapshots until the folder is within its quota
+    def evict(self):
+        while self.quota_bytes and self.total_bytes > self.quota_bytes and len(self.files) > 1:
+            path, size = self.files.popleft()
+            self.total_bytes -= size
+            self.evicted += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def stats(self):
+        durations = sorted(self.durations)
+        return {
+            "saved": self.saved,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+            "evicted": self.evicted,
+            "errors": self.errors,
+            "files": len(self.files),
+            "disk_mb": round(self.total_bytes / (1024 * 1024), 1),
+            "mean_ms": round(statistics.mean(durations) * 1000, 1) if durations else None,
+            "p95_ms": round(durations[min(int(0.95 * len(durations)), len(durations) - 1)] * 1000, 1) if durations else None,
+        }
@@ -0,0 +1,181 @@
+import threading
+import time
+import numpy as np
+
+# Multi-object tracker for the people the detector finds. Boxes are [x1, y1, x2, y2] in pixels and all tracks are kept in
+# NumPy arrays, so prediction and IoU matching are vectorised over boxes. Each track follows a constant-velocity model with
+# fixed alpha-beta gains (a steady-state Kalman filter), which lets the detector run only every few frames while the boxes
+# are propagated in between. A track is confirmed (counted as a visitor entering) after min_hits matched detections and
+# removed (an exit) after max_misses detections without a match. A track is only extrapolated for max_prediction_frames
+# after its last match, so a long gap between detections cannot carry it far away from where the person was last seen.
+
+class PersonTracker:
+    # iou_threshold: minimum IoU for a detection to continue a track; max_centroid_distance: detections that overlap no
+    # track still continue the nearest one whose centre is within this many box diagonals; alpha, beta: position and
+    # velocity gains of the filter; max_prediction_frames: frames a track is extrapolated for without a match;
+    # interval_seconds: length of the entries/exits reporting interval
+    def __init__(self, iou_threshold=0.3, max_centroid_distance=0.5, min_hits=2, max_misses=3, alpha=0.6, beta=0.2,
+                 max_prediction_frames=15, interval_seconds=60):
+        self.iou_threshold = iou_threshold
+        self.max_centroid_distance = max_centroid_distance
+        self.min_hits = min_hits
+        self.max_misses = max_misses
+        self.alpha = alpha
+        self.beta = beta
+        self.max_prediction_frames = max_prediction_frames
+        self.interval_seconds = interval_seconds
+        self.lock = threading.Lock()
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.boxes = np.zeros((0, 4), dtype=np.float32)
+        self.velocities = np.zeros((0, 4), dtype=np.float32)  # pixels per frame
+        self.hits = np.zeros(0, dtype=np.int32)
+        self.misses = np.zeros(0, dtype=np.int32)
+        self.predicted_frames = np.zeros(0, dtype=np.int32)  # frames extrapolated since the last match
+        self.frame_index = None
+        self.last_update_index = None
+        self.next_id = 1
+        self.unique_visitors = 0
+        self.entries = 0
+        self.exits = 0
+        self.interval_start = None
+        self.interval_entries = 0
+        self.interval_exits = 0
+        self.last_interval = None
+
+    # Move every track forward to frame_index and return the confirmed tracks as (ids, boxes)
+    def predict(self, frame_index):
+        with self.lock:
+            self.advance(frame_index)
+            return self.confirmed()
+
+    # Move on to frame_index without moving the tracks, for frames of a scene the motion gate found unchanged: nobody
+    # moved, so the tracks keep their boxes and lose their velocity
+    def hold(self, frame_index):
+        with self.lock:
+            self.velocities[:] = 0
+            self.frame_index = frame_index if self.frame_index is None else max(frame_index, self.frame_index)
+            return self.confirmed()
+
+    # Match the detected boxes of frame_index to the tracks, and return the confirmed tracks as (ids, boxes)
+    def update(self, frame_index, detections, now=None):
+        now = time.time() if now is None else now
+        detections = np.asarray(detections, dtype=np.float32).reshape(-1, 4)
+        with self.lock:
+            self.roll_interval(now)
+            self.advance(frame_index)
+            steps = max(frame_index - self.last_update_index, 1) if self.last_update_index is not None else 1
+            self.last_update_index = frame_index
+            track_indices, detection_indices = self.match(detections)
+            # Correct the matched tracks towards their detections
+            residuals = detections[detection_indices] - self.boxes[track_indices]
+            self.boxes[track_indices] += self.alpha * residuals
+            self.velocities[track_indices] += self.beta * residuals / steps
+            self.hits[track_indices] += 1
+            self.misses[track_indices] = 0
+            self.predicted_frames[track_indices] = 0
+            newly_confirmed = int(np.count_nonzero(self.hits[track_indices] == self.min_hits))
+            # Unmatched tracks miss a detection; those that missed too many are removed
+            unmatched = np.ones(len(self.ids), dtype=bool)
+            unmatched[track_indices] = False
+            self.misses[unmatched] += 1
+            keep = self.misses <= self.max_misses
+            exited = int(np.count_nonzero(~keep & (self.hits >= self.min_hits)))
+            self.ids, self.boxes, self.velocities = self.ids[keep], self.boxes[keep], self.velocities[keep]
+            self.hits, self.misses, self.predicted_frames = self.hits[keep], self.misses[keep], self.predicted_frames[keep]
+            # Unmatched detections start new tracks
+            new = np.ones(len(detections), dtype=bool)
+            new[detection_indices] = False
+            new_count = int(np.count_nonzero(new))
+            self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + new_count)])
+            self.next_id += new_count
+            self.boxes = np.concatenate([self.boxes, detections[new]])
+            self.velocities = np.concatenate([self.velocities, np.zeros((new_count, 4), dtype=np.float32)])
+            self.hits = np.concatenate([self.hits, np.ones(new_count, dtype=np.int32)])
+            self.misses = np.concatenate([self.misses, np.zeros(new_count, dtype=np.int32)])
+            self.predicted_frames = np.concatenate([self.predicted_frames, np.zeros(new_count, dtype=np.int32)])
+            if self.min_hits <= 1:
+                newly_confirmed += new_count
+            self.unique_visitors += newly_confirmed
+            self.entries += newly_confirmed
+            self.interval_entries += newly_confirmed
+            self.exits += exited
+            self.interval_exits += exited
+            return self.confirmed()
+
+    # Number of people currently tracked
+    def count(self):
+        with self.lock:
+            return int(np.count_nonzero(self.hits >= self.min_hits))
+
+    # Extrapolate every track to frame_index, up to max_prediction_frames after its last match
+    def advance(self, frame_index):
+        if self.frame_index is not None and frame_index > self.frame_index:
+            steps = np.clip(self.max_prediction_frames - self.predicted_frames, 0, frame_index - self.frame_index)
+            self.boxes += self.velocities * steps[:, None]
+            self.predicted_frames += steps
+        self.frame_index = frame_index if self.frame_index is None else max(frame_index, self.frame_index)
+
+    # Greedy matching, best IoU first, then nearest centre for the tracks and detections that are left
+    def match(self, detections):
+        track_indices, detection_indices = [], []
+        if len(self.ids) and len(detections):
+            scores = iou(self.boxes, detections)
+            scores[scores < self.iou_threshold] = 0
+            distances = centroid_distances(self.boxes, detections)
+            distances[distances > self.max_centroid_distance] = np.inf
+            for cost, valid in ((-scores, scores > 0), (distances, np.isfinite(distances))):
+                cost = np.where(valid, cost, np.inf)
+                cost[track_indices, :] = np.inf
+                cost[:, detection_indices] = np.inf
+                for flat_index in np.argsort(cost, axis=None):
+                    track, detection = np.unravel_index(flat_index, cost.shape)
+                    if not np.isfinite(cost[track, detection]):
+                        break
+                    if track in track_indices or detection in detection_indices:
+                        continue
+                    track_indices.append(int(track))
+                    detection_indices.append(int(detection))
+        return np.array(track_indices, dtype=np.int64), np.array(detection_indices, dtype=np.int64)
+
+    def confirmed(self):
+        confirmed = self.hits >= self.min_hits
+        return self.ids[confirmed], self.boxes[confirmed].copy()
+
+    # Start a new entries/exits interval every interval_seconds
+    def roll_interval(self, now):
+        if self.interval_start is None:
+            self.interval_start = now
+        elif now - self.interval_start >= self.interval_seconds:
+            self.last_interval = {"start": self.interval_start, "entries": self.interval_entries, "exits": self.interval_exits}
+            self.interval_start = now
+            self.interval_entries = 0
+            self.interval_exits = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "people": int(np.count_nonzero(self.hits >= self.min_hits)),
+                "tracks": len(self.ids),
+                "unique_visitors": self.unique_visitors,
+                "entries": self.entries,
+                "exits": self.exits,
+                "interval_entries": self.interval_entries,
+                "interval_exits": self.interval_exits,
+                "last_interval": self.last_interval,
+            }
+
+# Intersection over union of every box in a with every box in b
+def iou(a, b):
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-6)
+
+# Distance between the centres of every box in a and every box in b, in diagonals of the box in a
+def centroid_distances(a, b):
+    centres_a = (a[:, :2] + a[:, 2:]) / 2
+    centres_b = (b[:, :2] + b[:, 2:]) / 2
+    diagonals = np.maximum(np.linalg.norm(a[:, 2:] - a[:, :2], axis=1), 1)
+    return np.linalg.norm(centres_a[:, None, :] - centres_b[None, :, :], axis=2) / diagonals[:, None]
@@ -50,4 +50,15 @@ def visualize(image, detection_result) -> np.ndarray:
         cv2.putText(image, result_text, text_location, cv2.FONT_HERSHEY_PLAIN,
                     FONT_SIZE, TEXT_COLOR, FONT_THICKNESS)
 
-    return image
\ No newline at end of file
+    return image
+def visualize_tracks(image, track_ids, boxes) -> np.ndarray:
+    TRACK_COLOR = (0, 0, 255)  # Red
+
+    for track_id, box in zip(track_ids, boxes):
+        # Draw the tracked box and its track ID
+        x1, y1, x2, y2 = (int(value) for value in box)
+        cv2.rectangle(image, (x1, y1), (x2, y2), TRACK_COLOR, 3)
+        cv2.putText(image, f'person #{track_id}', (MARGIN + x1, MARGIN + ROW_SIZE + y1), cv2.FONT_HERSHEY_PLAIN,
+                    FONT_SIZE, TRACK_COLOR, FONT_THICKNESS)
+
+    return image
@@ -17,30 +17,35 @@
 # https://github.com/raspberrypi/picamera2/blob/main/examples/mjpeg_server.py
 
 import io
+import json
 import logging
 import socketserver
 from http import server
-from threading import Condition, Thread
-import time
+from threading import Condition
 import cv2
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe.tasks.python import vision
-from utils import visualize
 import os
 from dotenv import load_dotenv
-import sqlite3
 import argparse
-from datetime import datetime
 from picamera2 import Picamera2
 from picamera2.encoders import JpegEncoder
 from picamera2.outputs import FileOutput
-import matplotlib.pyplot as plt
-import pytz
+import sys
+
+# storage.py and deadband.py are shared with the hub: they sit next to this file on the Raspberry Pi and one directory up in the repo
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import open_database
+from deadband import parse_deadband_config
+from detection import DetectionPipeline, RUNNING_MODES
+from snapshot import SnapshotWriter, SNAPSHOT_FORMATS
+from motion import MotionGate
+from tracker import PersonTracker
+from aggregation import PersonCountWindows, COUNT_STATISTICS
 
 # Load environment variables from .env file
 load_dotenv()
 CAMERA_IDENTIFIER_NO = os.getenv("CAMERA_IDENTIFIER_NO")
+# A person count is only stored when it changes or when the CAMERA heartbeat interval passed (DEADBAND_CONFIG, see deadband.py)
+DEADBANDS = parse_deadband_config(os.getenv("DEADBAND_CONFIG"))
 
 #####
 # MJPEG Web Server
@@ -168,6 +173,14 @@ class StreamingHandler(server.BaseHTTPRequestHandler):
                     self.wfile.write(b'\r\n')
             except Exception as e:
                 logging.warning('Removed streaming client %s: %s', self.client_address, str(e))
+        elif self.path == '/stats.json':
+            # Items, dropped frames, rate and time per frame of every detection stage
+            content = json.dumps(pipeline.stats() if pipeline is not None else {}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', len(content))
+            self.end_headers()
+            self.wfile.write(content)
         else:
             self.send_error(404)
             self.end_headers()
@@ -180,23 +193,10 @@ class StreamingServer(socketserver.ThreadingMixIn, server.HTTPServer):
 # Person Detection with MediaPipe
 #####
 
-# Create the database if it doesn't exist
-def attempt_create_db():
-    try: 
-        mydb = sqlite3.connect("processor.db")
-        mycursor = mydb.cursor()
-        query = "CREATE TABLE IF NOT EXISTS sensordb(readingDate TIMESTAMP, sensorIdentifier CHAR, reading NUMERIC, sent INTEGER)"
-        mycursor.execute(query)
-        mydb.commit()
-        mydb.close()
-    except:
-        mydb.close()
-
 # Global variables
 webcam = None
 output = StreamingOutput()
-COUNTER, FPS = 0, 0
-START_TIME = time.time()
+pipeline = None
 
 # Initialize the USB webcam
 def initialize_camera():
@@ -216,107 +216,42 @@ def initialize_camera():
     print("Webcam initialized successfully.")
 
 
-def run_detection(model: str, max_results: int, score_threshold: float) -> None:
-    """Continuously run inference on images acquired from the camera.
+def run_detection(model: str, max_results: int, score_threshold: float, running_mode: str = "image",
+                  snapshot_writer: SnapshotWriter = None, motion_gate: MotionGate = None, tracker: PersonTracker = None,
+                  detect_every: int = 1, count_windows: PersonCountWindows = None) -> DetectionPipeline:
+    """Start running inference on images acquired from the camera.
+
+    Capture, inference, persistence and overlay each run on their own thread (see detection.py); snapshots are saved
+    in the background by snapshot_writer.
 
     Args:
         model: Name of the TFLite object detection model.
         max_results: Max number of detection results.
         score_threshold: The score threshold of detection results.
+        running_mode: "image" (detect each frame synchronously) or "live_stream" (detect_async on the newest frame).
+        snapshot_writer: Saves the detection frames its policy keeps, or None to save none.
+        motion_gate: Skips the detector on frames of an unchanged scene, or None to detect every frame.
+        tracker: Tracks people between detections and counts them, or None to count the detections of each frame.
+        detect_every: Run the detector on every detect_every-th frame and move the tracked boxes forward in between.
+        count_windows: Aggregates the person counts into the windows stored in the database (10 second maxima if None).
     """
-    global FPS, COUNTER, START_TIME
-
-    # Visualization parameters
-    row_size = 50  # pixels
-    left_margin = 24  # pixels
-    text_color = (0, 0, 0)  # black
-    font_size = 0.6
-    font_thickness = 1
-
-    output_dir = 'detection_results'
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Initialize the object detection model
-    base_options = python.BaseOptions(model_asset_path=model)
-    options = vision.ObjectDetectorOptions(
-        base_options=base_options,
-        running_mode=vision.RunningMode.IMAGE,
-        max_results=max_results,
-        score_threshold=score_threshold
-    )
-    detector = vision.ObjectDetector.create_from_options(options)
-
-    while True:
-        # Capture frame from webcam
+    # Capture frames from the webcam, resized for faster inference
+    def capture():
         ret, frame = webcam.read()
         if not ret:
-            print("Error: Failed to capture image.")
-            break
-
-        # Optionally resize for faster processing
-        frame = cv2.resize(frame, (320, 240))  # Smaller size for faster inference
-
-        # Convert the frame from BGR to RGB as required by the TFLite model
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=rgb_frame)
-
-        # Run object detection
-        detection_result = detector.detect(mp_image)
-
-        # Count the number of people detected
-        person_count = sum(1 for detection in detection_result.detections if detection.categories[0].category_name == "person")
-
-        # Log the number of people detected
-        print(f"People detected: {person_count}")
-
-        # Insert person count into the database
-        try:
-            with sqlite3.connect("processor.db") as mydb:
-                mycursor = mydb.cursor()
-                singapore_tz = pytz.timezone('Asia/Singapore')
-                current_time = datetime.now(singapore_tz).strftime("%Y-%m-%d %H:%M:%S")
-                query = "INSERT INTO sensordb(readingDate, sensorIdentifier, reading, sent) VALUES (?, ?, ?, ?)"
-                mycursor.execute(query, (current_time, CAMERA_IDENTIFIER_NO, person_count, 0))
-                mydb.commit()
-                print(f"Inserted person count {person_count} into database")
-        except sqlite3.Error as e:
-            print(f"Error inserting into database: {e}")
-
-        # Show the FPS and count
-        COUNTER += 1
-        if COUNTER % 10 == 0:
-            FPS = 10 / (time.time() - START_TIME)
-            START_TIME = time.time()
-
-        fps_text = f'FPS = {FPS:.1f}'
-        count_text = f'count = {person_count}'
-        cv2.putText(frame, fps_text, (left_margin, row_size), cv2.FONT_HERSHEY_SIMPLEX,
-                    font_size, text_color, font_thickness, cv2.LINE_AA)
-        cv2.putText(frame, count_text, (left_margin, row_size * 2), cv2.FONT_HERSHEY_SIMPLEX,
-                    font_size, text_color, font_thickness, cv2.LINE_AA)
-
-        # Visualize results if available
-        if detection_result:
-            frame = visualize(frame, detection_result)
-
-        # Encode the frame as JPEG and write it to output for streaming
-        _, jpeg_frame = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 70])  # Set quality to 70
-        output.write(jpeg_frame.tobytes())
-
-        # Save every detection frame if desired
-        if frame is not None:
-            try:
-                timestamp = datetime.now(pytz.timezone('Asia/Singapore')).strftime("%Y%m%d_%H%M%S_%f")
-                filepath = os.path.join(output_dir, f'detection_{timestamp}.png')
-                plt.imsave(filepath, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                print(f"Frame saved to {filepath}")
-            except Exception as e:
-                print(f"Error saving detection frame: {e}")
-
-    # Release the webcam when done
-    webcam.release()
-
-
+            raise RuntimeError("Failed to capture image.")
+        return cv2.resize(frame, (320, 240))
+
+    # The database is opened once; person counts are aggregated and each closed window is written in one transaction
+    mydb = open_database()
+    count_windows = count_windows or PersonCountWindows()
+    # The overlay frames are JPEG encoded into the stream
+    pipeline = DetectionPipeline(capture, model, max_results, score_threshold, mydb, CAMERA_IDENTIFIER_NO, DEADBANDS,
+                                 snapshot_writer, count_windows, stream_output=output,
+                                 running_mode=running_mode, motion_gate=motion_gate,
+                                 tracker=tracker, detect_every=detect_every)
+    pipeline.start()
+    return pipeline
 
 #####
 # Main
@@ -341,15 +276,83 @@ def main():
         required=False,
         type=float,
         default=0.35)
+    parser.add_argument(
+        '--runningMode',
+        help='MediaPipe running mode: image runs detect() on every frame, live_stream runs detect_async() on the newest frame only.',
+        required=False,
+        choices=list(RUNNING_MODES),
+        default='image')
+    parser.add_argument(
+        '--snapshotFormat',
+        help='Image format of the detection snapshots.',
+        required=False,
+        choices=list(SNAPSHOT_FORMATS),
+        default='jpg')
+    parser.add_argument(
+        '--snapshotIntervalSeconds',
+        help='Save a snapshot at least this often (0 to only save on person count changes).',
+        required=False,
+        type=float,
+        default=60)
+    parser.add_argument(
+        '--snapshotThresholds',
+        help='Comma separated person counts; a snapshot is saved whenever the count crosses one of them, instead of on every count change.',
+        required=False,
+        default='')
+    parser.add_argument(
+        '--snapshotQuotaMb',
+        help='Disk space for snapshots; the oldest are deleted beyond it (0 for no limit).',
+        required=False,
+        type=float,
+        default=500)
+    parser.add_argument(
+        '--motionThreshold',
+        help='Fraction of pixels that must change for the detector to run on a frame (0 to detect every frame).',
+        required=False,
+        type=float,
+        default=0.01)
+    parser.add_argument(
+        '--maxStaleSeconds',
+        help='Run the detector at least this often, even on an unchanged scene.',
+        required=False,
+        type=float,
+        default=10)
+    parser.add_argument(
+        '--detectEvery',
+        help='Run the detector on every n-th frame and track people in between.',
+        required=False,
+        type=int,
+        default=3)
+    parser.add_argument(
+        '--noTracking',
+        help='Count the people detected in each frame instead of tracking them (the detector runs on every frame).',
+        action='store_true')
+    parser.add_argument(
+        '--countWindowSeconds',
+        help='Length of the windows the person counts are aggregated over before they are stored.',
+        required=False,
+        type=float,
+        default=10)
+    parser.add_argument(
+        '--countStatistic',
+        help='Statistic of each window that is stored as the camera reading and uploaded (all are kept in person_count_windows).',
+        required=False,
+        choices=list(COUNT_STATISTICS),
+        default='max')
     args = parser.parse_args()
 
-    attempt_create_db()
     initialize_camera()
 
-    # Start the detection thread
-    detection_thread = Thread(target=run_detection, args=(args.model, int(args.maxResults), args.scoreThreshold))
-    detection_thread.daemon = True
-    detection_thread.start()
+    # Start the detection stages
+    global pipeline
+    snapshot_writer = SnapshotWriter('detection_results', image_format=args.snapshotFormat,
+                                     interval_seconds=args.snapshotIntervalSeconds,
+                                     count_thresholds=[int(count) for count in args.snapshotThresholds.split(',') if count],
+                                     quota_bytes=int(args.snapshotQuotaMb * 1024 * 1024))
+    motion_gate = MotionGate(args.motionThreshold, max_stale_seconds=args.maxStaleSeconds) if args.motionThreshold > 0 else None
+    tracker = None if args.noTracking else PersonTracker()
+    pipeline = run_detection(args.model, int(args.maxResults), args.scoreThreshold, args.runningMode, snapshot_writer,
+                             motion_gate, tracker, args.detectEvery, PersonCountWindows(args.countWindowSeconds, args.countStatistic))
 
     # Start the streaming server
     try:
@@ -358,6 +361,7 @@ def main():
         print("Server started at http://localhost:8000")
         server.serve_forever()
     finally:
+        pipeline.stop()
         webcam.release()
 
 if __name__ == '__main__':
@@ -0,0 +1,71 @@
+import json
+
+# Deadband reporting: a sensor's smoothed reading is only stored (and uploaded) when it moved more than its type's
+# absolute or relative threshold away from the last reading that was reported, or when heartbeatSeconds passed since then.
+# Sensor types are the backend's SensorTypeEnum values. absolute is in the unit the hub uploads (raw micro:bit values for
+# SOIL_MOISTURE and LIGHT); relative is a fraction of the last reported reading (0 disables it); a heartbeatSeconds of 0
+# reports every reading.
+DEFAULT_DEADBANDS = {
+    "TEMPERATURE": {"absolute": 0.5, "relative": 0, "heartbeatSeconds": 600},
+    "HUMIDITY": {"absolute": 1.0, "relative": 0, "heartbeatSeconds": 600},
+    "SOIL_MOISTURE": {"absolute": 8, "relative": 0, "heartbeatSeconds": 900},
+    "LIGHT": {"absolute": 4, "relative": 0.05, "heartbeatSeconds": 600},
+    # Any change of the person count is reported
+    "CAMERA": {"absolute": 0, "relative": 0, "heartbeatSeconds": 300},
+}
+# Short names accepted in DEADBAND_CONFIG, as used by microbit_simulator.py
+SENSOR_TYPE_ALIASES = {"TEMP": "TEMPERATURE", "SOIL": "SOIL_MOISTURE"}
+
+# Deadbands per sensor type: DEFAULT_DEADBANDS updated with a JSON object such as
+# {"SOIL": {"absolute": 15}, "LIGHT": {"heartbeatSeconds": 300}}. The string "off" reports every reading.
+def parse_deadband_config(config):
+    if config is not None and config.strip().lower() == "off":
+        return dict()
+    deadbands = {sensor_type: dict(deadband) for sensor_type, deadband in DEFAULT_DEADBANDS.items()}
+    for sensor_type, deadband in (json.loads(config) if config else dict()).items():
+        sensor_type = SENSOR_TYPE_ALIASES.get(sensor_type.upper(), sensor_type.upper())
+        unknown_keys = set(deadband) - {"absolute", "relative", "heartbeatSeconds"}
+        if unknown_keys:
+            raise ValueError(f"Unknown deadband setting(s) for {sensor_type}: {', '.join(sorted(unknown_keys))}")
+        deadbands.setdefault(sensor_type, {"absolute": 0, "relative": 0, "heartbeatSeconds": 0}).update(deadband)
+    return deadbands
+
+# Decides which readings of each sensor are reported. Sensors whose type has no deadband report every reading.
+class DeadbandFilter:
+    def __init__(self, deadbands=None):
+        self.deadbands = DEFAULT_DEADBANDS if deadbands is None else deadbands
+        self.sensor_deadbands = dict()  # sensor -> deadband of its type
+        self.last_reported = dict()  # sensor -> (epoch milliseconds, reading) of the last reported reading
+        self.readings_seen = 0
+        self.readings_reported = 0
+
+    # Set the type of every sensor (sensor -> SensorTypeEnum, from the backend's polling config)
+    def configure(self, sensor_types):
+        self.sensor_deadbands = {sensor: self.deadbands[sensor_type] for sensor, sensor_type in (sensor_types or dict()).items()
+                                 if sensor_type in self.deadbands}
+        self.last_reported = {sensor: last for sensor, last in self.last_reported.items() if sensor in self.sensor_deadbands}
+
+    def should_report(self, sensor, time_ms, reading):
+        self.readings_seen += 1
+        deadband = self.sensor_deadbands.get(sensor)
+        last = self.last_reported.get(sensor)
+        if deadband is not None and last is not None and deadband["heartbeatSeconds"]:
+            change = abs(reading - last[1])
+            moved = change > deadband["absolute"] or (deadband["relative"] and change > deadband["relative"] * abs(last[1]))
+            if not moved and time_ms - last[0] < deadband["heartbeatSeconds"] * 1000:
+                return False
+        if deadband is not None:
+            self.last_reported[sensor] = (time_ms, reading)
+        self.readings_reported += 1
+        return True
+
+    # The readings of one poll result ({sensor: {"time", "reading"}}) that are to be reported
+    def filter(self, sensor_values):
+        return {sensor: data for sensor, data in sensor_values.items() if self.should_report(sensor, data["time"], data["reading"])}
+
+    def stats(self):
+        return {
+            "readings_seen": self.readings_seen,
+            "readings_reported": self.readings_reported,
+            "reported_percent": round(100 * self.readings_reported / self.readings_seen, 1) if self.readings_seen else None,
+        }
@@ -0,0 +1,230 @@
+import argparse
+import json
+import multiprocessing
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from backend_client import BackendClient, CircuitBreaker
+from upload_encoder import UploadEncoder
+
+# Load generator for the backend's hub ingestion path. Creates N virtual hubs with a mix of sensors and drives them
+# concurrently through what a hub does after an outage: verifyHubInitialization, getHubDataTransmissionRate, the empty
+# push that returns its sensors, then its whole backlog as signed, gzip-compressed pushSensorReadings chunks built like
+# hub.py builds them. Reports throughput, latency percentiles and error rates per route.
+# Runs against a backend started locally (--baseUrl http://localhost:3333/api, with hubs that exist there, see
+# --hubIdentifiers) or, by default, against backend_simulator.py started in this process.
+# Usage: python3 fleet_simulator.py [--hubs 200] [--backlogMinutes 60] [--concurrency 64] [--processes 4]
+
+# Same chunk size as hub.py's OUTBOX_CHUNK_ROWS
+CHUNK_ROWS = 500
+# Sensor types with their share of a park's sensors and a reading generator (initial value, random walk step, min, max)
+SENSOR_MIX = {
+    "TEMPERATURE": (0.3, (29.0, 0.3, 15.0, 40.0)),
+    "HUMIDITY": (0.25, (75.0, 0.8, 30.0, 100.0)),
+    "SOIL_MOISTURE": (0.25, (550.0, 4.0, 0.0, 1023.0)),
+    "LIGHT": (0.15, (120.0, 10.0, 0.0, 255.0)),
+    "CAMERA": (0.05, (3.0, 1.0, 0.0, 40.0)),
+}
+ROUTES = ["verifyHubInitialization", "getHubDataTransmissionRate", "pushSensorReadings"]
+
+def pick_sensor_types(rng, count):
+    return rng.choices(list(SENSOR_MIX), weights=[share for share, _ in SENSOR_MIX.values()], k=count)
+
+# Readings of every sensor once per poll over the backlog, oldest first, in the order the hub's outbox holds them.
+# Smoothed readings are full precision floats, except the camera's person counts.
+def generate_backlog(rng, sensors, sensor_types, backlog_minutes, poll_seconds, now_ms):
+    values = {sensor: SENSOR_MIX[sensor_types[sensor]][1][0] for sensor in sensors}
+    polls = int(backlog_minutes * 60 / poll_seconds)
+    for poll in range(polls):
+        reading_date = now_ms - int((polls - poll) * poll_seconds * 1000)
+        for sensor in sensors:
+            sensor_type = sensor_types[sensor]
+            _, step, minimum, maximum = SENSOR_MIX[sensor_type][1]
+            values[sensor] = min(max(values[sensor] + rng.uniform(-step, step), minimum), maximum)
+            yield sensor, reading_date, round(values[sensor]) if sensor_type == "CAMERA" else values[sensor]
+
+# The rows of one chunk grouped by sensor, like storage.iter_readings_by_sensor
+def group_by_sensor(rows):
+    grouped = dict()
+    for row in rows:
+        grouped.setdefault(row[0], []).append(row)
+    return [row for sensor_rows in grouped.values() for row in sensor_rows]
+
+class VirtualHub:
+    def __init__(self, identifier, base_url, backlog_minutes, poll_seconds, json_backend, retries, deadline_seconds, seed):
+        self.identifier = identifier
+        self.backlog_minutes = backlog_minutes
+        self.poll_seconds = poll_seconds
+        self.json_backend = json_backend
+        self.deadline_seconds = deadline_seconds
+        self.rng = random.Random(seed)
+        # Every hub has its own connection pool, like a real hub
+        self.backend = BackendClient(base_url, retries=retries, pool_size=1)
+        self.records = []  # (route, ok, status or error name, seconds, readings, request bytes)
+        self.readings_pending = 0
+
+    def call(self, route, method, path, readings=0, data=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.backend.request(method, path, data=data, **kwargs)
+            result = response.status_code
+            ok = response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            response, result, ok = None, type(e).__name__, False
+        self.records.append((route, ok, result, time.perf_counter() - started, readings, len(data) if data else 0))
+        return response if ok else None
+
+    def push(self, encoder, rows):
+        body, count = encoder.encode(rows)
+        response = self.call("pushSensorReadings", "POST", f"/hubs/pushSensorReadings/{self.identifier}", count, data=body,
+                             headers={'content-type': 'application/json', 'content-encoding': 'gzip'})
+        return response.json() if response is not None else None
+
+    def run(self):
+        deadline = time.monotonic() + self.deadline_seconds
+        response = self.call("verifyHubInitialization", "PUT", "/hubs/verifyHubInitialization", json={"identifierNumber": self.identifier})
+        if response is None:
+            return self.finish()
+        encoder = UploadEncoder(response.json()["token"], self.json_backend)
+        self.call("getHubDataTransmissionRate", "GET", f"/hubs/getHubDataTransmissionRate/{self.identifier}")
+        # The first push is empty and returns the hub's sensors
+        result = self.push(encoder, ())
+        if result is None:
+            return self.finish()
+        sensors = result["sensors"]
+        sensor_types = dict(zip(sensors, pick_sensor_types(self.rng, len(sensors))))
+        backlog = list(generate_backlog(self.rng, sensors, sensor_types, self.backlog_minutes, self.poll_seconds, int(time.time() * 1000)))
+
+        # Chunks are retried with the hub's circuit breaker until they are accepted or the deadline passes
+        breaker = CircuitBreaker()
+        position = 0
+        while position < len(backlog) and time.monotonic() < deadline:
+            time.sleep(min(breaker.retry_delay(), max(deadline - time.monotonic(), 0)))
+            chunk = backlog[position:position + CHUNK_ROWS]
+            if self.push(encoder, group_by_sensor(chunk)) is None:
+                breaker.record_failure()
+                continue
+            breaker.record_success()
+            position += len(chunk)
+        self.readings_pending = len(backlog) - position
+        return self.finish()
+
+    def finish(self):
+        self.backend.close()
+        return {"records": self.records, "readings_pending": self.readings_pending, "client": self.backend.stats()}
+
+# Runs a share of the fleet on a thread pool; the entry point of every worker process
+def run_hubs(hub_identifiers, base_url, backlog_minutes, poll_seconds, json_backend, retries, deadline_seconds, concurrency, seed):
+    hubs = [VirtualHub(identifier, base_url, backlog_minutes, poll_seconds, json_backend, retries, deadline_seconds, seed + index)
+            for index, identifier in enumerate(hub_identifiers)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(VirtualHub.run, hubs))
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else None
+
+def summarize(results, wall_time):
+    records = [record for result in results for record in result["records"]]
+    summary = {
+        "hubs": len(results),
+        "hubs_drained": sum(1 for result in results if result["readings_pending"] == 0 and any(record[0] == "pushSensorReadings" and record[1] for record in result["records"])),
+        "wall_seconds": round(wall_time, 1),
+        "requests_per_sec": round(len(records) / wall_time, 1),
+        "readings_per_sec": round(sum(record[4] for record in records if record[1]) / wall_time, 1),
+        "readings_pushed": sum(record[4] for record in records if record[1] and record[0] == "pushSensorReadings"),
+        "readings_pending": sum(result["readings_pending"] for result in results),
+        "upload_mb": round(sum(record[5] for record in records if record[0] == "pushSensorReadings") / 2 ** 20, 2),
+        "client_retries": sum(result["client"]["retries"] for result in results),
+        "routes": dict(),
+    }
+    for route in ROUTES:
+        route_records = [record for record in records if record[0] == route]
+        if not route_records:
+            continue
+        latencies = [record[3] for record in route_records]
+        errors = dict()
+        for record in route_records:
+            if not record[1]:
+                errors[str(record[2])] = errors.get(str(record[2]), 0) + 1
+        summary["routes"][route] = {
+            "requests": len(route_records),
+            "error_rate": round(sum(errors.values()) / len(route_records), 4),
+            "errors": errors,
+            "p50_ms": round(statistics.median(latencies) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "max_ms": round(max(latencies) * 1000, 1),
+        }
+    return summary
+
+def fleet(hub_identifiers, base_url, backlog_minutes, poll_seconds, json_backend, retries, deadline_seconds, concurrency, processes, seed):
+    started = time.perf_counter()
+    if processes <= 1:
+        results = run_hubs(hub_identifiers, base_url, backlog_minutes, poll_seconds, json_backend, retries, deadline_seconds, concurrency, seed)
+    else:
+        shares = [hub_identifiers[index::processes] for index in range(processes)]
+        with multiprocessing.Pool(processes) as pool:
+            results = [result for share in pool.starmap(run_hubs, [
+                (share, base_url, backlog_minutes, poll_seconds, json_backend, retries, deadline_seconds, max(concurrency // processes, 1), seed + index * len(hub_identifiers))
+                for index, share in enumerate(shares)]) for result in share]
+    return summarize(results, time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--baseUrl', default=None, help='API URL of a running backend, e.g. http://localhost:3333/api. By default a backend_simulator.py stand-in is started.')
+    parser.add_argument('--hubIdentifiers', default=None, help='Comma separated identifiers of hubs that exist on the backend (needed with --baseUrl).')
+    parser.add_argument('--hubs', type=int, default=50, help='Number of virtual hubs on the stand-in.')
+    parser.add_argument('--minSensors', type=int, default=5, help='Fewest sensors of a virtual hub on the stand-in.')
+    parser.add_argument('--maxSensors', type=int, default=30, help='Most sensors of a virtual hub on the stand-in.')
+    parser.add_argument('--backlogMinutes', type=float, default=60, help='Minutes of readings every hub has to push, e.g. the length of a Wi-Fi outage.')
+    parser.add_argument('--pollSeconds', type=float, default=5, help='Seconds between the readings of a sensor.')
+    parser.add_argument('--concurrency', type=int, default=32, help='Hubs pushing at the same time.')
+    parser.add_argument('--processes', type=int, default=1, help='Processes the hubs are spread over.')
+    parser.add_argument('--retries', type=int, default=3, help='Retries of every request by the hubs\' BackendClient.')
+    parser.add_argument('--deadlineSeconds', type=float, default=600, help='Time after which a hub stops retrying its backlog.')
+    parser.add_argument('--jsonBackend', default="json", choices=["json", "orjson"], help='JSON backend of the upload encoder.')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds the stand-in adds to every request.')
+    parser.add_argument('--errorRate', type=float, default=0.0, help='Probability that a stand-in request fails.')
+    parser.add_argument('--timeoutRate', type=float, default=0.0, help='Probability that a stand-in response is held back past the hub\'s timeout.')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed.')
+    parser.add_argument('--json', action='store_true', help='Print the result as JSON.')
+    args = parser.parse_args()
+
+    simulator = None
+    if args.baseUrl:
+        if not args.hubIdentifiers:
+            parser.error("--hubIdentifiers is needed with --baseUrl")
+        base_url, hub_identifiers = args.baseUrl, args.hubIdentifiers.split(",")
+    else:
+        from backend_simulator import BackendSimulator
+        rng = random.Random(args.seed)
+        hubs = {f"HB-{10000 + index}": [f"SE-{index:04d}{sensor:02d}" for sensor in range(rng.randint(args.minSensors, args.maxSensors))]
+                for index in range(args.hubs)}
+        simulator = BackendSimulator(hubs, auto_register=False, latency=args.latency, error_rate=args.errorRate,
+                                     timeout_rate=args.timeoutRate, timeout_seconds=15, seed=args.seed)
+        base_url, hub_identifiers = simulator.start(), list(hubs)
+    try:
+        summary = fleet(hub_identifiers, base_url, args.backlogMinutes, args.pollSeconds, args.jsonBackend, args.retries,
+                        args.deadlineSeconds, args.concurrency, args.processes, args.seed)
+        if simulator is not None:
+            summary["backend"] = simulator.stats()
+    finally:
+        if simulator is not None:
+            simulator.stop()
+    if args.json:
+        print(json.dumps(summary))
+        return
+    routes = summary.pop("routes")
+    backend_stats = summary.pop("backend", None)
+    print(", ".join(f"{key}={value}" for key, value in summary.items()))
+    for route, stats in routes.items():
+        print(f"{route}: " + ", ".join(f"{key}={value}" for key, value in stats.items()))
+    if backend_stats:
+        print("stand-in: " + ", ".join(f"{key}={value}" for key, value in backend_stats.items() if not key.startswith("latency")))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Binary framing for the hub <-> gateway micro:bit serial link, negotiated at start up with the text command "bin".
+# Every frame is: MAGIC | payload length (1 byte) | frame type (1 byte) | payload | checksum (1 byte)
+# where the checksum is the XOR of the length, type and payload bytes. Text lines can still be interleaved with frames,
+# e.g. for sensors whose index the gateway does not know yet.
+MAGIC = 0xA5
+FRAME_OVERHEAD = 4
+MAX_PAYLOAD_LENGTH = 255
+
+# gateway -> hub: sensor index (1 byte) + value (float32, little endian)
+FRAME_READING = 0x01
+# hub -> gateway: radio group (1 byte), then for every sensor: index (1 byte), identifier length (1 byte), identifier
+FRAME_BCT = 0x02
+# hub -> gateway: sensor indices to poll (1 byte each); an empty payload polls every sensor
+FRAME_POLL = 0x03
+# hub -> gateway: switch back to the text protocol
+FRAME_TEXT_MODE = 0x7E
+# gateway -> hub: binary framing accepted, payload is the protocol version (1 byte)
+FRAME_HELLO = 0x7F
+
+READING_PAYLOAD = struct.Struct("<Bf")
+READING_FRAME_SIZE = FRAME_OVERHEAD + READING_PAYLOAD.size
+# Largest sensor index that fits in a frame
+MAX_SENSOR_INDEX = 255
+
+if np is not None:
+    READING_FRAME_DTYPE = np.dtype([("magic", "u1"), ("length", "u1"), ("type", "u1"), ("index", "u1"), ("value", "<f4"), ("checksum", "u1")])
+
+def checksum(data):
+    result = 0
+    for byte in data:
+        result ^= byte
+    return result
+
+def encode_frame(frame_type, payload=b""):
+    if len(payload) > MAX_PAYLOAD_LENGTH:
+        raise ValueError(f"Frame payload too long ({len(payload)} bytes)")
+    body = bytes((len(payload), frame_type)) + payload
+    return bytes((MAGIC,)) + body + bytes((checksum(body),))
+
+def encode_reading_frame(index, value):
+    return encode_frame(FRAME_READING, READING_PAYLOAD.pack(index, value))
+
+# One bct frame can carry many sensors; sensors that do not fit are carried by further frames
+def encode_bct_frames(radioGroup, indexed_sensors):
+    frames = []
+    payload = bytearray((radioGroup,))
+    for index, sensorIdentifier in indexed_sensors:
+        identifier = sensorIdentifier.encode()
+        entry = bytes((index, len(identifier))) + identifier
+        if len(payload) + len(entry) > MAX_PAYLOAD_LENGTH:
+            frames.append(encode_frame(FRAME_BCT, bytes(payload)))
+            payload = bytearray((radioGroup,))
+        payload += entry
+    if len(payload) > 1:
+        frames.append(encode_frame(FRAME_BCT, bytes(payload)))
+    return frames
+
+def decode_bct_payload(payload):
+    radioGroup, position, sensors = payload[0], 1, []
+    while position + 2 <= len(payload):
+        index, length = payload[position], payload[position + 1]
+        sensors.append((index, payload[position + 2:position + 2 + length].decode("utf-8", errors="replace")))
+        position += 2 + length
+    return radioGroup, sensors
+
+def encode_poll_frame(indices=()):
+    return encode_frame(FRAME_POLL, bytes(indices))
+
+# Splits a serial byte stream into text lines, readings and other frames, keeping incomplete data for the next call
+class FrameDecoder:
+    def __init__(self):
+        self._pending = b""
+        self._text_partial = b""
+        self.checksum_errors = 0
+
+    # Returns (text lines, reading indices, reading values, other frames as (type, payload))
+    def feed(self, data):
+        buffer = self._pending + data
+        lines, indices, values, frames = [], [], [], []
+        position = 0
+        while position < len(buffer):
+            start = buffer.find(MAGIC, position)
+            if start < 0:
+                self._add_text(buffer[position:], lines)
+                position = len(buffer)
+                break
+            self._add_text(buffer[position:start], lines)
+            position = start
+            if len(buffer) - start < FRAME_OVERHEAD:
+                break
+            end = start + FRAME_OVERHEAD + buffer[start + 1]
+            if end > len(buffer):
+                break
+            if buffer[start + 2] == FRAME_READING and buffer[start + 1] == READING_PAYLOAD.size:
+                count = self._decode_readings(buffer, start, indices, values)
+                if count:
+                    position = start + count * READING_FRAME_SIZE
+                    continue
+            if checksum(buffer[start + 1:end - 1]) == buffer[end - 1]:
+                frames.append((buffer[start + 2], buffer[start + 3:end - 1]))
+                position = end
+            else:
+                # Not a valid frame after all: treat the magic byte as noise and resynchronise on the next one
+                self.checksum_errors += 1
+                position = start + 1
+        self._pending = buffer[position:]
+        return lines, indices, values, frames
+
+    def _add_text(self, data, lines):
+        if not data:
+            return
+        *complete_lines, self._text_partial = (self._text_partial + data).split(b"\n")
+        lines.extend(complete_lines)
+
+    # Decode the run of consecutive, valid reading frames starting at start and return how many there were
+    def _decode_readings(self, buffer, start, indices, values):
+        available = (len(buffer) - start) // READING_FRAME_SIZE
+        if np is not None and available > 1:
+            frames = np.frombuffer(buffer, dtype=READING_FRAME_DTYPE, count=available, offset=start)
+            raw = np.frombuffer(buffer, dtype=np.uint8, count=available * READING_FRAME_SIZE, offset=start).reshape(available, READING_FRAME_SIZE)
+            valid = (frames["magic"] == MAGIC) & (frames["length"] == READING_PAYLOAD.size) & (frames["type"] == FRAME_READING)
+            valid &= np.bitwise_xor.reduce(raw[:, 1:-1], axis=1) == frames["checksum"]
+            count = available if valid.all() else int(np.argmin(valid))
+            indices.extend(frames["index"][:count].tolist())
+            values.extend(frames["value"][:count].tolist())
+            return count
+
+        count = 0
+        for offset in range(start, start + available * READING_FRAME_SIZE, READING_FRAME_SIZE):
+            frame = buffer[offset:offset + READING_FRAME_SIZE]
+            if frame[0] != MAGIC or frame[1] != READING_PAYLOAD.size or frame[2] != FRAME_READING or checksum(frame[1:-1]) != frame[-1]:
+                break
+            index, value = READING_PAYLOAD.unpack_from(frame, 3)
+            indices.append(index)
+            values.append(value)
+            count += 1
+        return count
@@ -1,14 +1,21 @@
 import time
-from datetime import datetime, timedelta
-import sqlite3
+import asyncio
 import requests
 import json
-import hashlib
 import os
 from dotenv import load_dotenv
-import requests
 import sys
-import pytz
+from concurrent.futures import ThreadPoolExecutor
+import zlib
+import sqlite3
+from serial_ingest import SerialIngestThread
+from sensor_smoothing import SensorSmoother, get_smoothing_filter
+from polling_scheduler import PollingScheduler
+from deadband import DeadbandFilter, parse_deadband_config
+from backend_client import BackendClient, CircuitBreaker, CONNECT_TIMEOUT_SECONDS, READ_TIMEOUT_SECONDS
+from storage import open_database, insert_readings, iter_unsent_readings, iter_readings_by_sensor, get_acked_rowid, acknowledge_readings, maintain_database
+from upload_encoder import UploadEncoder
+from frame_codec import encode_bct_frames, encode_poll_frame, encode_frame, FRAME_TEXT_MODE, MAX_SENSOR_INDEX
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,56 +23,99 @@ load_dotenv()
 HUB_IDENTIFIER_NO = os.getenv("HUB_IDENTIFIER_NO")
 BACKEND_IP = os.getenv("BACKEND_IP")
 BACKEND_PORT = os.getenv("BACKEND_PORT")
+# One or more serial ports, comma separated, each with a gateway micro:bit plugged in
 COM_PORT = os.getenv("COM_PORT")
+# Comma separated radio group per gateway, required with more than one gateway: the backend only reserves the hub's own
+# radio group, so a group derived from it could belong to another hub in the park. A single gateway uses the hub's group.
+GATEWAY_RADIO_GROUPS = os.getenv("GATEWAY_RADIO_GROUPS")
+# "auto" negotiates compact binary framing with each gateway micro:bit and falls back to text lines if it does not answer;
+# "text" always uses text lines
+SERIAL_FRAMING = os.getenv("SERIAL_FRAMING", "auto")
 
 # Poll sensor data from micro:bits
+# Each sensor's interval adapts between the bounds from the backend's polling config; this is used for sensors without one
 NEXT_POLL_IN_SECONDS = 5
+# Maximum time a single poll cycle may take, after which whatever has been received is used
+POLL_CYCLE_TIMEOUT_SECONDS = 5
+# Maximum time to wait for replies to one "pol" command before sending the next one
+POLL_ROUND_TIMEOUT_SECONDS = 0.8
+# Gap between consecutive "bct" commands so the gateway micro:bit's serial buffer is not overrun
+BCT_COMMAND_GAP_SECONDS = 0.1
+# When at most this many sensors (and fewer than half of them) are due, they are polled one by one with "pol<ID>"
+# so the sensors that are not due stay quiet; otherwise a single "pol" polls every sensor
+TARGETED_POLL_MAX_SENSORS = 4
+# Sensors falling due within this many seconds of each other are polled in the same cycle
+POLL_COALESCE_SECONDS = 1
+# Poll results waiting for the sqlite writer; while sqlite keeps failing (e.g. a full SD card) the oldest are dropped beyond this
+POLL_RESULTS_QUEUE_SIZE = 120
+# Time to wait for a gateway micro:bit to answer "idn" with its own sensor identifier, or "bin" with a hello frame
+GATEWAY_IDENTIFY_TIMEOUT_SECONDS = 2
+# A gateway whose own sensor is not on the hub only counts as silent after receiving nothing at all for this long
+GATEWAY_SILENCE_SECONDS = 600
 
 # Backend URL
 BASE_URL = f'http://{BACKEND_IP}:{BACKEND_PORT}/api'  # Replace with your actual backend URL
 HEADERS = {'content-type': 'application/json'}
+# Every backend call goes through this client, which keeps the connection to the backend open between calls
+backend = BackendClient(BASE_URL,
+                        connect_timeout=float(os.getenv("BACKEND_CONNECT_TIMEOUT_SECONDS", CONNECT_TIMEOUT_SECONDS)),
+                        read_timeout=float(os.getenv("BACKEND_READ_TIMEOUT_SECONDS", READ_TIMEOUT_SECONDS)))
+
+# Maximum number of readings, and approximate JSON payload size, uploaded to the backend per request
+OUTBOX_CHUNK_ROWS = 500
+OUTBOX_CHUNK_BYTES = 64 * 1024
+# Upload requests are gzip-compressed; the backend inflates them (Content-Encoding: gzip)
+UPLOAD_HEADERS = {**HEADERS, 'content-encoding': 'gzip'}
+UPLOAD_GZIP_LEVEL = 6
+# JSON backend used to write upload payloads: "json" (same output as json.dumps) or "orjson" (faster, needs pip install orjson)
+UPLOAD_JSON_BACKEND = os.getenv("UPLOAD_JSON_BACKEND", "json")
+# Last sensors, radio group and polling config received from the backend
+HUB_STATE_FILE = "hub_state.json"
+# Raw readings are kept this many hours after they have been uploaded; after that only the 1 minute and 1 hour rollups stay
+RAW_RETENTION_HOURS = float(os.getenv("RAW_RETENTION_HOURS", "24"))
+# How often the database maintenance (rollups, retention, incremental vacuum) runs
+DATABASE_MAINTENANCE_INTERVAL_SECONDS = 600
+# A write or maintenance run that failed (e.g. the database stayed locked past the busy timeout or the SD card is full) is
+# retried after this delay, doubled after every further failure up to the maximum
+SQLITE_RETRY_INITIAL_SECONDS = 1
+SQLITE_RETRY_MAX_SECONDS = 60
 
 # Smoothing window size and weight for sensor readings
 SMOOTHING_WINDOW_SIZE = 5
 SMOOTHING_WEIGHT = 0.4
+# Filter used to report a sensor's reading: "ema", "median" (windowed median) or "envelope" (windowed min/max midpoint)
+SMOOTHING_FILTER = get_smoothing_filter(os.getenv("SMOOTHING_FILTER", "ema"))
+# A smoothed reading is only stored and uploaded when it moved past its sensor type's deadband, or when the type's heartbeat
+# interval passed (see deadband.py). DEADBAND_CONFIG overrides the defaults per type as JSON, or is "off".
+DEADBANDS = parse_deadband_config(os.getenv("DEADBAND_CONFIG"))
 
-ser = None
+serial_ports = []
 if COM_PORT:
     import serial
-    ser = serial.Serial(port=COM_PORT, baudrate=115200)
-    ser.timeout = 1
-
-# Create the database if it doesn't exist
-def attempt_create_db():
-    try: 
-        mydb = sqlite3.connect("processor.db")
-        mycursor = mydb.cursor()
-        query = "CREATE TABLE sensordb(readingDate TIMESTAMP, sensorIdentifier CHAR, reading NUMERIC, sent INTEGER)"
-        mycursor.execute(query)
-        mydb.commit()
-        mydb.close()
-    except:
-        mydb.close()
+    for port in COM_PORT.split(","):
+        if port.strip():
+            serial_port = serial.Serial(port=port.strip(), baudrate=115200)
+            serial_port.timeout = 1
+            serial_ports.append(serial_port)
+# Serial port of the first gateway, used when no port is given explicitly
+ser = serial_ports[0] if serial_ports else None
+if len(serial_ports) > 1 and len([group for group in (GATEWAY_RADIO_GROUPS or "").split(",") if group.strip()]) < len(serial_ports):
+    raise ValueError(f"GATEWAY_RADIO_GROUPS must give a radio group for each of the {len(serial_ports)} gateways in COM_PORT")
 
 # Send command to micro:bit via serial
-def sendCommand(command:str):
+def sendCommand(command:str, serial_port=None):
     command = command + '\n'
-    if ser is not None:
-        ser.write(str.encode(command))
-
-# Wait for response from micro:bit via serial
-def waitResponse():
-    response = None
-    if ser is not None:
-        response = ser.readline()
-    if response is not None and len(response) > 0:
-        return response.decode('utf-8').strip()
-    return None
-
-def clear_serial_buffer():
-    if ser is not None:
-        ser.reset_input_buffer()
-        ser.reset_output_buffer()
+    if serial_port is None:
+        serial_port = ser
+    if serial_port is not None:
+        serial_port.write(str.encode(command))
+
+# Send a binary frame to micro:bit via serial (only once binary framing has been negotiated)
+def sendFrame(frame:bytes, serial_port=None):
+    if serial_port is None:
+        serial_port = ser
+    if serial_port is not None:
+        serial_port.write(frame)
 
 # Global variables
 global NUMBER_OF_POLLS_BEFORE_UPDATE_BACKEND
@@ -73,79 +123,104 @@ NUMBER_OF_POLLS_BEFORE_UPDATE_BACKEND = 5  # Default value
 
 def get_data_transmission_rate():
     global NUMBER_OF_POLLS_BEFORE_UPDATE_BACKEND
-    response = requests.get(BASE_URL + f"/hubs/getHubDataTransmissionRate/{HUB_IDENTIFIER_NO}", timeout=5).json()
+    response = backend.get(f"/hubs/getHubDataTransmissionRate/{HUB_IDENTIFIER_NO}").json()
     print(response)
     NUMBER_OF_POLLS_BEFORE_UPDATE_BACKEND = response
     return response
 
-def poll_sensor_data_from_microbit(valid_sensors, radioGroup):
+# Get the sensor types of this hub and the polling interval bounds per sensor type (including overrides set on the hub)
+def get_polling_config():
+    try:
+        response = backend.get(f"/hubs/getHubPollingConfig/{HUB_IDENTIFIER_NO}")
+        if response.status_code == 200:
+            return response.json()
+        print(f"Error: Unable to fetch polling config, status code {response.status_code}")
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred while fetching polling config: {e}")
+    return None
+
+# Polls the given (due) sensors. sensor_count is the number of sensors on the hub, used to decide how to send "pol".
+# sensor_indices (sensor -> frame index) is given once binary framing has been negotiated with the gateway.
+# announce_sensors are the sensors that are sent their radio group with "bct" first (all of valid_sensors if None).
+async def poll_sensor_data_from_microbit(valid_sensors, radioGroup, ingest, data_event, smoothers, sensor_count=None, serial_port=None, sensor_indices=None, announce_sensors=None):
     if len(valid_sensors) == 0:
         return dict() 
     
     # Broadcast radio group and sensors
     # this sends the command to all micro:bits to set the radio group to the radioGroup variable and to send data back to the hub
-    for sensor in valid_sensors:
-        sendCommand("bct" + sensor + "|" + str(radioGroup))
-        time.sleep(0.1)
+    announce_sensors = valid_sensors if announce_sensors is None else announce_sensors
+    if sensor_indices is not None:
+        # Binary framing carries many sensors per bct frame, so the gap is only needed between frames
+        for frame in encode_bct_frames(radioGroup, [(sensor_indices[sensor], sensor) for sensor in announce_sensors]):
+            sendFrame(frame, serial_port)
+            await asyncio.sleep(BCT_COMMAND_GAP_SECONDS)
+    else:
+        for sensor in announce_sensors:
+            sendCommand("bct" + sensor + "|" + str(radioGroup), serial_port)
+            await asyncio.sleep(BCT_COMMAND_GAP_SECONDS)
 
-    # Allow more time for micro:bits to process commands
-    time.sleep(1)
+    print("Sending polling commands to micro:bits, waiting for valid response...")
 
-    # Clears buffer
-    clear_serial_buffer()
+    sensor_count = len(valid_sensors) if sensor_count is None else sensor_count
+    if sensor_indices is not None:
+        # A single poll frame can target any number of sensors
+        targeted_poll = len(valid_sensors) * 2 < sensor_count
+    else:
+        targeted_poll = len(valid_sensors) <= TARGETED_POLL_MAX_SENSORS and len(valid_sensors) * 2 < sensor_count
+
+    def has_enough_readings(counts):
+        return all(counts.get(sensor, 0) >= SMOOTHING_WINDOW_SIZE for sensor in valid_sensors)
+
+    loop = asyncio.get_running_loop()
+    # During this time we will repeatedly send the polling command
+    cycle_deadline = loop.time() + POLL_CYCLE_TIMEOUT_SECONDS
+    # Readings forwarded by the gateway since the previous cycle are already buffered and count towards this one
+    counts = ingest.unread_counts()
+
+    while not has_enough_readings(counts) and loop.time() < cycle_deadline:
+        if sensor_indices is not None:
+            sendFrame(encode_poll_frame([sensor_indices[sensor] for sensor in valid_sensors] if targeted_poll else []), serial_port)
+        elif targeted_poll:
+            for sensor in valid_sensors:
+                sendCommand("pol" + sensor, serial_port)
+                await asyncio.sleep(BCT_COMMAND_GAP_SECONDS)
+        else:
+            sendCommand("pol", serial_port)
+        round_start_counts = counts
+        round_deadline = min(loop.time() + POLL_ROUND_TIMEOUT_SECONDS, cycle_deadline)
 
-    print("Sending polling commands to micro:bits, waiting for valid response...")
+        # Start the next round as soon as every sensor has replied to this one
+        while True:
+            data_event.clear()
+            counts = ingest.unread_counts()
+            if has_enough_readings(counts) or all(counts.get(sensor, 0) > round_start_counts.get(sensor, 0) for sensor in valid_sensors):
+                break
+            try:
+                await asyncio.wait_for(data_event.wait(), timeout=max(round_deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                counts = ingest.unread_counts()
+                break
+
+    if has_enough_readings(counts):
+        print("All sensors have reported with enough readings. Stopping poll.")
 
+    # Feed every new reading into the sensor's smoothing state, which carries over from previous poll cycles.
+    # Readings from sensors that are not due (e.g. replies to a broadcast "pol") still update their state but are not reported.
     poll_result = dict()
-    start_time = time.time()
-    timeout = 5  # Set a timeout for polling, during this time we will repeatedly send the polling command
-
-    while time.time() - start_time < timeout:
-        sendCommand("pol")
-        time.sleep(0.5)
-
-        data = waitResponse()
-        if data:
-            print("Received data:", data)
-            sensorIdentifier = data.split("|")[0]
-            if sensorIdentifier in valid_sensors:
-                try:
-                    value = float(data.split("|")[1])
-
-                    if sensorIdentifier not in poll_result:
-                        singapore_tz = pytz.timezone('Asia/Singapore')
-                        poll_result[sensorIdentifier] = {
-                            "readings": [],
-                            "time": datetime.now(singapore_tz).strftime("%Y-%m-%d %H:%M:%S")
-                        }
-                    
-                    poll_result[sensorIdentifier]["readings"].append(value)
-                    
-                    # Keep only the last SMOOTHING_WINDOW_SIZE readings
-                    poll_result[sensorIdentifier]["readings"] = poll_result[sensorIdentifier]["readings"][-SMOOTHING_WINDOW_SIZE:]
-                    
-                    print(f"Valid reading received for sensor {sensorIdentifier}")
-                    if len(poll_result) == len(valid_sensors) and all(len(sensor_data["readings"]) >= SMOOTHING_WINDOW_SIZE for sensor_data in poll_result.values()):
-                        print("All sensors have reported with enough readings. Stopping poll.")
-                        break
-                except:
-                    print(f"Invalid reading format for sensor {sensorIdentifier}")
-            else:
-                print(f"Received data from invalid sensor: {sensorIdentifier}")
-        time.sleep(0.3)
-
-    # Calculate smoothed readings
-    for sensorIdentifier, sensor_data in poll_result.items():
-        print("Smoothing readings for sensor: ", sensorIdentifier)
-        readings = sensor_data["readings"]
-        if len(readings) > 0:
-            # Calculate exponential moving average
-            ema = readings[0]
-            for reading in readings[1:]:
-                ema = ema * (1 - SMOOTHING_WEIGHT) + reading * SMOOTHING_WEIGHT
-            poll_result[sensorIdentifier]["reading"] = ema
-        else:
-            poll_result[sensorIdentifier]["reading"] = None
+    due_sensors = set(valid_sensors)
+    for sensorIdentifier, readings in ingest.snapshot().items():
+        smoother = smoothers.get(sensorIdentifier)
+        if smoother is None:
+            smoother = smoothers[sensorIdentifier] = SensorSmoother(SMOOTHING_WINDOW_SIZE, SMOOTHING_WEIGHT)
+        for timestamp, value in readings:
+            smoother.update(value)
+        if sensorIdentifier not in due_sensors:
+            continue
+        poll_result[sensorIdentifier] = {
+            "reading": SMOOTHING_FILTER(smoother),
+            # epoch milliseconds of the sensor's latest reading
+            "time": int(readings[-1][0] * 1000)
+        }
 
     if len(poll_result) == 0:
         print("No valid sensor readings received within the timeout period.")
@@ -153,62 +228,81 @@ def poll_sensor_data_from_microbit(valid_sensors, radioGroup):
         print(f"Polling completed! Received data from {len(poll_result)} sensor(s).")
     return poll_result
 
-# Send sensor readings to the backend
+# Build one upload chunk from the outbox, bounded by OUTBOX_CHUNK_ROWS and OUTBOX_CHUNK_BYTES, signed and gzip-compressed on its own.
+# Returns (request body, number of readings, readingId of the last row covered or None, whether the outbox is now empty).
+# Rows of sensors that are not in valid_sensors (inactive, removed or unregistered on the backend) are not sent but are
+# covered by the chunk, so they never hold up the other sensors' readings; they are logged and stay in the local database
+# until the raw retention deletes them.
+def build_upload_chunk(conn, valid_sensors, encoder):
+    valid_sensors = set(valid_sensors)
+    start = get_acked_rowid(conn)
+    # First pass: find the rows that fit in the chunk
+    payload_bytes = 2
+    row_count = 0
+    last_rowid = None  # readingId of the last row covered by this chunk
+    chunk_sensors = set()
+    full = False
+    skipped = dict()  # sensor not in valid_sensors -> rows of it covered by this chunk
+    for readingId, readingDate, sensorIdentifier, reading in iter_unsent_readings(conn, OUTBOX_CHUNK_ROWS):
+        # Rows past the byte budget are left for the next chunk
+        if chunk_sensors and payload_bytes >= OUTBOX_CHUNK_BYTES:
+            full = True
+            break
+        row_count += 1
+        last_rowid = readingId
+        if sensorIdentifier not in valid_sensors:
+            skipped[sensorIdentifier] = skipped.get(sensorIdentifier, 0) + 1
+            continue
+        # Approximate size of the reading in the JSON payload ('{"readingDate": ..., "reading": ...}, ')
+        payload_bytes += len(str(readingDate)) + len(repr(reading)) + 33 + (0 if sensorIdentifier in chunk_sensors else len(sensorIdentifier) + 8)
+        chunk_sensors.add(sensorIdentifier)
+
+    # Second pass: stream the rows, grouped by sensor, into the encoder.
+    # The payload is a dictionary with sensor names as keys and a list of dictionaries as values. Each inner dictionary contains a readingDate (epoch milliseconds) and a reading.
+    if skipped:
+        print(f"Skipping {sum(skipped.values())} readings of sensors the backend does not list: " + ", ".join(f"{sensor} ({count})" for sensor, count in skipped.items()))
+    rows = (row for row in iter_readings_by_sensor(conn, start, last_rowid) if row[0] in valid_sensors) if last_rowid is not None else ()
+    body, reading_count = encoder.encode(rows)
+    return body, reading_count, last_rowid, not full and row_count < OUTBOX_CHUNK_ROWS
+
+# Post an upload chunk. Returns the backend's (valid sensors, radio group), or (None, None) if it did not accept the chunk.
+# Network errors are raised.
+def post_upload_chunk(body):
+    response = backend.post("/hubs/pushSensorReadings/" + HUB_IDENTIFIER_NO, 
+        headers = UPLOAD_HEADERS, 
+        data = body).json()
+
+    if "sensors" not in response:
+        print(f"Error: Unable to connect to hub or process response.")
+        return None, None  # Return None values to indicate an error
+    return response["sensors"], response["radioGroup"] if "radioGroup" in response else 255
+
+# Send sensor readings to the backend in chunks bounded by OUTBOX_CHUNK_ROWS and OUTBOX_CHUNK_BYTES.
+# Every chunk is acknowledged on its own, so a large backlog drains one chunk at a time.
 def push_sensor_readings_to_backend(valid_sensors, token, conn, is_first_time):
-    mycursor = conn.cursor()
-    # Only take readings that have not been sent to the backend
-    mycursor.execute('SELECT readingDate, sensorIdentifier, reading FROM sensordb WHERE sent = 0')
-    results = mycursor.fetchall()
-    
-    json_payload = dict()
-    for result in results:
-        # If the sensor is not in the valid_sensors list, skip it
-        if result[1] not in valid_sensors: continue
-        # If the sensor is already in the payload, append the reading to the existing list
-        if result[1] in json_payload:
-            json_payload[result[1]].append({
-                "readingDate": result[0],
-                "reading" : result[2]
-            })
-        # If the sensor is not in the payload, create a new list for it
-        #result[1] is the sensor identifier
+    encoder = UploadEncoder(token, UPLOAD_JSON_BACKEND, UPLOAD_GZIP_LEVEL)
+    while True:
+        # The first call only fetches the list of valid sensors, so it sends an empty payload and acknowledges nothing
+        if is_first_time:
+            (body, reading_count), last_rowid, drained = encoder.encode(()), None, True
         else:
-            json_payload[result[1]] = [{
-                "readingDate": result[0],
-                "reading" : result[2]
-            }]
+            body, reading_count, last_rowid, drained = build_upload_chunk(conn, valid_sensors, encoder)
+        valid_sensors, radioGroup = post_upload_chunk(body)
+        if valid_sensors is None:
+            return None, None
 
-    # json_payload consists of a dictionary with sensor names as keys and a list of dictionaries as values. Each inner dictionary contains a readingDate and a reading.
-    
-    json_payload_string = json.dumps(json_payload)
-    hash_obj = hashlib.sha256()
-    hash_obj.update((json_payload_string + token).encode())
-
-    response = requests.post(BASE_URL + "/hubs/pushSensorReadings/" + HUB_IDENTIFIER_NO, 
-        headers = HEADERS, 
-        json = {
-        "jsonPayloadString" : json_payload_string,
-        "sha256" : hash_obj.hexdigest()
-        }, 
-        timeout=5).json()
-    
-    if "sensors" in response:
         if is_first_time:
             print("Initial call: Fetched list of valid sensors from the backend.")
-        else:
-            while True:
-                try:
-                    mycursor.execute('UPDATE sensordb SET sent = 1 WHERE sent = 0')
-                    break
-                except:
-                    time.sleep(0.2)
+            break
+        # The rows in this chunk were accepted, or skipped as their sensors are not listed by the backend
+        if last_rowid is not None:
+            acknowledge_readings(conn, last_rowid)
+            print(f"Sent {reading_count} sensor readings ({len(body)} bytes compressed) to the backend server.")
+        if drained:
             print("All sensor readings have been sent to the backend server.")
-        valid_sensors = response["sensors"]
-    else:
-        print(f"Error: Unable to connect to hub or process response.")
-        return None, None  # Return None values to indicate an error
+            break
 
-    return valid_sensors, response["radioGroup"] if "radioGroup" in response else 255
+    return valid_sensors, radioGroup
 
 # Get the token from the SECRET file (in raspberry pi)
 def get_token():
@@ -219,7 +313,7 @@ def get_token():
 
 # Initialize connection to backend, backend will return a token
 def initialize_connection_to_backend():
-    endpoint = f"{BASE_URL}/hubs/verifyHubInitialization"
+    endpoint = "/hubs/verifyHubInitialization"
     
     # Prepare the payload
     payload = {
@@ -227,8 +321,8 @@ def initialize_connection_to_backend():
     }
     
     try:
-        print(f"Attempting to connect to {endpoint}")
-        response = requests.put(endpoint, json=payload, timeout=5)
+        print(f"Attempting to connect to {BASE_URL}{endpoint}")
+        response = backend.put(endpoint, json=payload)
     
         if response.status_code == 200:
             data = response.json()
@@ -251,9 +345,394 @@ def save_token(token):
     f = open("SECRET", "w")
     f.write(token)
 
+# Last sensors, radio group and polling config received from the backend, used while the backend cannot be reached
+def load_hub_state():
+    try:
+        with open(HUB_STATE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_hub_state(valid_sensors, radioGroup, polling_config):
+    try:
+        with open(HUB_STATE_FILE, "w") as f:
+            json.dump({"sensors": valid_sensors, "radioGroup": radioGroup, "pollingConfig": polling_config}, f)
+    except OSError as e:
+        print(f"Error saving hub state: {e}")
+
+# Get the hub's sensors, radio group and polling config at start up. If the backend cannot be reached, the last known
+# ones are used; if there are none yet, keep trying with backoff instead of exiting.
+def get_initial_hub_state(token, mydb):
+    breaker = CircuitBreaker()
+    while True:
+        try:
+            valid_sensors, radioGroup = push_sensor_readings_to_backend([], token, mydb, True)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"An error occurred while fetching sensors from the backend: {e}")
+            valid_sensors, radioGroup = None, None
+        if valid_sensors is not None:
+            polling_config = get_polling_config()
+            save_hub_state(valid_sensors, radioGroup, polling_config)
+            return valid_sensors, radioGroup, polling_config
+
+        hub_state = load_hub_state()
+        if hub_state is not None:
+            print("Backend unreachable: using the sensors from the last time it was reached.")
+            return hub_state["sensors"], hub_state["radioGroup"], hub_state["pollingConfig"]
+        breaker.record_failure()
+        delay = breaker.retry_delay()
+        print(f"Backend unreachable and no known sensors yet. Retrying in {delay:.0f} seconds...")
+        time.sleep(delay)
+
+# Insert one poll cycle's smoothed readings into the sqlite database as a single transaction
+def insert_sensor_readings(mydb, sensor_values):
+    insert_readings(mydb, [(data["time"], sensor_identifier, data["reading"]) for sensor_identifier, data in sensor_values.items()])
+    if len(sensor_values): print("Inserted records into SQLite database!\n")
+    else: print("No new sensor data to insert\n")
+
+# Radio group used by the gateway at the given index
+def gateway_radio_group(radioGroup, index):
+    if GATEWAY_RADIO_GROUPS:
+        return int(GATEWAY_RADIO_GROUPS.split(",")[index])
+    return radioGroup
+
+# Sensors of these types are not micro:bits (the camera stores its own person counts), so they are never polled over serial
+NON_SERIAL_SENSOR_TYPES = {"CAMERA"}
+
+# The valid sensors that are polled over serial, leaving out those the polling config gives a NON_SERIAL_SENSOR_TYPES type
+def serial_sensors(valid_sensors, polling_config):
+    sensor_types = (polling_config.get("sensorTypes") if polling_config else None) or dict()
+    return [sensor for sensor in valid_sensors if sensor_types.get(sensor) not in NON_SERIAL_SENSOR_TYPES]
+
+# Split the sensors across gateways. A gateway micro:bit's own sensor stays on that gateway; every other sensor is
+# placed by a stable hash of its identifier, so it keeps the same gateway (and radio group) across refreshes and restarts.
+def shard_sensors(sensors, gateways):
+    shards = [[] for _ in gateways]
+    pinned = {gateway.identity: index for index, gateway in enumerate(gateways) if gateway.identity}
+    for sensor in sensors:
+        index = pinned.get(sensor, zlib.crc32(sensor.encode()) % len(gateways))
+        shards[index].append(sensor)
+    return shards
+
+# Polls the sensors of one gateway micro:bit on its own serial port and radio group
+class GatewayWorker:
+    def __init__(self, index, serial_port):
+        self.index = index
+        self.serial_port = serial_port
+        self.identity = None
+        self.binary = False
+        self.sensor_indices = dict()
+        self.sensors = []
+        self.radioGroup = None
+        self.ingest = SerialIngestThread(serial_port)
+        self.data_event = asyncio.Event()
+        self.smoothers = dict()
+        self.scheduler = PollingScheduler(NEXT_POLL_IN_SECONDS)
+        self.schedule_changed = asyncio.Event()
+        self.deadband = DeadbandFilter(DEADBANDS)
+        # Radio group each sensor was last sent with "bct" and has answered on since
+        self.announced = dict()
+        self.dropped_poll_results = 0
+
+    def start(self):
+        self.ingest.notify(asyncio.get_running_loop(), self.data_event)
+        if self.serial_port is not None:
+            self.ingest.start()
+
+    def stop(self):
+        self.ingest.stop()
+
+    # Ask the gateway micro:bit for its own sensor identifier, so its sensor is never sharded to another gateway
+    async def identify(self):
+        if self.serial_port is None:
+            return None
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + GATEWAY_IDENTIFY_TIMEOUT_SECONDS
+        sendCommand("idn", self.serial_port)
+        while self.ingest.identity is None and loop.time() < deadline:
+            self.data_event.clear()
+            try:
+                await asyncio.wait_for(self.data_event.wait(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+        self.identity = self.ingest.identity
+        return self.identity
+
+    # Ask the gateway micro:bit to switch to binary framing; gateways running older code ignore "bin" and stay on text lines
+    async def negotiate_binary(self):
+        self.binary = False
+        if self.serial_port is None or SERIAL_FRAMING == "text":
+            return False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + GATEWAY_IDENTIFY_TIMEOUT_SECONDS
+        self.ingest.binary_version = None
+        # A restarted gateway may have lost the radio groups, so every sensor is sent its group again
+        self.announced.clear()
+        # A gateway still in binary mode from an earlier run only understands frames, so reset it to text first. The newline
+        # ends the frame as a line of its own for a gateway already in text mode, whose serial.readLine() would otherwise
+        # read it together with "bin" and never see the command.
+        sendFrame(encode_frame(FRAME_TEXT_MODE) + b"\n", self.serial_port)
+        await asyncio.sleep(BCT_COMMAND_GAP_SECONDS)
+        sendCommand("bin", self.serial_port)
+        while self.ingest.binary_version is None and loop.time() < deadline:
+            self.data_event.clear()
+            try:
+                await asyncio.wait_for(self.data_event.wait(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                break
+        self.binary = self.ingest.binary_version is not None
+        print(f"Gateway {self.index} serial framing: {'binary' if self.binary else 'text'}")
+        return self.binary
+
+    # Give every sensor a frame index that stays the same for as long as the sensor is on this gateway
+    def assign_sensor_indices(self, sensors):
+        self.sensor_indices = {sensor: index for sensor, index in self.sensor_indices.items() if sensor in sensors}
+        used_indices = set(self.sensor_indices.values())
+        next_index = 0
+        for sensor in sensors:
+            if sensor in self.sensor_indices:
+                continue
+            while next_index in used_indices:
+                next_index += 1
+            self.sensor_indices[sensor] = next_index
+            used_indices.add(next_index)
+        indexed_sensors = [None] * (max(used_indices) + 1 if used_indices else 0)
+        for sensor, index in self.sensor_indices.items():
+            indexed_sensors[index] = sensor
+        self.ingest.set_sensor_indices(indexed_sensors)
+
+    def configure(self, sensors, radioGroup, polling_config, now):
+        self.sensors = sensors
+        self.radioGroup = radioGroup
+        self.ingest.set_sensors(sensors)
+        self.assign_sensor_indices(sensors)
+        self.smoothers = {sensor: smoother for sensor, smoother in self.smoothers.items() if sensor in sensors}
+        # Sensors that are new or whose radio group changed are sent it with their next poll
+        self.announced = {sensor: group for sensor, group in self.announced.items() if sensor in sensors}
+        sensor_types = polling_config.get("sensorTypes") if polling_config else None
+        polling_intervals = polling_config.get("pollingIntervals") if polling_config else None
+        self.scheduler.configure(sensors, now, sensor_types, polling_intervals)
+        self.deadband.configure({sensor: sensor_type for sensor, sensor_type in (sensor_types or dict()).items() if sensor in sensors})
+        self.schedule_changed.set()
+
+    # Poll the due sensors. "bct" is only sent to the sensors that have not been sent the gateway's current radio group yet,
+    # or did not answer since (a sensor micro:bit that restarted is back on the unconfigured group).
+    async def poll(self, due_sensors):
+        # Frame indices are one byte, so a gateway with more sensors than that keeps using text lines
+        binary = self.binary and len(self.sensor_indices) <= MAX_SENSOR_INDEX + 1
+        announce_sensors = [sensor for sensor in due_sensors if self.announced.get(sensor) != self.radioGroup]
+        sensor_values = await poll_sensor_data_from_microbit(due_sensors, self.radioGroup, self.ingest, self.data_event, self.smoothers, len(self.sensors), self.serial_port, self.sensor_indices if binary else None, announce_sensors)
+        for sensor in due_sensors:
+            if sensor in sensor_values:
+                self.announced[sensor] = self.radioGroup
+            else:
+                self.announced.pop(sensor, None)
+        return sensor_values
+
+    # Whether the gateway itself stopped answering, as opposed to the due sensors: the gateway answers every poll of its
+    # own sensor, so a cycle that polled it and received nothing at all over serial means the gateway went silent. Without
+    # its own sensor on the hub, only GATEWAY_SILENCE_SECONDS without anything received counts.
+    def gateway_silent(self, due_sensors, lines_before):
+        if self.ingest.lines_received != lines_before:
+            return False
+        if self.identity in self.sensors:
+            return self.identity in due_sensors
+        last_received_time = self.ingest.last_received_time
+        return last_received_time is None or time.monotonic() - last_received_time >= GATEWAY_SILENCE_SECONDS
+
+    # Queue a poll result for the sqlite writer without holding up polling. When the writer has fallen
+    # POLL_RESULTS_QUEUE_SIZE results behind, the oldest queued result is dropped.
+    def put_poll_result(self, poll_results, sensor_values):
+        if poll_results.full():
+            dropped = poll_results.get_nowait()
+            self.dropped_poll_results += 1
+            print(f"Sqlite writer is behind: dropped a poll result of {len(dropped)} readings ({self.dropped_poll_results} dropped by gateway {self.index} so far)")
+        poll_results.put_nowait(sensor_values)
+
+    async def poll_timer(self, poll_results):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Sleep until the earliest sensor deadline, or until the sensor list or polling config changes
+            self.schedule_changed.clear()
+            next_due_time = self.scheduler.next_due_time()
+            timeout = None if next_due_time is None else max(next_due_time - loop.time(), 0)
+            try:
+                await asyncio.wait_for(self.schedule_changed.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            due_sensors = self.scheduler.pop_due(loop.time() + POLL_COALESCE_SECONDS)
+            if not due_sensors:
+                continue
+            # get the sensor values from the micro:bits
+            lines_before = self.ingest.lines_received
+            sensor_values = await self.poll(due_sensors)
+            # Readings that stayed within their deadband are dropped before they reach the database
+            self.put_poll_result(poll_results, self.deadband.filter(sensor_values))
+
+            # A gateway that went silent may have restarted in text mode, so negotiate the framing again
+            if self.binary and self.gateway_silent(due_sensors, lines_before):
+                await self.negotiate_binary()
+
+            # Sensors whose readings barely changed are polled less often, down to their type's maximum interval
+            now = loop.time()
+            for sensor in due_sensors:
+                smoother = self.smoothers.get(sensor)
+                spread = smoother.spread() if sensor in sensor_values and smoother is not None else None
+                self.scheduler.reschedule(sensor, spread, now)
+
+# Runs serial I/O, the poll timers of every gateway, sqlite writes and backend pushes as separate coroutines.
+# Every coroutine waits on a deadline, a queue or an event, so the hub is idle between polls.
+class HubRuntime:
+    def __init__(self, token, mydb, valid_sensors, radioGroup, polling_config=None):
+        self.token = token
+        self.mydb = mydb
+        self.valid_sensors = valid_sensors
+        self.radioGroup = radioGroup
+        self.polling_config = polling_config
+        self.gateways = [GatewayWorker(index, serial_port) for index, serial_port in enumerate(serial_ports or [None])]
+        # Poll results of every gateway go through one sqlite writer and one backend uploader
+        self.poll_results = asyncio.Queue(maxsize=POLL_RESULTS_QUEUE_SIZE)
+        # Upload requests from the sqlite writer. The readings themselves wait in the outbox, so one pending request is enough.
+        self.upload_requests = asyncio.Queue(maxsize=1)
+        self.breaker = CircuitBreaker()
+        self.upload_encoder = UploadEncoder(token, UPLOAD_JSON_BACKEND, UPLOAD_GZIP_LEVEL)
+        # All sqlite work runs on one thread so the connection is never used concurrently
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        # Backend requests run on their own thread, so polling and sqlite writes never wait for the network
+        self.upload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="uploader")
+
+    async def run_db(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.db_executor, function, *args)
+
+    async def run_upload(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.upload_executor, function, *args)
+
+    async def run(self):
+        for gateway in self.gateways:
+            gateway.start()
+        # Every gateway's own sensor is needed to shard the sensors and to tell when a gateway went silent
+        identities = await asyncio.gather(*(gateway.identify() for gateway in self.gateways))
+        print("Gateway micro:bits: ", identities)
+        # The first poll happens one interval after start up
+        self.configure_gateways(asyncio.get_running_loop().time() + NEXT_POLL_IN_SECONDS)
+        await asyncio.gather(*(gateway.negotiate_binary() for gateway in self.gateways))
+
+        tasks = [asyncio.create_task(gateway.poll_timer(self.poll_results)) for gateway in self.gateways]
+        tasks += [
+            asyncio.create_task(self.sqlite_writer()),
+            asyncio.create_task(self.backend_uploader()),
+            asyncio.create_task(self.database_maintainer()),
+        ]
+        try:
+            # None of the coroutines return; this only stops on an unexpected error
+            done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for gateway in self.gateways:
+                gateway.stop()
+            self.db_executor.shutdown(wait=True)
+            self.upload_executor.shutdown(wait=False, cancel_futures=True)
+
+    def configure_gateways(self, now):
+        for gateway, sensors in zip(self.gateways, shard_sensors(serial_sensors(self.valid_sensors, self.polling_config), self.gateways)):
+            gateway.configure(sensors, gateway_radio_group(self.radioGroup, gateway.index), self.polling_config, now)
+
+    async def sqlite_writer(self):
+        polls = 0
+        while True:
+            sensor_values = await self.poll_results.get()
+            # insert the sensor values into the sqlite database, keeping the batch until it is written; polling carries on
+            # and queues its results in the meantime
+            delay = SQLITE_RETRY_INITIAL_SECONDS
+            while True:
+                try:
+                    await self.run_db(insert_sensor_readings, self.mydb, sensor_values)
+                    break
+                except sqlite3.Error as e:
+                    print(f"Error inserting sensor readings into database, retrying in {delay} seconds: {e}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, SQLITE_RETRY_MAX_SECONDS)
+            polls += 1
+            # Every gateway completes its own poll cycles, so the push interval is counted in cycles per gateway
+            if polls >= NUMBER_OF_POLLS_BEFORE_UPDATE_BACKEND * len(self.gateways):
+                try:
+                    self.upload_requests.put_nowait(None)
+                except asyncio.QueueFull:
+                    pass  # an upload is already pending and will include these readings
+                polls = 0
+
+    # Drains the outbox whenever an upload is requested. Failures back off through the circuit breaker; while the backend
+    # is offline the hub keeps polling with the last known sensors and readings keep accumulating in the outbox.
+    async def backend_uploader(self):
+        while True:
+            await self.upload_requests.get()
+            while True:
+                delay = self.breaker.retry_delay()
+                if delay > 0:
+                    print(f"Backend upload failed {self.breaker.failures} time(s) in a row (circuit {self.breaker.state}), next attempt in {delay:.0f} seconds")
+                    await asyncio.sleep(delay)
+                try:
+                    drained = await self.upload_chunk()
+                except Exception as e:
+                    # Whatever goes wrong with an upload, polling and local storage carry on
+                    print(f"An error occurred while uploading sensor readings: {e}")
+                    drained = None
+                if drained is None:
+                    self.breaker.record_failure()
+                    continue
+                self.breaker.record_success()
+                if drained:
+                    break
+            print("Backend requests: ", backend.stats())
+            print("Deadband: ", [gateway.deadband.stats() for gateway in self.gateways])
+            polling_config = await self.run_upload(get_polling_config)
+            if polling_config is not None:
+                self.polling_config = polling_config
+            await asyncio.to_thread(save_hub_state, self.valid_sensors, self.radioGroup, self.polling_config)
+            self.configure_gateways(asyncio.get_running_loop().time())
+
+    # Upload one outbox chunk. Returns whether the outbox is now empty, or None if the backend did not accept the chunk.
+    async def upload_chunk(self):
+        # The chunk is read from sqlite and encoded on the sqlite thread
+        body, reading_count, last_rowid, drained = await self.run_db(build_upload_chunk, self.mydb, self.valid_sensors, self.upload_encoder)
+        valid_sensors, radioGroup = await self.run_upload(post_upload_chunk, body)
+        if valid_sensors is None:
+            return None
+        # The rows in this chunk were accepted, or skipped as their sensors are not listed by the backend
+        if last_rowid is not None:
+            await self.run_db(acknowledge_readings, self.mydb, last_rowid)
+            print(f"Sent {reading_count} sensor readings ({len(body)} bytes compressed) to the backend server.")
+        if valid_sensors != self.valid_sensors:
+            print("Sensors list refreshed: ", valid_sensors)
+        self.valid_sensors = valid_sensors
+        self.radioGroup = radioGroup
+        return drained
+
+    async def database_maintainer(self):
+        delay = SQLITE_RETRY_INITIAL_SECONDS
+        while True:
+            cutoff = int((time.time() - RAW_RETENTION_HOURS * 60 * 60) * 1000)
+            try:
+                deleted = await self.run_db(maintain_database, self.mydb, cutoff)
+            except sqlite3.Error as e:
+                # Every maintenance step commits its own chunks, so the next run picks up where this one failed
+                print(f"Error during database maintenance, retrying in {delay} seconds: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, DATABASE_MAINTENANCE_INTERVAL_SECONDS)
+                continue
+            delay = SQLITE_RETRY_INITIAL_SECONDS
+            if deleted:
+                print(f"Database maintenance: deleted {deleted} uploaded readings older than {RAW_RETENTION_HOURS} hours")
+            await asyncio.sleep(DATABASE_MAINTENANCE_INTERVAL_SECONDS)
+
 # Update the main_function to periodically check for new sensors
 def main_function():
-    attempt_create_db()
     token = get_token()
     if token is None:
         max_retries = 3
@@ -275,68 +754,24 @@ def main_function():
                     return  # Exit the main_function
 
     print("Starting program...\n")
-    mydb = sqlite3.connect("processor.db")
-    valid_sensors, radioGroup = push_sensor_readings_to_backend([], token, mydb, True)
-    if valid_sensors is None:
-        print("No valid sensors. Exiting...")
-        return  # Exit the main_function
-    if radioGroup is None:
-        print("Radio group not found. Exiting...")
-        return  # Exit the main_function
+    # Opened once for the hub's lifetime; all sqlite work then runs on the runtime's sqlite thread
+    mydb = open_database()
+    valid_sensors, radioGroup, polling_config = get_initial_hub_state(token, mydb)
     print("Valid sensors fetched: ", valid_sensors)
     print()
     
-    response = get_data_transmission_rate()
-    print("Data Transmission Rate (Polls) is: " + str(response))
     try:
-        polls = 0
-        singapore_tz = pytz.timezone('Asia/Singapore')
-        last_poll_time = datetime.now(singapore_tz)
-        while True:
-            current_time = datetime.now(singapore_tz)
-            if (current_time - last_poll_time).total_seconds() >= NEXT_POLL_IN_SECONDS:
-                polls += 1
-                # get the sensor values from the micro:bits
-                sensor_values = poll_sensor_data_from_microbit(valid_sensors, radioGroup)
-                mycursor = mydb.cursor()
-                
-                # insert the sensor values into the sqlite database
-                for sensor_identifier, data in sensor_values.items():
-                    reading = data["reading"]
-                    readingDate = data["time"]
-                    query = 'INSERT INTO sensordb(readingDate, sensorIdentifier, reading, sent) VALUES (?, ?, ?, ?)'
-                    val = (readingDate, sensor_identifier, reading, 0)
-
-                    while True:
-                        try:
-                            mycursor.execute(query, val)
-                            break
-                        except:
-                            time.sleep(0.2)
-
-                mydb.commit()
-                if len(sensor_values): print("Inserted records into SQLite database!\n")
-                else: print("No new sensor data to insert\n")
-
-                # send the sensor values to the backend
-                if polls >= NUMBER_OF_POLLS_BEFORE_UPDATE_BACKEND:
-                    valid_sensors, radioGroup = push_sensor_readings_to_backend(valid_sensors, token, mydb, False)
-                    print("Sensors list refreshed: ", valid_sensors)
-                    print()
-                    if valid_sensors is None:
-                        print("No valid sensors. Exiting...")
-                        break  # Exit the main_function
-                    if radioGroup is None:
-                        print("Radio group not found. Exiting...")
-                        break
-                    polls = 0
-
-                last_poll_time = current_time
-                time.sleep(0.5)
-
+        response = get_data_transmission_rate()
+        print("Data Transmission Rate (Polls) is: " + str(response))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Unable to fetch the data transmission rate, using {NUMBER_OF_POLLS_BEFORE_UPDATE_BACKEND} polls: {e}")
+    print("Polling config: ", polling_config)
+    try:
+        asyncio.run(HubRuntime(token, mydb, valid_sensors, radioGroup, polling_config).run())
     except KeyboardInterrupt:
-        if ser.is_open:
-            ser.close()
+        for serial_port in serial_ports:
+            if serial_port.is_open:
+                serial_port.close()
         print("Program terminated!")
 
     # Close the database connection before exiting
@@ -12,12 +12,110 @@ function substring (inputString: string, start: number, end: number) {
 input.onButtonPressed(Button.A, function () {
   basic.showString(sensorIdentifierNumber)
 })
+// Binary framing (negotiated by the hub with "bin"): 0xA5 | payload length | frame type | payload | XOR of length, type and payload
+function frameChecksum (frame: Buffer, length: number) {
+  let checksum = 0
+  for (let j = 1; j < length; j++) {
+      checksum = checksum ^ frame[j]
+  }
+  return checksum
+}
+function sendFrame (frameType: number, payload: Buffer) {
+  let frame = pins.createBuffer(payload.length + 4)
+  frame[0] = FRAME_MAGIC
+  frame[1] = payload.length
+  frame[2] = frameType
+  frame.write(3, payload)
+  frame[frame.length - 1] = frameChecksum(frame, frame.length - 1)
+  serial.writeBuffer(frame)
+}
+// Readings go to the hub as a sensor index + float32 frame when the index is known, otherwise as an "ID|value" line
+function sendReading (sender: string, value: number) {
+  let index = sensorIndices.indexOf(sender)
+  if (binaryMode && index >= 0) {
+      let payload = pins.createBuffer(5)
+      payload[0] = index
+      payload.setNumber(NumberFormat.Float32LE, 1, value)
+      sendFrame(FRAME_READING, payload)
+  } else {
+      serial.writeLine("" + sender + "|" + value)
+  }
+}
+function handleFrame (frameType: number, payload: Buffer) {
+  if (frameType == FRAME_BCT) {
+      // radio group, then for every sensor: index, identifier length, identifier
+      let group = payload[0]
+      let position = 1
+      while (position + 2 <= payload.length) {
+          let index = payload[position]
+          let identifier = payload.slice(position + 2, payload[position + 1]).toString()
+          position = position + 2 + payload[position + 1]
+          while (sensorIndices.length <= index) {
+              sensorIndices.push("")
+          }
+          sensorIndices[index] = identifier
+          if (identifier == sensorIdentifierNumber) {
+              radioGroup = group
+          } else {
+              // Radio strings are limited to 19 bytes, so every sensor still gets its own text bct
+              radio.setGroup(255)
+              radio.sendString("bct" + identifier + "|" + group)
+          }
+          basic.pause(BCT_RADIO_GAP_MS)
+      }
+      radio.setGroup(radioGroup)
+  } else if (frameType == FRAME_POLL) {
+      if (radioGroup == 255) {
+          return
+      }
+      // An empty poll frame polls every sensor, otherwise only the listed sensor indices
+      let pollSelf = payload.length == 0
+      if (pollSelf) {
+          radio.sendString("pol")
+      }
+      for (let k = 0; k < payload.length; k++) {
+          let target = sensorIndices[payload[k]]
+          if (target == sensorIdentifierNumber) {
+              pollSelf = true
+          } else if (target) {
+              radio.sendString("pol" + target)
+          }
+      }
+      if (pollSelf) {
+          sendReading(sensorIdentifierNumber, getSensorValues())
+      }
+  } else if (frameType == FRAME_TEXT_MODE) {
+      binaryMode = false
+  }
+}
+// Split the received bytes into frames, keeping an incomplete frame for the next call
+function handleFrames (received: Buffer) {
+  pendingFrameBytes = pendingFrameBytes.concat(received)
+  let start = 0
+  while (start < pendingFrameBytes.length) {
+      if (pendingFrameBytes[start] != FRAME_MAGIC) {
+          start++
+          continue
+      }
+      if (pendingFrameBytes.length - start < 4 || pendingFrameBytes.length - start < pendingFrameBytes[start + 1] + 4) {
+          break
+      }
+      let frame = pendingFrameBytes.slice(start, pendingFrameBytes[start + 1] + 4)
+      if (frameChecksum(frame, frame.length - 1) == frame[frame.length - 1]) {
+          handleFrame(frame[2], frame.slice(3, frame[1]))
+          start = start + frame.length
+      } else {
+          start++
+      }
+  }
+  pendingFrameBytes = pendingFrameBytes.slice(start)
+}
 radio.onReceivedValue(function (sender, value) {
   if (testingSerial) {
       serial.writeLine("Radio received: " + sender + ", " + value)
   }
   if (writeSerial) {
-      serial.writeLine("" + sender + "|" + value)
+      sendReading(sender, value)
   }
   return 0;
 })
@@ -48,7 +146,8 @@ radio.onReceivedString(function (receivedString) {
   paramsFromMicrobit = substring(receivedString, 3, receivedString.length)
   switch (commandFromMicrobit) {
       case 'pol':
-          if (radioGroup == 255) {
+          // "pol" polls every micro:bit in the radio group, "pol<ID>" only the micro:bit with that sensor identifier
+          if (radioGroup == 255 || (paramsFromMicrobit.length > 0 && paramsFromMicrobit != sensorIdentifierNumber)) {
               break;
           }
           let sensorValueSlave = getSensorValues();
@@ -64,6 +163,10 @@ radio.onReceivedString(function (receivedString) {
   }
 })
 serial.onDataReceived(serial.delimiters(Delimiters.NewLine), function () {
+  // In binary mode the background loop below reads the serial port
+  if (binaryMode) {
+      return
+  }
   data = serial.readLine()
   commandFromHub = substring(data, 0, 3)
   paramsFromHub = substring(data, 3, data.length)
@@ -73,8 +176,11 @@ serial.onDataReceived(serial.delimiters(Delimiters.NewLine), function () {
               break;
           }
           radio.sendString(data);
+          if (paramsFromHub.length > 0 && paramsFromHub != sensorIdentifierNumber) {
+              break;
+          }
           let sensorValueMaster = getSensorValues();
-          serial.writeLine(sensorIdentifierNumber + '|' + sensorValueMaster);
+          sendReading(sensorIdentifierNumber, sensorValueMaster);
           break;
       case 'bct':
           let paramsArrayMaster = paramsFromHub.split('|');
@@ -85,6 +191,18 @@ serial.onDataReceived(serial.delimiters(Delimiters.NewLine), function () {
           radio.sendString(data);
           radio.setGroup(radioGroup);
           break;
+      case 'idn':
+          // Lets a hub with several gateway micro:bits tell which sensor each serial port belongs to
+          serial.writeLine('idn' + sensorIdentifierNumber);
+          break;
+      case 'bin':
+          // Accept binary framing and reply with a hello frame carrying the protocol version
+          binaryMode = true
+          pendingFrameBytes = pins.createBuffer(0)
+          let hello = pins.createBuffer(1)
+          hello[0] = BINARY_PROTOCOL_VERSION
+          sendFrame(FRAME_HELLO, hello)
+          break;
   }
 })
 let tempString = ""
@@ -101,6 +219,17 @@ let sensorType: string;
 let writeSerial: boolean;
 let testingSerial: boolean;
 let radioGroup = 255
+let binaryMode = false
+let sensorIndices: string[] = []
+let pendingFrameBytes = pins.createBuffer(0)
+const FRAME_MAGIC = 0xA5
+const FRAME_READING = 0x01
+const FRAME_BCT = 0x02
+const FRAME_POLL = 0x03
+const FRAME_TEXT_MODE = 0x7E
+const FRAME_HELLO = 0x7F
+const BINARY_PROTOCOL_VERSION = 1
+const BCT_RADIO_GAP_MS = 20
 // ascii names
 sensorIdentifierNumber = "SE-88888"
 sensorType = "HUMIDITY"
@@ -109,6 +238,18 @@ testingSerial = false
 radio.setGroup(radioGroup)
 radio.setTransmitPower(7)
 basic.showIcon(IconNames.Yes)
+serial.setRxBufferSize(128)
 basic.forever(function () {
 
 })
+control.inBackground(function () {
+  while (true) {
+      if (binaryMode) {
+          let received = serial.readBuffer(0)
+          if (received.length > 0) {
+              handleFrames(received)
+          }
+      }
+      basic.pause(5)
+  }
+})
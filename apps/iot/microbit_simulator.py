@@ -0,0 +1,375 @@
+import argparse
+import heapq
+import json
+import os
+import random
+import select
+import threading
+import time
+import tty
+from frame_codec import FrameDecoder, decode_bct_payload, encode_frame, encode_reading_frame, MAGIC, FRAME_BCT, FRAME_POLL, FRAME_TEXT_MODE, FRAME_HELLO
+
+# Simulates the gateway micro:bit (and the sensor micro:bits it talks to over radio) on a pseudo-terminal,
+# speaking the same serial protocol as microbit.js:
+#   hub -> gateway: "bct<ID>|<group>" sets the radio group of sensor <ID>, "pol" polls every sensor in the group,
+#                   "pol<ID>" polls only sensor <ID>, "idn" asks the gateway for its own sensor identifier,
+#                   "bin" switches to the binary framing of frame_codec.py
+#   gateway -> hub: "<ID>|<value>" for every reading received over radio (and the gateway's own reading)
+
+# Sensor types cycled through when creating simulated sensors, with (initial value, random walk step, min, max)
+SENSOR_PROFILES = {
+    "TEMP": (28.0, 0.2, -5.0, 50.0),
+    "LIGHT": (120.0, 8.0, 0.0, 255.0),
+    "SOIL": (600.0, 3.0, 0.0, 1023.0),
+    "HUMIDITY": (70.0, 0.5, 0.0, 100.0),
+}
+UNCONFIGURED_RADIO_GROUP = 255
+# Time for a command to go over radio and for the reply to come back, before jitter is added
+RADIO_HOP_SECONDS = 0.004
+
+class SimulatedSensor:
+    def __init__(self, identifier, sensor_type, rng):
+        self.identifier = identifier
+        self.sensor_type = sensor_type
+        self.radio_group = UNCONFIGURED_RADIO_GROUP
+        self.rng = rng
+        self.value, self.step, self.minimum, self.maximum = SENSOR_PROFILES[sensor_type]
+
+    def read(self):
+        self.value = min(max(self.value + self.rng.uniform(-self.step, self.step), self.minimum), self.maximum)
+        # micro:bit sensor APIs return integers
+        return int(round(self.value))
+
+class MicrobitSimulator:
+    def __init__(self, sensor_count=10, jitter=0.02, loss=0.0, malformed=0.0, baudrate=115200, seed=None,
+                 identifier_prefix="SE-", sensor_identifiers=None):
+        self.rng = random.Random(seed)
+        sensor_types = list(SENSOR_PROFILES)
+        if sensor_identifiers is None:
+            sensor_identifiers = [f"{identifier_prefix}{10000 + i}" for i in range(sensor_count)]
+        self.sensors = [SimulatedSensor(identifier, sensor_types[i % len(sensor_types)], self.rng) for i, identifier in enumerate(sensor_identifiers)]
+        self.sensors_by_identifier = {sensor.identifier: sensor for sensor in self.sensors}
+        # The first sensor is the gateway micro:bit plugged into the hub
+        self.gateway = self.sensors[0] if self.sensors else None
+        self.jitter = jitter
+        self.loss = loss
+        self.malformed = malformed
+        self.seconds_per_byte = 10 / baudrate if baudrate else 0
+        self.master_fd = None
+        self.slave_fd = None
+        self.port_path = None
+        self.commands_received = 0
+        self.readings_sent = 0
+        self.readings_lost = 0
+        self.malformed_sent = 0
+        self.bytes_sent = 0
+        self.binary = False
+        self.sensor_indices = dict()  # sensor identifier -> frame index, learnt from bct frames
+        self._pending = []  # heap of (due time, sequence, bytes)
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._line_free_at = 0
+        self._capture = None
+        self._threads = []
+
+    def open(self):
+        self.master_fd, self.slave_fd = os.openpty()
+        tty.setraw(self.master_fd)
+        tty.setraw(self.slave_fd)
+        self.port_path = os.ttyname(self.slave_fd)
+        return self.port_path
+
+    def start(self, record_path=None):
+        if self.master_fd is None:
+            self.open()
+        if record_path:
+            self._capture = open(record_path, "w")
+        self._started_at = time.monotonic()
+        self._threads = [
+            threading.Thread(target=self._read_commands, daemon=True, name="microbit-sim-reader"),
+            threading.Thread(target=self._write_replies, daemon=True, name="microbit-sim-writer"),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self.port_path
+
+    def stop(self):
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        for fd in (self.master_fd, self.slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.master_fd = self.slave_fd = None
+        if self._capture:
+            self._capture.close()
+            self._capture = None
+
+    def stats(self):
+        return {
+            "sensors": len(self.sensors),
+            "commands_received": self.commands_received,
+            "readings_sent": self.readings_sent,
+            "readings_lost": self.readings_lost,
+            "malformed_sent": self.malformed_sent,
+            "bytes_sent": self.bytes_sent,
+            "binary": self.binary,
+        }
+
+    def handle_command(self, line):
+        self.commands_received += 1
+        self._record("down", line)
+        command, params = line[:3], line[3:]
+        if command == "bct":
+            identifier, _, group = params.partition("|")
+            try:
+                self._set_radio_group(identifier, int(group))
+            except ValueError:
+                return
+        elif command == "idn":
+            if self.gateway is not None:
+                self._schedule_line("idn" + self.gateway.identifier, time.monotonic())
+        elif command == "bin":
+            self.binary = True
+            self._schedule_bytes(encode_frame(FRAME_HELLO, bytes((1,))), time.monotonic())
+        elif command == "pol":
+            # "pol" polls every sensor in the group, "pol<ID>" only that sensor
+            self._poll(self.sensors if not params else [self.sensors_by_identifier[params]] if params in self.sensors_by_identifier else [])
+
+    def handle_frame(self, frame_type, payload):
+        self.commands_received += 1
+        self._record("down", frame=encode_frame(frame_type, payload))
+        if frame_type == FRAME_BCT:
+            radio_group, indexed_sensors = decode_bct_payload(payload)
+            for index, identifier in indexed_sensors:
+                self.sensor_indices[identifier] = index
+                self._set_radio_group(identifier, radio_group)
+        elif frame_type == FRAME_POLL:
+            if not payload:
+                self._poll(self.sensors)
+            else:
+                identifiers = {identifier for identifier, index in self.sensor_indices.items() if index in set(payload)}
+                self._poll([sensor for sensor in self.sensors if sensor.identifier in identifiers])
+        elif frame_type == FRAME_TEXT_MODE:
+            self.binary = False
+
+    def _set_radio_group(self, identifier, group):
+        # The gateway re-broadcasts bct on the unconfigured group, so only a sensor still on it can pick up its new group
+        sensor = self.sensors_by_identifier.get(identifier)
+        if sensor is not None and (sensor is self.gateway or sensor.radio_group == UNCONFIGURED_RADIO_GROUP):
+            sensor.radio_group = group
+
+    def _poll(self, polled):
+        if self.gateway is None or self.gateway.radio_group == UNCONFIGURED_RADIO_GROUP:
+            return
+        now = time.monotonic()
+        for sensor in polled:
+            if sensor is self.gateway:
+                # The gateway answers for itself straight away
+                self._schedule_reading(sensor, now)
+            elif sensor.radio_group == self.gateway.radio_group:
+                self._schedule_reading(sensor, now + RADIO_HOP_SECONDS + self.rng.uniform(0, self.jitter))
+
+    def _schedule_reading(self, sensor, due_time):
+        if self.rng.random() < self.loss:
+            self.readings_lost += 1
+            return
+        index = self.sensor_indices.get(sensor.identifier) if self.binary else None
+        if self.rng.random() < self.malformed:
+            self.malformed_sent += 1
+            if index is not None:
+                # Flip a bit in the value so the checksum no longer matches
+                frame = bytearray(encode_reading_frame(index, sensor.read()))
+                frame[5] ^= 0x10
+                self._schedule_bytes(bytes(frame), due_time)
+                return
+            line = self.rng.choice([f"{sensor.identifier}|", f"{sensor.identifier}|{sensor.read()}x", f"{sensor.identifier}", "|", f"Radio received: {sensor.identifier}"])
+        else:
+            self.readings_sent += 1
+            if index is not None:
+                self._schedule_bytes(encode_reading_frame(index, sensor.read()), due_time)
+                return
+            line = f"{sensor.identifier}|{sensor.read()}"
+        self._schedule_line(line, due_time)
+
+    def _schedule_line(self, line, due_time):
+        self._schedule_bytes((line + "\r\n").encode(), due_time)
+
+    def _schedule_bytes(self, data, due_time):
+        with self._condition:
+            heapq.heappush(self._pending, (due_time, self._sequence, data))
+            self._sequence += 1
+            self._condition.notify()
+
+    # Reads the downlink the way microbit.js does: in text mode serial.readLine() splits it at newlines only, so any bytes
+    # before a newline (a frame too) are part of that line; in binary mode only frames are read
+    def _read_commands(self):
+        decoder = FrameDecoder()
+        partial_line = b""
+        while not self._stopped.is_set():
+            try:
+                ready, _, _ = select.select([self.master_fd], [], [], 0.2)
+                if not ready:
+                    continue
+                data = os.read(self.master_fd, 4096)
+            except OSError:
+                break
+            while data:
+                if self.binary:
+                    _, _, _, frames = decoder.feed(data)
+                    data = b""
+                    for frame_type, payload in frames:
+                        self.handle_frame(frame_type, payload)
+                    continue
+                newline = data.find(b"\n")
+                if newline < 0:
+                    partial_line += data
+                    break
+                line = (partial_line + data[:newline]).decode("utf-8", errors="replace").strip()
+                partial_line, data = b"", data[newline + 1:]
+                if line:
+                    self.handle_command(line)
+                if self.binary:
+                    decoder = FrameDecoder()
+
+    def _write_replies(self):
+        while not self._stopped.is_set():
+            with self._condition:
+                while not self._stopped.is_set() and (not self._pending or self._pending[0][0] > time.monotonic()):
+                    timeout = self._pending[0][0] - time.monotonic() if self._pending else None
+                    self._condition.wait(timeout)
+                if self._stopped.is_set():
+                    break
+                _, _, data = heapq.heappop(self._pending)
+            # Lines leave the gateway no faster than the serial baud rate allows
+            now = time.monotonic()
+            if self._line_free_at > now:
+                time.sleep(self._line_free_at - now)
+            self._line_free_at = max(now, self._line_free_at) + len(data) * self.seconds_per_byte
+            try:
+                os.write(self.master_fd, data)
+            except OSError:
+                break
+            self.bytes_sent += len(data)
+            if data[0] == MAGIC:
+                self._record("up", frame=data)
+            else:
+                self._record("up", data.decode("utf-8", errors="replace").strip())
+
+    # Captures hold one entry per serial message: text lines as "line", binary frames as hex in "frame"
+    def _record(self, direction, line=None, frame=None):
+        if self._capture:
+            entry = {"t": round(time.monotonic() - self._started_at, 6), "dir": direction}
+            if frame is not None:
+                entry["frame"] = frame.hex()
+            else:
+                entry["line"] = line
+            self._capture.write(json.dumps(entry) + "\n")
+
+    # Replay the gateway -> hub lines of a capture with their original timing (relative to start)
+    def replay(self, capture_path, speed=1.0):
+        start = time.monotonic()
+        with open(capture_path) as capture:
+            for entry in map(json.loads, capture):
+                if entry["dir"] != "up":
+                    continue
+                if "frame" in entry:
+                    self._schedule_bytes(bytes.fromhex(entry["frame"]), start + entry["t"] / speed)
+                else:
+                    self._schedule_line(entry["line"], start + entry["t"] / speed)
+
+# Sit between the hub and a real gateway micro:bit, forwarding both directions and recording every message. Both directions
+# go through a FrameDecoder, so binary frames are recorded as hex under "frame" like the simulator's own captures.
+def record_serial_capture(real_port, capture_path, baudrate=115200):
+    import serial
+    device = serial.Serial(port=real_port, baudrate=baudrate, timeout=0.2)
+    proxy = MicrobitSimulator(sensor_count=0)
+    proxy.open()
+    started_at = time.monotonic()
+    lock = threading.Lock()
+    with open(capture_path, "w") as capture:
+        def log(direction, line=None, frame=None):
+            entry = {"t": round(time.monotonic() - started_at, 6), "dir": direction}
+            if frame is not None:
+                entry["frame"] = frame.hex()
+            else:
+                entry["line"] = line
+            with lock:
+                capture.write(json.dumps(entry) + "\n")
+                capture.flush()
+
+        def log_messages(direction, decoder, data):
+            lines, indices, values, frames = decoder.feed(data)
+            for line in lines:
+                # A frame sent with a newline after it (the text mode reset) leaves an empty line behind
+                if line.strip():
+                    log(direction, line.decode("utf-8", errors="replace").strip())
+            for index, value in zip(indices, values):
+                log(direction, frame=encode_reading_frame(index, value))
+            for frame_type, payload in frames:
+                log(direction, frame=encode_frame(frame_type, payload))
+
+        def hub_to_device():
+            decoder = FrameDecoder()
+            while True:
+                data = os.read(proxy.master_fd, 4096)
+                device.write(data)
+                log_messages("down", decoder, data)
+
+        threading.Thread(target=hub_to_device, daemon=True).start()
+        print(f"Recording {real_port} through {proxy.port_path} into {capture_path}. Press Ctrl+C to stop.")
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = device.read(device.in_waiting or 1)
+                if data:
+                    os.write(proxy.master_fd, data)
+                    log_messages("up", decoder, data)
+        except KeyboardInterrupt:
+            pass
+    device.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Simulate a gateway micro:bit and its sensors on a pseudo-terminal.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--sensors', type=int, default=10, help='Number of simulated sensor micro:bits.')
+    parser.add_argument('--sensorIdentifiers', default=None, help='Comma separated sensor identifiers (overrides --sensors).')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Maximum extra reply delay in seconds.')
+    parser.add_argument('--loss', type=float, default=0.0, help='Probability that a reading is lost over radio.')
+    parser.add_argument('--malformed', type=float, default=0.0, help='Probability that a reading line is malformed.')
+    parser.add_argument('--baudrate', type=int, default=115200, help='Serial baud rate to throttle replies to (0 to disable).')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed.')
+    parser.add_argument('--record', default=None, help='Write every serial line to this capture file.')
+    parser.add_argument('--replay', default=None, help='Replay the gateway lines of a capture file.')
+    parser.add_argument('--recordFrom', default=None, help='Record from a real gateway on this serial port instead of simulating.')
+    args = parser.parse_args()
+
+    if args.recordFrom:
+        record_serial_capture(args.recordFrom, args.record or "capture.jsonl")
+        return
+
+    sensor_identifiers = args.sensorIdentifiers.split(",") if args.sensorIdentifiers else None
+    simulator = MicrobitSimulator(args.sensors, args.jitter, args.loss, args.malformed, args.baudrate, args.seed,
+                                  sensor_identifiers=sensor_identifiers)
+    port_path = simulator.start(record_path=args.record)
+    print(f"Simulated gateway listening on {port_path} (set COM_PORT={port_path})")
+    print("Sensors: " + ",".join(sensor.identifier for sensor in simulator.sensors))
+    if args.replay:
+        simulator.replay(args.replay)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(simulator.stats())
+    finally:
+        simulator.stop()
+
+if __name__ == "__main__":
+    main()
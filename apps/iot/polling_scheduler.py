@@ -0,0 +1,74 @@
+import heapq
+
+# Factor a sensor's polling interval grows by after each poll in which its readings stayed within the change threshold
+INTERVAL_GROWTH = 1.5
+
+# Keeps every sensor's next-due deadline in a heap and adapts each sensor's interval to how much its readings change
+class PollingScheduler:
+    def __init__(self, default_interval_seconds):
+        # Used for sensors whose type has no polling config from the backend
+        self.default_bounds = (default_interval_seconds, default_interval_seconds, 0)
+        self.bounds = dict()  # sensor -> (min interval, max interval, change threshold)
+        self.intervals = dict()
+        self.due_times = dict()
+        self._heap = []  # (due time, sensor); entries whose due time no longer matches due_times are stale
+
+    # Set the polled sensors and their interval bounds. New sensors are due immediately, removed sensors are dropped.
+    def configure(self, sensors, now, sensor_types=None, polling_intervals=None):
+        sensor_types = sensor_types or dict()
+        polling_intervals = polling_intervals or dict()
+        bounds = dict()
+        for sensor in sensors:
+            config = polling_intervals.get(sensor_types.get(sensor))
+            if config:
+                minimum = config.get("minIntervalSeconds", self.default_bounds[0])
+                maximum = max(config.get("maxIntervalSeconds", minimum), minimum)
+                bounds[sensor] = (minimum, maximum, config.get("changeThreshold", 0))
+            else:
+                bounds[sensor] = self.default_bounds
+        self.bounds = bounds
+
+        for sensor in list(self.due_times):
+            if sensor not in bounds:
+                del self.due_times[sensor]
+                del self.intervals[sensor]
+        for sensor, (minimum, maximum, _) in bounds.items():
+            if sensor in self.due_times:
+                self.intervals[sensor] = min(max(self.intervals[sensor], minimum), maximum)
+            else:
+                self.intervals[sensor] = minimum
+                self._schedule(sensor, now)
+
+    def next_due_time(self):
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    # Remove and return every sensor whose deadline has passed, most overdue first
+    def pop_due(self, now):
+        due = []
+        self._discard_stale()
+        while self._heap and self._heap[0][0] <= now:
+            _, sensor = heapq.heappop(self._heap)
+            del self.due_times[sensor]
+            due.append(sensor)
+            self._discard_stale()
+        return due
+
+    # Schedule a polled sensor's next deadline. spread is how much its recent readings varied, or None if it did not report.
+    def reschedule(self, sensor, spread, now):
+        if sensor not in self.bounds:
+            return
+        minimum, maximum, change_threshold = self.bounds[sensor]
+        if spread is not None and spread <= change_threshold:
+            self.intervals[sensor] = min(self.intervals[sensor] * INTERVAL_GROWTH, maximum)
+        else:
+            self.intervals[sensor] = minimum
+        self._schedule(sensor, now + self.intervals[sensor])
+
+    def _schedule(self, sensor, due_time):
+        self.due_times[sensor] = due_time
+        heapq.heappush(self._heap, (due_time, sensor))
+
+    def _discard_stale(self):
+        while self._heap and self.due_times.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
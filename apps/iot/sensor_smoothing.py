@@ -0,0 +1,65 @@
+from array import array
+
+# Streaming smoothing state for one sensor, kept across poll cycles.
+# Every sample updates the EMA and the sliding window in O(1); the windowed filters are only evaluated when a reading is reported.
+class SensorSmoother:
+    __slots__ = ("weight", "window_size", "window", "window_index", "window_count", "ema", "samples")
+
+    def __init__(self, window_size, weight):
+        self.weight = weight
+        self.window_size = window_size
+        self.window = array('d', bytes(8 * window_size))
+        self.window_index = 0
+        self.window_count = 0
+        self.ema = None
+        self.samples = 0
+
+    def update(self, value):
+        # Exponential moving average, seeded with the first sample the hub ever received from this sensor
+        self.ema = value if self.ema is None else self.ema * (1 - self.weight) + value * self.weight
+        self.window[self.window_index] = value
+        self.window_index = (self.window_index + 1) % self.window_size
+        if self.window_count < self.window_size:
+            self.window_count += 1
+        self.samples += 1
+
+    def window_values(self):
+        return self.window[:self.window_count] if self.window_count < self.window_size else self.window
+
+    def median(self):
+        if self.window_count == 0:
+            return None
+        values = sorted(self.window_values())
+        middle = len(values) // 2
+        return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+    # Standard deviation of the sliding window, used to tell how quickly the sensor is changing
+    def spread(self):
+        if self.window_count == 0:
+            return None
+        values = self.window_values()
+        mean = sum(values) / len(values)
+        return (sum((value - mean) ** 2 for value in values) / len(values)) ** 0.5
+
+    # Lowest and highest value in the sliding window
+    def envelope(self):
+        if self.window_count == 0:
+            return None, None
+        values = self.window_values()
+        return min(values), max(values)
+
+    def envelope_midpoint(self):
+        minimum, maximum = self.envelope()
+        return None if minimum is None else (minimum + maximum) / 2
+
+# Filters that can be selected to produce the reported reading
+SMOOTHING_FILTERS = {
+    "ema": lambda smoother: smoother.ema,
+    "median": SensorSmoother.median,
+    "envelope": SensorSmoother.envelope_midpoint,
+}
+
+def get_smoothing_filter(name):
+    if name not in SMOOTHING_FILTERS:
+        raise ValueError(f"Unknown smoothing filter '{name}', expected one of: {', '.join(SMOOTHING_FILTERS)}")
+    return SMOOTHING_FILTERS[name]
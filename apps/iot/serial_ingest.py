@@ -0,0 +1,168 @@
+import math
+import threading
+import time
+from array import array
+from frame_codec import FrameDecoder, FRAME_HELLO
+
+# Number of unread readings kept per sensor before the oldest is overwritten
+RING_BUFFER_CAPACITY = 64
+
+# Fixed-size, array-backed buffer of (timestamp, value) readings for one sensor
+class SensorRingBuffer:
+    __slots__ = ("capacity", "timestamps", "values", "written", "consumed", "overwritten")
+
+    def __init__(self, capacity=RING_BUFFER_CAPACITY):
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.values = array('d', bytes(8 * capacity))
+        self.written = 0  # total number of readings ever appended
+        self.consumed = 0  # total number of readings handed out by drain()
+        self.overwritten = 0  # readings lost because the buffer filled up before being drained
+
+    def append(self, timestamp, value):
+        index = self.written % self.capacity
+        self.timestamps[index] = timestamp
+        self.values[index] = value
+        self.written += 1
+        if self.written - self.consumed > self.capacity:
+            self.consumed += 1
+            self.overwritten += 1
+
+    def unread(self):
+        return self.written - self.consumed
+
+    # Return the unread readings, oldest first, and mark them as read
+    def drain(self):
+        readings = [(self.timestamps[i % self.capacity], self.values[i % self.capacity]) for i in range(self.consumed, self.written)]
+        self.consumed = self.written
+        return readings
+
+# Drains the serial port continuously on its own thread and files every reading into its sensor's ring buffer.
+# Readings arrive as "ID|value" text lines or, once binary framing is negotiated, as reading frames carrying a sensor index.
+class SerialIngestThread(threading.Thread):
+    def __init__(self, serial_port, capacity=RING_BUFFER_CAPACITY):
+        super().__init__(daemon=True, name="serial-ingest")
+        self.serial_port = serial_port
+        self.capacity = capacity
+        self.buffers = dict()
+        self.lock = threading.Lock()
+        self.lines_received = 0
+        self.malformed_lines = 0
+        self.last_received_time = None  # time.monotonic() of the last line or frame received
+        self.unknown_sensor_lines = 0
+        self.identity = None  # sensor identifier the gateway micro:bit reported in reply to "idn"
+        self.binary_version = None  # protocol version the gateway reported when it accepted binary framing
+        self.sensor_indices = []  # sensor identifier of every index used in reading frames
+        self.decoder = FrameDecoder()
+        self._stopped = threading.Event()
+        self._loop = None
+        self._data_event = None
+
+    # Only readings from these sensors are kept; buffers of sensors that are still valid are preserved
+    def set_sensors(self, sensor_identifiers):
+        with self.lock:
+            self.buffers = {
+                sensorIdentifier: self.buffers.get(sensorIdentifier) or SensorRingBuffer(self.capacity)
+                for sensorIdentifier in sensor_identifiers
+            }
+
+    def set_sensor_indices(self, sensor_indices):
+        with self.lock:
+            self.sensor_indices = list(sensor_indices)
+
+    # Set the given asyncio event (from the event loop's thread) every time new readings are buffered
+    def notify(self, loop, data_event):
+        self._loop = loop
+        self._data_event = data_event
+
+    def unread_counts(self):
+        with self.lock:
+            return {sensorIdentifier: buffer.unread() for sensorIdentifier, buffer in self.buffers.items()}
+
+    # Take every reading buffered since the previous snapshot
+    def snapshot(self):
+        with self.lock:
+            return {sensorIdentifier: buffer.drain() for sensorIdentifier, buffer in self.buffers.items() if buffer.unread()}
+
+    def buffered_count(self):
+        with self.lock:
+            return sum(buffer.written for buffer in self.buffers.values())
+
+    def overwritten_count(self):
+        with self.lock:
+            return sum(buffer.overwritten for buffer in self.buffers.values())
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set() and self.serial_port.is_open:
+            try:
+                # Blocks until at least one byte arrives (or the port timeout passes), then takes everything waiting
+                data = self.serial_port.read(self.serial_port.in_waiting or 1)
+            except Exception as e:
+                print(f"Error reading from serial port: {e}")
+                break
+            if data:
+                self.feed(data)
+
+    def feed(self, data, timestamp=None):
+        lines, indices, values, frames = self.decoder.feed(data)
+        if not (lines or indices or frames):
+            return
+        timestamp = time.time() if timestamp is None else timestamp
+        self.last_received_time = time.monotonic()
+        stored = False
+        with self.lock:
+            for line in lines:
+                stored = self._store_line(line, timestamp) or stored
+            for index, value in zip(indices, values):
+                stored = self._store_reading(index, value, timestamp) or stored
+            for frame_type, payload in frames:
+                if frame_type == FRAME_HELLO and payload:
+                    self.binary_version = payload[0]
+                    stored = True
+        if stored and self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._data_event.set)
+            except RuntimeError:
+                # The event loop has already shut down; the readings stay buffered
+                pass
+
+    def _store_reading(self, index, value, timestamp):
+        self.lines_received += 1
+        # A NaN or infinite value would stay in the sensor's smoothing for good and cannot be stored
+        if not math.isfinite(value):
+            self.malformed_lines += 1
+            return False
+        buffer = self.buffers.get(self.sensor_indices[index]) if index < len(self.sensor_indices) and self.sensor_indices[index] else None
+        if buffer is None:
+            self.unknown_sensor_lines += 1
+            return False
+        buffer.append(timestamp, value)
+        return True
+
+    def _store_line(self, line, timestamp):
+        self.lines_received += 1
+        sensorIdentifier, separator, raw_value = line.strip().partition(b"|")
+        if not separator:
+            if sensorIdentifier.startswith(b"idn"):
+                self.identity = sensorIdentifier[3:].decode('utf-8', errors='replace')
+                return True
+            self.malformed_lines += 1
+            return False
+        buffer = self.buffers.get(sensorIdentifier.decode('utf-8', errors='replace'))
+        if buffer is None:
+            self.unknown_sensor_lines += 1
+            return False
+        try:
+            value = float(raw_value)
+        except ValueError:
+            self.malformed_lines += 1
+            return False
+        # float() also accepts "nan" and "inf"
+        if not math.isfinite(value):
+            self.malformed_lines += 1
+            return False
+        buffer.append(timestamp, value)
+        return True
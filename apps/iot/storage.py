@@ -0,0 +1,219 @@
+import math
+import sqlite3
+
+# SQLite storage shared by the hub (hub.py) and the camera (camera/camera.py), which both write processor.db.
+# Each process opens the database once and keeps the connection for its lifetime.
+DATABASE_PATH = "processor.db"
+# Time a writer waits for the other process to release its lock instead of failing with "database is locked"
+BUSY_TIMEOUT_MS = 5000
+
+# Name of the outbox cursor that tracks uploads to the backend
+BACKEND_OUTBOX = "backend"
+# Name of the outbox cursor that tracks which rows have been added to the rollups
+ROLLUP_OUTBOX = "rollup"
+# Raw rows handled per transaction by the maintenance task, so the camera is never locked out for long
+MAINTENANCE_CHUNK_ROWS = 5000
+# Free pages returned to the file system per maintenance run
+INCREMENTAL_VACUUM_PAGES = 1000
+
+# Rollup tables and the length of their buckets in milliseconds
+ROLLUP_TABLES = {
+    "readings_1m": 60 * 1000,
+    "readings_1h": 60 * 60 * 1000,
+}
+# Rollup tables of the old schema, whose buckets were readingDate prefixes, with the suffix that completes the timestamp
+LEGACY_ROLLUP_TABLES = {
+    "sensordb_1m": ("readings_1m", ":00"),  # bucket "%Y-%m-%d %H:%M"
+    "sensordb_1h": ("readings_1h", ":00:00"),  # bucket "%Y-%m-%d %H"
+}
+# The old schema's "%Y-%m-%d %H:%M:%S" readingDate was written in Asia/Singapore time, which is UTC+8 all year
+LEGACY_READING_DATE_UTC_OFFSET_SECONDS = 8 * 60 * 60
+
+# Readings are stored as (epoch milliseconds, interned sensor id, REAL) instead of a date string and the full sensor identifier
+INSERT_SENSOR_QUERY = "INSERT OR IGNORE INTO sensors(sensorIdentifier) VALUES (?)"
+INSERT_READING_QUERY = (
+    "INSERT INTO readings(readingTime, sensorId, reading) "
+    "VALUES (?, (SELECT sensorId FROM sensors WHERE sensorIdentifier = ?), ?)"
+)
+
+# Open the database in WAL mode, so readers never block the writer and a commit appends to the WAL instead of
+# rewriting the database file. synchronous=NORMAL syncs the WAL only at checkpoints, i.e. at most one fsync per batch.
+def open_database(path=DATABASE_PATH):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    # Incremental auto vacuum lets the maintenance task give deleted pages back without rewriting the whole file.
+    # Switching an existing database over needs a one-time full VACUUM.
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    create_schema(conn)
+    migrate_legacy_schema(conn)
+    return conn
+
+# Create the tables and their indexes if they don't exist
+def create_schema(conn):
+    with conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS sensors(sensorId INTEGER PRIMARY KEY, sensorIdentifier TEXT NOT NULL UNIQUE)")
+        # readingId is the rowid, so the outbox marks below walk the table's own b-tree
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS readings(readingId INTEGER PRIMARY KEY, readingTime INTEGER NOT NULL, "
+            "sensorId INTEGER NOT NULL, reading REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS readings_sensor_time ON readings(sensorId, readingTime)")
+        # Highest readingId each destination has acknowledged; every row after it is still to be uploaded
+        conn.execute("CREATE TABLE IF NOT EXISTS outbox(destination TEXT PRIMARY KEY, ackedRowid INTEGER NOT NULL)")
+        for table in ROLLUP_TABLES:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table}(sensorId INTEGER NOT NULL, bucketStart INTEGER NOT NULL, minReading REAL, "
+                "maxReading REAL, meanReading REAL, readingCount INTEGER, PRIMARY KEY (sensorId, bucketStart)) WITHOUT ROWID")
+        # Person counts of a camera aggregated over windows of windowSeconds (see camera/aggregation.py)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS person_count_windows(sensorId INTEGER NOT NULL, windowStart INTEGER NOT NULL, "
+            "windowSeconds REAL NOT NULL, maxCount INTEGER, meanCount REAL, p95Count INTEGER, lastCount INTEGER, "
+            "frameCount INTEGER, PRIMARY KEY (sensorId, windowStart)) WITHOUT ROWID")
+
+def table_exists(conn, table):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+# Move the rows of an old sensordb table (and its rollups) into the normalized tables in one transaction.
+# readingIds keep the old rowids, so outbox marks written against sensordb stay valid.
+def migrate_legacy_schema(conn):
+    if not table_exists(conn, "sensordb"):
+        return
+    # Take the write lock first: the camera may be opening the same file and migrating it at the same time
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not table_exists(conn, "sensordb"):
+            conn.rollback()
+            return
+        # A database from before the outbox starts just before its first row that was never sent
+        conn.execute(
+            "INSERT OR IGNORE INTO outbox(destination, ackedRowid) VALUES (?, "
+            "COALESCE((SELECT MIN(rowid) FROM sensordb WHERE sent = 0) - 1, (SELECT MAX(rowid) FROM sensordb), 0))",
+            (BACKEND_OUTBOX,))
+        conn.execute("INSERT OR IGNORE INTO sensors(sensorIdentifier) SELECT DISTINCT sensorIdentifier FROM sensordb WHERE sensorIdentifier IS NOT NULL")
+        # Rows whose readingDate cannot be parsed are dropped
+        conn.execute(
+            "INSERT INTO readings(readingId, readingTime, sensorId, reading) "
+            "SELECT sensordb.rowid, (CAST(strftime('%s', readingDate) AS INTEGER) - ?) * 1000, sensorId, CAST(reading AS REAL) "
+            "FROM sensordb JOIN sensors USING (sensorIdentifier) WHERE strftime('%s', readingDate) IS NOT NULL AND reading IS NOT NULL",
+            (LEGACY_READING_DATE_UTC_OFFSET_SECONDS,))
+        conn.execute("DROP TABLE sensordb")
+        for legacy_table, (table, bucket_suffix) in LEGACY_ROLLUP_TABLES.items():
+            if not table_exists(conn, legacy_table):
+                continue
+            conn.execute(f"INSERT OR IGNORE INTO sensors(sensorIdentifier) SELECT DISTINCT sensorIdentifier FROM {legacy_table}")
+            conn.execute(
+                f"INSERT OR REPLACE INTO {table}(sensorId, bucketStart, minReading, maxReading, meanReading, readingCount) "
+                "SELECT sensorId, (CAST(strftime('%s', bucket || ?) AS INTEGER) - ?) * 1000, minReading, maxReading, meanReading, readingCount "
+                f"FROM {legacy_table} JOIN sensors USING (sensorIdentifier) WHERE strftime('%s', bucket || ?) IS NOT NULL",
+                (bucket_suffix, LEGACY_READING_DATE_UTC_OFFSET_SECONDS, bucket_suffix))
+            conn.execute(f"DROP TABLE {legacy_table}")
+        conn.commit()
+    except:
+        conn.rollback()
+        raise
+    print("Migrated processor.db to the normalized readings schema")
+
+# Insert a batch of (epoch milliseconds, sensorIdentifier, reading) rows in one transaction. Rows with a NaN or infinite
+# reading are dropped, as SQLite would store NaN as NULL and fail the whole batch on the NOT NULL constraint.
+def insert_readings(conn, rows):
+    rows = [row for row in rows if math.isfinite(row[2])]
+    if not rows:
+        return
+    with conn:
+        conn.executemany(INSERT_SENSOR_QUERY, {(row[1],) for row in rows})
+        conn.executemany(INSERT_READING_QUERY, rows)
+
+# Insert a batch of (window start epoch milliseconds, sensorIdentifier, window seconds, max, mean, p95, last, frames)
+# person count windows, and the (epoch milliseconds, sensorIdentifier, reading) rows reported for them, in one transaction
+def insert_count_windows(conn, windows, rows=()):
+    if not windows and not rows:
+        return
+    with conn:
+        conn.executemany(INSERT_SENSOR_QUERY, {(row[1],) for row in [*windows, *rows]})
+        conn.executemany(
+            "INSERT OR REPLACE INTO person_count_windows(windowStart, sensorId, windowSeconds, maxCount, meanCount, p95Count, "
+            "lastCount, frameCount) VALUES (?, (SELECT sensorId FROM sensors WHERE sensorIdentifier = ?), ?, ?, ?, ?, ?, ?)",
+            windows)
+        conn.executemany(INSERT_READING_QUERY, rows)
+
+def get_acked_rowid(conn, destination=BACKEND_OUTBOX):
+    row = conn.execute("SELECT ackedRowid FROM outbox WHERE destination = ?", (destination,)).fetchone()
+    return row[0] if row else 0
+
+# Cursor over up to limit (readingId, epoch milliseconds, sensorIdentifier, reading) rows after the acknowledged readingId, oldest first.
+# This walks the readings b-tree from the mark, so the cost depends on the backlog and not on the size of the table.
+def iter_unsent_readings(conn, limit, destination=BACKEND_OUTBOX):
+    return conn.execute(
+        "SELECT readingId, readingTime, sensorIdentifier, reading FROM readings JOIN sensors USING (sensorId) "
+        "WHERE readingId > ? ORDER BY readingId LIMIT ?",
+        (get_acked_rowid(conn, destination), limit))
+
+def fetch_unsent_readings(conn, limit, destination=BACKEND_OUTBOX):
+    return iter_unsent_readings(conn, limit, destination).fetchall()
+
+# Cursor over (sensorIdentifier, epoch milliseconds, reading) of the readings with start < readingId <= end, with every
+# sensor's readings together (oldest first) and the sensors in the order of their first reading
+def iter_readings_by_sensor(conn, start, end):
+    return conn.execute(
+        "SELECT sensorIdentifier, readingTime, reading FROM readings JOIN sensors USING (sensorId) "
+        "WHERE readingId > ? AND readingId <= ? ORDER BY MIN(readingId) OVER (PARTITION BY sensorId), readingId",
+        (start, end))
+
+# Move the acknowledged mark up to readingId once the rows up to it have been accepted by the destination.
+# Rows inserted after they were fetched have higher readingIds and stay unsent.
+def acknowledge_readings(conn, readingId, destination=BACKEND_OUTBOX):
+    with conn:
+        conn.execute(
+            "INSERT INTO outbox(destination, ackedRowid) VALUES (?, ?) "
+            "ON CONFLICT(destination) DO UPDATE SET ackedRowid = MAX(ackedRowid, excluded.ackedRowid)",
+            (destination, readingId))
+
+# Fold the raw rows that are not in the rollups yet into the per-sensor 1 minute and 1 hour rollups
+def update_rollups(conn):
+    while True:
+        with conn:
+            start = get_acked_rowid(conn, ROLLUP_OUTBOX)
+            end = conn.execute("SELECT MAX(readingId) FROM (SELECT readingId FROM readings WHERE readingId > ? ORDER BY readingId LIMIT ?)",
+                               (start, MAINTENANCE_CHUNK_ROWS)).fetchone()[0]
+            if end is None:
+                return
+            for table, bucket_length in ROLLUP_TABLES.items():
+                # "WHERE true" keeps SQLite from reading ON CONFLICT as part of the SELECT
+                conn.execute(
+                    f"INSERT INTO {table}(sensorId, bucketStart, minReading, maxReading, meanReading, readingCount) "
+                    "SELECT sensorId, readingTime - readingTime % ?, MIN(reading), MAX(reading), AVG(reading), COUNT(*) "
+                    "FROM readings WHERE readingId > ? AND readingId <= ? AND true GROUP BY 1, 2 "
+                    "ON CONFLICT(sensorId, bucketStart) DO UPDATE SET "
+                    "minReading = MIN(minReading, excluded.minReading), "
+                    "maxReading = MAX(maxReading, excluded.maxReading), "
+                    "meanReading = (meanReading * readingCount + excluded.meanReading * excluded.readingCount) / (readingCount + excluded.readingCount), "
+                    "readingCount = readingCount + excluded.readingCount",
+                    (bucket_length, start, end))
+            conn.execute(
+                "INSERT INTO outbox(destination, ackedRowid) VALUES (?, ?) ON CONFLICT(destination) DO UPDATE SET ackedRowid = excluded.ackedRowid",
+                (ROLLUP_OUTBOX, end))
+
+# Delete raw rows from before cutoff (epoch milliseconds) that have been both uploaded and rolled up, and return how many were deleted.
+# The newest row is always kept so SQLite never hands out a readingId at or below the outbox marks again.
+def delete_expired_readings(conn, cutoff):
+    deleted = 0
+    acked_rowid = min(get_acked_rowid(conn, BACKEND_OUTBOX), get_acked_rowid(conn, ROLLUP_OUTBOX))
+    upper = min(acked_rowid, conn.execute("SELECT IFNULL(MAX(readingId), 0) FROM readings").fetchone()[0] - 1)
+    lower = conn.execute("SELECT IFNULL(MIN(readingId), 1) FROM readings").fetchone()[0] - 1
+    while lower < upper:
+        end = min(lower + MAINTENANCE_CHUNK_ROWS, upper)
+        with conn:
+            deleted += conn.execute("DELETE FROM readings WHERE readingId > ? AND readingId <= ? AND readingTime < ?", (lower, end, cutoff)).rowcount
+        lower = end
+    return deleted
+
+# Update the rollups, apply the raw row retention and give free pages back to the SD card
+def maintain_database(conn, cutoff):
+    update_rollups(conn)
+    deleted = delete_expired_readings(conn, cutoff)
+    # incremental_vacuum frees one page per returned row, so every row has to be fetched
+    conn.execute(f"PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})").fetchall()
+    return deleted
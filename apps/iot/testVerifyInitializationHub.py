@@ -1,6 +1,7 @@
 import requests
 import os
 from dotenv import load_dotenv
+from backend_client import BackendClient
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,9 +13,10 @@ print(HUB_IDENTIFIER_NO)
 
 # Backend URL
 BASE_URL = f'http://{IP_ADDRESS}:3333/api'  # Replace with your actual backend URL
+backend = BackendClient(BASE_URL)
 
 def test_verify_hub_initialization():
-    endpoint = f"{BASE_URL}/hubs/verifyHubInitialization"
+    endpoint = "/hubs/verifyHubInitialization"
     
     # Prepare the payload
     payload = {
@@ -23,7 +25,7 @@ def test_verify_hub_initialization():
     
     try:
         # Send POST request to the endpoint
-        response = requests.put(endpoint, json=payload, timeout=5)
+        response = backend.put(endpoint, json=payload)
         
         # Check the response
         if response.status_code == 200:
@@ -39,6 +41,8 @@ def test_verify_hub_initialization():
         
     except requests.exceptions.RequestException as e:
         print(f"An error occurred: {e}")
+    finally:
+        print(f"Backend requests: {backend.stats()}")
     
     return None
 
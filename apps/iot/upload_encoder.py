@@ -0,0 +1,120 @@
+import hashlib
+import zlib
+from json.encoder import encode_basestring_ascii
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# "json" writes the payload exactly like json.dumps; "orjson" (if installed) writes compact JSON faster.
+# The backend hashes the payload string it receives, so both pass its sha256 check.
+JSON_BACKENDS = ("json", "orjson")
+# Payload characters collected before they are hashed, escaped and compressed
+FLUSH_CHARACTERS = 16 * 1024
+# Readings serialised per orjson call
+ORJSON_BATCH_ROWS = 256
+
+# Same output as json.dumps for a reading's date or value
+def encode_json_value(value):
+    if isinstance(value, float):
+        if value != value:
+            return "NaN"
+        if value in (float("inf"), float("-inf")):
+            return "Infinity" if value > 0 else "-Infinity"
+        return float.__repr__(value)
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if value is None:
+        return "null"
+    return encode_basestring_ascii(value)
+
+# Writes an upload request body straight from rows that arrive grouped by sensor, without building the payload dict,
+# the payload string or the request body in memory. The payload
+#   {"<sensorIdentifier>": [{"readingDate": ..., "reading": ...}, ...], ...}
+# is hashed together with the token as it is written, escaped into the {"jsonPayloadString": ..., "sha256": ...} body
+# and gzip-compressed on the fly. The buffers are reused between requests.
+class UploadEncoder:
+    def __init__(self, token, json_backend="json", compress_level=6):
+        if json_backend not in JSON_BACKENDS:
+            raise ValueError(f"Unknown JSON backend '{json_backend}', expected one of: {', '.join(JSON_BACKENDS)}")
+        if json_backend == "orjson" and orjson is None:
+            raise ValueError("The orjson JSON backend is not installed (pip install orjson)")
+        self.token = token.encode()
+        self.json_backend = json_backend
+        self.compress_level = compress_level
+        self._pending = []  # payload fragments not hashed and compressed yet
+        self._pending_characters = 0
+        self._output = bytearray()
+        self._hash = None
+        self._compressor = None
+
+    # Encode rows of (sensorIdentifier, readingDate, reading) and return (gzip-compressed request body, number of readings)
+    def encode(self, grouped_rows):
+        self._pending.clear()
+        self._pending_characters = 0
+        self._output.clear()
+        self._hash = hashlib.sha256()
+        self._compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        self._output += self._compressor.compress(b'{"jsonPayloadString": "')
+        if self.json_backend == "orjson":
+            count = self._write_orjson_payload(grouped_rows)
+        else:
+            count = self._write_json_payload(grouped_rows)
+        self._flush()
+        self._hash.update(self.token)
+        self._output += self._compressor.compress(f'", "sha256": "{self._hash.hexdigest()}"}}'.encode())
+        self._output += self._compressor.flush()
+        return bytes(self._output), count
+
+    def _write(self, fragment):
+        self._pending.append(fragment)
+        self._pending_characters += len(fragment)
+        if self._pending_characters >= FLUSH_CHARACTERS:
+            self._flush()
+
+    def _flush(self):
+        payload = "".join(self._pending)
+        self._pending.clear()
+        self._pending_characters = 0
+        self._hash.update(payload.encode())
+        # Escaping the payload piece by piece gives the same result as escaping the whole string, as json.dumps does
+        self._output += self._compressor.compress(encode_basestring_ascii(payload)[1:-1].encode())
+
+    def _write_json_payload(self, grouped_rows):
+        count = 0
+        current_sensor = None
+        self._write("{")
+        for sensorIdentifier, readingDate, reading in grouped_rows:
+            if sensorIdentifier != current_sensor:
+                self._write(("], " if current_sensor is not None else "") + encode_basestring_ascii(sensorIdentifier) + ": [")
+                current_sensor = sensorIdentifier
+            else:
+                self._write(", ")
+            self._write('{"readingDate": ' + encode_json_value(readingDate) + ', "reading": ' + encode_json_value(reading) + "}")
+            count += 1
+        self._write("]}" if current_sensor is not None else "}")
+        return count
+
+    def _write_orjson_payload(self, grouped_rows):
+        count = 0
+        current_sensor = None
+        batch = []
+        self._write("{")
+        for sensorIdentifier, readingDate, reading in grouped_rows:
+            if sensorIdentifier != current_sensor or len(batch) == ORJSON_BATCH_ROWS:
+                if batch:
+                    self._write(orjson.dumps(batch).decode()[1:-1])
+                    batch.clear()
+                if sensorIdentifier != current_sensor:
+                    self._write(("]," if current_sensor is not None else "") + orjson.dumps(sensorIdentifier).decode() + ":[")
+                    current_sensor = sensorIdentifier
+                else:
+                    self._write(",")
+            batch.append({"readingDate": readingDate, "reading": reading})
+            count += 1
+        if batch:
+            self._write(orjson.dumps(batch).decode()[1:-1])
+        self._write("]}" if current_sensor is not None else "}")
+        return count
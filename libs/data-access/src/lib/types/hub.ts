@@ -4,6 +4,12 @@ import { ZoneResponse } from './zone';
 import { HubStatusEnum } from './sharedEnums';
 import { SensorResponse } from './sensor';
 
+export interface HubPollingInterval {
+  minIntervalSeconds?: number;
+  maxIntervalSeconds?: number;
+  changeThreshold?: number;
+}
+
 export interface HubData {
   name: string;
   serialNumber: string;
@@ -13,6 +19,7 @@ export interface HubData {
   nextMaintenanceDate?: string;
   nextMaintenanceDates?: string[];
   dataTransmissionInterval?: number;
+  pollingConfig?: Record<string, HubPollingInterval>;
   supplier: string;
   supplierContactNumber: string;
   ipAddress?: string;
@@ -39,6 +46,7 @@ export interface HubResponse {
   nextMaintenanceDate?: string;
   nextMaintenanceDates?: string[];
   dataTransmissionInterval?: number;
+  pollingConfig?: Record<string, HubPollingInterval>;
   supplier: string;
   supplierContactNumber: string;
   ipAddress?: string;
@@ -67,6 +75,7 @@ export interface HubUpdateData {
   nextMaintenanceDate?: string;
   nextMaintenanceDates?: string[];
   dataTransmissionInterval?: number;
+  pollingConfig?: Record<string, HubPollingInterval>;
   supplier?: string;
   supplierContactNumber?: string;
   ipAddress?: string;
@@ -0,0 +1,2 @@
+-- AlterTable
+ALTER TABLE "Hub" ADD COLUMN     "pollingConfig" JSONB;